@@ -0,0 +1,358 @@
+"""Benchmark suite for the email rendering, MIME and Sheets hot paths.
+
+Run with ``python benchmarks/suite.py``. Save the results with ``--output``, and
+compare them against results saved earlier with ``--baseline``, which exits with a
+non-zero status if any benchmark got slower than ``--tolerance`` allows.
+
+No baseline is kept in the repository, since timings depend on the machine. Save one
+from the commit to compare against, e.g. ``python benchmarks/suite.py -o
+baseline.json``, then run the suite with ``-b baseline.json`` after the change.
+
+Pairs of benchmarks compare implementations: ``get_message`` against the
+``serialize_message`` MIME writer, ``render_message`` with and without
+``.precompiled`` HTML and ``render_values.wide`` against evaluating each column
+separately in ``.per_column``.
+"""
+import argparse
+import json
+import platform
+import re
+import sys
+import timeit
+from collections.abc import Callable, Mapping
+from pathlib import Path
+from typing import Any
+
+from jinja2 import ChainableUndefined
+from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+from oes.webhooks.email.html import process_html
+from oes.webhooks.email.mime import serialize_message
+from oes.webhooks.email.template import (
+    Attachments,
+    Subject,
+    get_environment,
+    render_message,
+)
+from oes.webhooks.email.types import (
+    Attachment,
+    AttachmentType,
+    Email,
+    EmailHookBody,
+    encode_base64,
+)
+from oes.webhooks.serialization import converter
+from oes.webhooks.settings import GoogleSheetsHook
+from oes.webhooks.sheets.hooks import render_values
+
+TEMPLATE_PATH = Path(__file__).parent.parent / "templates" / "email"
+
+DATE = "Mon, 02 Jan 2023 03:04:05 +0000"
+
+REGISTRATIONS = 5
+LINE_ITEMS = 4
+SHEETS_COLUMNS = 40
+
+
+def _make_checkout(registrations: int, line_items: int) -> dict[str, Any]:
+    """Make a ``checkout.closed`` body for a cart of several registrations."""
+    return {
+        "id": "c9d5e2b0a1f34c6d",
+        "receipt_id": "ABC123XYZ",
+        "service": "stripe",
+        "external_id": "pi_3NQx0k2eZvKYlo2C1tZ8Lr5W",
+        "date_created": "2023-07-01T12:00:00+00:00",
+        "date_closed": "2023-07-01T12:01:30+00:00",
+        "cart_data": {
+            "event_id": "example-event",
+            "meta": {"email": "buyer@example.net"},
+            "registrations": [
+                {
+                    "id": f"reg-{i}",
+                    "old_data": {"version": 1},
+                    "new_data": {
+                        "version": 2,
+                        "email": f"attendee{i}@example.net",
+                        "first_name": f"First{i}",
+                        "last_name": f"Last{i}",
+                        "preferred_name": f"Nick{i}",
+                        "birth_date": "1990-01-01",
+                        "level": "standard",
+                        "options": [f"option-{j}" for j in range(line_items)],
+                    },
+                }
+                for i in range(registrations)
+            ],
+        },
+        "pricing_result": {
+            "currency": "USD",
+            "registrations": [
+                {
+                    "id": f"reg-{i}",
+                    "line_items": [
+                        {
+                            "price": 2500,
+                            "total_price": 2000,
+                            "name": f"Item {j}",
+                            "description": f"Line item {j}",
+                            "modifiers": [
+                                {"amount": -500, "name": "Early bird discount"}
+                            ],
+                        }
+                        for j in range(line_items)
+                    ],
+                }
+                for i in range(registrations)
+            ],
+            "total_price": 2000 * registrations * line_items,
+        },
+    }
+
+
+CHECKOUT = _make_checkout(REGISTRATIONS, LINE_ITEMS)
+
+RENDER_DATA = {
+    "code": {"to": "attendee@example.net", "code": "123456"},
+    "receipt": {
+        "to": "buyer@example.net",
+        "subject": "Order Confirmation",
+        "checkout": CHECKOUT,
+    },
+}
+
+_attachment_data = bytes(range(256)) * 256
+
+EMAIL = Email(
+    to="Test User <to@test.com>",
+    from_="Example <from@test.com>",
+    subject="Your registration receipt",
+    text="Thank you for registering.\n" * 20,
+    html="<p>Thank you for registering.</p>" * 20,
+)
+
+EMAIL_WITH_ATTACHMENTS = Email(
+    to=EMAIL.to,
+    from_=EMAIL.from_,
+    subject=EMAIL.subject,
+    text=EMAIL.text,
+    html=EMAIL.html,
+    attachments=(
+        Attachment(
+            id="logo",
+            name="logo.png",
+            data=_attachment_data,
+            encoded=encode_base64(_attachment_data),
+            media_type="image/png",
+            attachment_type=AttachmentType.inline,
+        ),
+        Attachment(
+            id="receipt",
+            name="receipt.pdf",
+            data=_attachment_data,
+            encoded=encode_base64(_attachment_data),
+            media_type="application/pdf",
+        ),
+    ),
+)
+
+SHEETS_HOOK = GoogleSheetsHook(
+    id="registrations",
+    sheet_id="sheet",
+    values=tuple(
+        f'registration.new_data.field_{i} | default("none")'
+        for i in range(SHEETS_COLUMNS)
+    ),
+)
+
+SHEETS_DATA = {
+    "registration": {
+        "new_data": {f"field_{i}": f"value {i}" for i in range(0, SHEETS_COLUMNS, 2)}
+    }
+}
+
+
+def _render_message(template_name: str, precompile_html: bool) -> Callable[[], Any]:
+    env = get_environment(TEMPLATE_PATH, precompile_html)
+    data = RENDER_DATA[template_name]
+
+    def render():
+        subject = Subject(data.get("subject"))
+        attachments = Attachments(TEMPLATE_PATH)
+        return render_message(env, subject, attachments, template_name, data)
+
+    return render
+
+
+def _process_html() -> Callable[[], Any]:
+    _, html = _render_message("receipt", False)()
+    return lambda: process_html(html)
+
+
+def _get_message(email: Email) -> Callable[[], Any]:
+    def get_message():
+        msg = email.get_message()
+        msg.add_header("Date", DATE)
+        return bytes(msg)
+
+    return get_message
+
+
+def _serialize_message(email: Email) -> Callable[[], Any]:
+    return lambda: serialize_message(email, DATE)
+
+
+def _structure_hook_body() -> Callable[[], Any]:
+    body = RENDER_DATA["receipt"]
+    return lambda: converter.structure(body, EmailHookBody)
+
+
+def _render_values() -> Callable[[], Any]:
+    return lambda: render_values(SHEETS_HOOK, SHEETS_DATA)
+
+
+def _render_values_per_column() -> Callable[[], Any]:
+    env = ImmutableSandboxedEnvironment(undefined=ChainableUndefined)
+    expressions = [env.compile_expression(v) for v in SHEETS_HOOK.values]
+
+    def render():
+        values = (e(SHEETS_DATA) for e in expressions)
+        return [str(v) if v is not None else "" for v in values]
+
+    assert render() == list(render_values(SHEETS_HOOK, SHEETS_DATA))
+    return render
+
+
+BENCHMARKS: Mapping[str, Callable[[], Callable[[], Any]]] = {
+    "render_message.code": lambda: _render_message("code", False),
+    "render_message.code.precompiled": lambda: _render_message("code", True),
+    "render_message.receipt": lambda: _render_message("receipt", False),
+    "render_message.receipt.precompiled": lambda: _render_message("receipt", True),
+    "process_html.receipt": _process_html,
+    "get_message": lambda: _get_message(EMAIL),
+    "get_message.attachments": lambda: _get_message(EMAIL_WITH_ATTACHMENTS),
+    "serialize_message": lambda: _serialize_message(EMAIL),
+    "serialize_message.attachments": lambda: _serialize_message(EMAIL_WITH_ATTACHMENTS),
+    "structure.email_hook_body": _structure_hook_body,
+    "render_values.wide": _render_values,
+    "render_values.wide.per_column": _render_values_per_column,
+}
+"""Benchmark names and functions returning the function to time."""
+
+
+def run_benchmark(
+    func: Callable[[], Any], min_time: float = 0.2, repeat: int = 5
+) -> dict[str, Any]:
+    """Time a function.
+
+    The number of calls per repeat is chosen so a repeat takes at least
+    ``min_time`` seconds.
+
+    Returns:
+        The ``number`` of calls per repeat, and the ``min`` and ``mean`` time per call
+        over the repeats, in seconds.
+    """
+    func()
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {"number": number, "min": min(times), "mean": sum(times) / len(times)}
+
+
+def run_suite(
+    pattern: str = "", min_time: float = 0.2, repeat: int = 5
+) -> dict[str, dict[str, Any]]:
+    """Run the benchmarks whose names match ``pattern``."""
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if pattern and not re.search(pattern, name):
+            continue
+        results[name] = run_benchmark(setup(), min_time, repeat)
+        print(f"{name:<40} {results[name]['min'] * 1e6:>10.1f} us", file=sys.stderr)
+    return results
+
+
+def compare(
+    results: Mapping[str, Mapping[str, Any]],
+    baseline: Mapping[str, Mapping[str, Any]],
+    tolerance: float,
+) -> list[str]:
+    """Compare results against a baseline.
+
+    Returns:
+        The names of the benchmarks more than ``tolerance`` slower than the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<40} {'(new)':>10}")
+            continue
+
+        ratio = result["min"] / base["min"]
+        regressed = ratio > 1 + tolerance
+        marker = "  REGRESSION" if regressed else ""
+        print(f"{name:<40} {ratio:>9.2f}x{marker}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line args."""
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument(
+        "-k", "--filter", default="", help="only run benchmarks matching a regex"
+    )
+    parser.add_argument(
+        "-o", "--output", type=Path, help="path to save the results as JSON"
+    )
+    parser.add_argument(
+        "-b", "--baseline", type=Path, help="path to results to compare against"
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed slowdown against the baseline, as a fraction",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="minimum time for each repeat, in seconds",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="number of repeats per benchmark"
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    """Run the suite."""
+    args = parse_args()
+    results = run_suite(args.filter, args.min_time, args.repeat)
+
+    if args.output:
+        doc = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        args.output.write_text(json.dumps(doc, indent=2) + "\n")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(
+                f"{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}"
+            )
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
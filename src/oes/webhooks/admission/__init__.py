@@ -0,0 +1,132 @@
+"""Admission control module."""
+import asyncio
+import contextlib
+import functools
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any, Optional, TypeVar
+
+from quart import current_app
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+from oes.webhooks import metrics
+from oes.webhooks.settings import LimitSettings
+
+_F = TypeVar("_F", bound=Callable[..., Awaitable])
+
+
+class AdmissionLimiter:
+    """Limits the number of requests handled at once.
+
+    Requests over the concurrency limit wait in a bounded queue. A request is
+    rejected with ``429 Too Many Requests`` if the queue is full, or
+    ``503 Service Unavailable`` if it waited longer than the queue timeout.
+    """
+
+    def __init__(self, name: str, settings: LimitSettings, retry_after: int = 1):
+        """Create an :class:`AdmissionLimiter`.
+
+        Args:
+            name: The limit name, for metrics.
+            settings: The limit settings.
+            retry_after: The ``Retry-After`` value of rejections, in seconds.
+        """
+        self.name = name
+        self.concurrency = max(settings.concurrency, 1)
+        self.max_queue = max(settings.queue, 0)
+        self.queue_timeout = settings.queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    @contextlib.asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """Hold a slot while handling a request.
+
+        Raises:
+            TooManyRequests: If the queue is full.
+            ServiceUnavailable: If the request waited too long.
+        """
+        if not self._semaphore.locked():
+            # does not wait
+            await self._semaphore.acquire()
+        elif self.queued >= self.max_queue:
+            self._reject(429)
+            raise TooManyRequests(retry_after=self.retry_after)
+        else:
+            self._set_queued(1)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject(503)
+                raise ServiceUnavailable(retry_after=self.retry_after)
+            finally:
+                self._set_queued(-1)
+
+        self._set_in_flight(1)
+        try:
+            yield
+        finally:
+            self._set_in_flight(-1)
+            self._semaphore.release()
+
+    def stats(self) -> dict[str, int]:
+        """Get the limit statistics."""
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+        }
+
+    def _set_queued(self, delta: int):
+        self.queued += delta
+        metrics.ADMISSION_QUEUED.labels(self.name).inc(delta)
+
+    def _set_in_flight(self, delta: int):
+        self.in_flight += delta
+        metrics.ADMISSION_IN_FLIGHT.labels(self.name).inc(delta)
+
+    def _reject(self, status: int):
+        self.rejected += 1
+        metrics.ADMISSION_REJECTED.labels(self.name, str(status)).inc()
+
+
+def get_limiter(name: str) -> Optional[AdmissionLimiter]:
+    """Get the limiter with a name, if that limit is configured."""
+    limiters: dict[str, AdmissionLimiter] = current_app.config.get(
+        "admission_limiters", {}
+    )
+    return limiters.get(name)
+
+
+@contextlib.asynccontextmanager
+async def limit(name: str) -> AsyncIterator[None]:
+    """Hold a slot of the named limit, if it is configured.
+
+    Raises:
+        TooManyRequests: If the queue is full.
+        ServiceUnavailable: If the request waited too long.
+    """
+    limiter = get_limiter(name)
+    if limiter is None:
+        yield
+    else:
+        async with limiter.admit():
+            yield
+
+
+def admitted(name: str) -> Callable[[_F], _F]:
+    """Apply the named limit to a view."""
+
+    def decorator(func: _F) -> _F:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            async with limit(name):
+                return await func(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
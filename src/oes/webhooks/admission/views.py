@@ -0,0 +1,26 @@
+"""Admission control views."""
+import attrs
+from quart import Response, jsonify
+
+from oes.webhooks.admission import AdmissionLimiter
+from oes.webhooks.app import app
+from oes.webhooks.settings import LimitSettings, Settings
+
+
+@app.get("/admission")
+async def admission_stats() -> Response:
+    """Get the in-flight, queued and rejected request counts for each limit."""
+    limiters: dict[str, AdmissionLimiter] = app.config.get("admission_limiters", {})
+    return jsonify({name: limiter.stats() for name, limiter in limiters.items()})
+
+
+@app.before_serving
+async def start_admission_limiters():
+    """Create the configured limiters."""
+    settings: Settings = app.config["settings"]
+    limits = settings.limits
+    app.config["admission_limiters"] = {
+        name: AdmissionLimiter(name, value, limits.retry_after)
+        for name, value in attrs.asdict(limits, recurse=False).items()
+        if isinstance(value, LimitSettings)
+    }
@@ -1,66 +1,208 @@
 """App module."""
 import argparse
-import contextlib
+import importlib
+import importlib.util
+import json
 import logging
+import os
+import shutil
+import tempfile
 from pathlib import Path
+from typing import Optional
 
 import uvicorn
+from attrs import frozen
 from loguru import logger
+from prometheus_client.multiprocess import mark_process_dead
 from quart import Quart
 
+from oes.webhooks.email.cache import attachment_cache
 from oes.webhooks.email.template import get_environment
 from oes.webhooks.log import setup_logging
-from oes.webhooks.settings import Settings, load_settings
+from oes.webhooks.metrics import MULTIPROC_DIR_ENV, is_multiprocess
+from oes.webhooks.serialization import ORJSONProvider
+from oes.webhooks.settings import Settings, SheetsClientType, load_settings
+from oes.webhooks.sheets.hooks import SheetsHookRegistry
+from oes.webhooks.startup import StartupProfile, profile_serving
 
 app = Quart(__name__)
+app.json = ORJSONProvider(app)
+
+STARTUP_OPTIONS_ENV = "OES_WEBHOOKS_STARTUP_OPTIONS"
+"""The environment variable with the options passed to the workers, as JSON."""
+
+VIEW_MODULES = (
+    "oes.webhooks.admission.views",
+    "oes.webhooks.email.views",
+    "oes.webhooks.idempotency.views",
+    "oes.webhooks.metrics.views",
+    "oes.webhooks.receipt.views",
+    "oes.webhooks.sheets.views",
+)
+"""The modules registering the app's views."""
+
+
+@frozen
+class StartupOptions:
+    """The command line options passed to the workers."""
+
+    config: Optional[Path] = None
+    debug: bool = False
+    profile_startup: bool = False
 
 
 def run():
     """Main entry point."""
-    args = parse_args()
-    settings = load_settings(args.config)
-    setup_logging(args.debug)
+    profile = StartupProfile("Main process")
+    with profile.step("parse args"):
+        args = parse_args()
+    with profile.step("load settings"):
+        settings = load_settings(args.config)
+    with profile.step("set up logging"):
+        setup_logging(args.debug, settings.log)
+
+    metrics_dir = _setup_multiprocess_metrics() if args.workers > 1 else None
+
+    # the workers load the settings again, so secrets are not written anywhere
+    _save_startup_options(
+        StartupOptions(
+            args.config.resolve() if args.config is not None else None,
+            args.debug,
+            args.profile_startup,
+        )
+    )
+
+    if args.profile_startup:
+        logger.info(profile.report())
 
     log_startup_summary(settings)
-    uvicorn.run(
-        "oes.webhooks.app:_get_app",
-        factory=True,
-        workers=args.workers,
-        reload=args.reload,
-        host=args.bind,
-        port=args.port,
-        log_level=logging.DEBUG if args.debug else None,
-        log_config=None,
+    try:
+        uvicorn.run(
+            "oes.webhooks.app:_get_app",
+            factory=True,
+            workers=args.workers,
+            reload=args.reload,
+            host=args.bind,
+            port=args.port,
+            log_level=logging.DEBUG if args.debug else None,
+            log_config=None,
+        )
+    finally:
+        if metrics_dir is not None:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def _setup_multiprocess_metrics() -> Optional[str]:
+    """Have the workers record metrics to a shared directory.
+
+    Returns:
+        The path of the directory, if it was created.
+    """
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        return None
+
+    path = tempfile.mkdtemp(prefix="oes-webhooks-metrics-")
+    os.environ[MULTIPROC_DIR_ENV] = path
+    return path
+
+
+async def _mark_process_dead():
+    """Remove the worker's live gauge values from the shared metrics."""
+    mark_process_dead(os.getpid())
+
+
+def _save_startup_options(options: StartupOptions):
+    """Pass the startup options to the workers in the environment."""
+    os.environ[STARTUP_OPTIONS_ENV] = json.dumps(
+        {
+            "config": str(options.config) if options.config is not None else None,
+            "debug": options.debug,
+            "profile_startup": options.profile_startup,
+        }
+    )
+
+
+def _load_startup_options() -> StartupOptions:
+    """Get the startup options from the main process, or the command line."""
+    value = os.environ.get(STARTUP_OPTIONS_ENV)
+    if not value:
+        args = parse_args()
+        return StartupOptions(args.config, args.debug, args.profile_startup)
+
+    options = json.loads(value)
+    config = options.get("config")
+    return StartupOptions(
+        Path(config) if config is not None else None,
+        bool(options.get("debug")),
+        bool(options.get("profile_startup")),
     )
 
 
 def _get_app():
-    args = parse_args()
-    settings = load_settings(args.config)
-    setup_logging(args.debug)
-    return configure_app(settings)
+    profile = StartupProfile("Worker")
+    with profile.step("load settings"):
+        options = _load_startup_options()
+        settings = load_settings(options.config)
+    with profile.step("set up logging"):
+        setup_logging(options.debug, settings.log)
+    configure_app(settings, profile)
+    if options.profile_startup:
+        profile_serving(app, profile)
+    return app
 
 
-def configure_app(settings):
+def configure_app(
+    settings: Settings, profile: Optional[StartupProfile] = None
+) -> Quart:
     """Configure and return the app."""
+    if profile is None:
+        profile = StartupProfile("App")
+
     app.config["settings"] = settings
-    app.config["email_template_env"] = get_environment(settings.email.template_path)
+    with profile.step("create template environment"):
+        app.config["email_template_env"] = get_environment(
+            settings.email.template_path,
+            settings.email.precompile_html,
+            settings.email.fragment_cache_size,
+            auto_reload=not settings.email.watch_templates,
+        )
+    attachment_cache.max_size = settings.email.attachment_cache_size
+    attachment_cache.stream_size = settings.email.attachment_stream_size
+    attachment_cache.check_mtime = not settings.email.watch_templates
+    with profile.step("create sheets hooks"):
+        app.config["sheets_hooks"] = SheetsHookRegistry(settings.google.sheets_hooks)
 
-    with contextlib.suppress(ImportError):
-        from oes.webhooks.sheets.client import GoogleSheetsClient
+    if (
+        settings.google.service_account_credentials
+        and settings.google.sheets_client == SheetsClientType.discovery
+    ):
+        with profile.step("create sheets client"):
+            _configure_sheets_client(settings)
 
-        if settings.google.service_account_credentials:
-            app.config["sheets_client"] = GoogleSheetsClient(
-                settings.google.service_account_credentials
-            )
+    for module in VIEW_MODULES:
+        with profile.step(f"import {module.removeprefix('oes.webhooks.')}"):
+            importlib.import_module(module)
 
-    import oes.webhooks.email.views  # noqa
-    import oes.webhooks.receipt.views  # noqa
-    import oes.webhooks.sheets.views  # noqa
+    # after the views' shutdown functions, which may still update gauges
+    if is_multiprocess() and _mark_process_dead not in app.after_serving_funcs:
+        app.after_serving(_mark_process_dead)
 
     return app
 
 
+def _configure_sheets_client(settings: Settings):
+    """Create the Sheets client, which loads the Google API libraries on first use."""
+    if importlib.util.find_spec("googleapiclient") is None:
+        logger.error("google-api-python-client is required for the Sheets client")
+        return
+
+    from oes.webhooks.sheets.client import GoogleSheetsClient
+
+    app.config["sheets_client"] = GoogleSheetsClient(
+        settings.google.service_account_credentials
+    )
+
+
 def log_startup_summary(settings: Settings):
     """Print startup information to the logger."""
     features = {
@@ -111,5 +253,11 @@ def parse_args():
         action="store_true",
         help="reload on changes for development",
     )
+    parser.add_argument(
+        "--profile-startup",
+        default=False,
+        action="store_true",
+        help="log the time taken by each startup step",
+    )
 
     return parser.parse_args()
@@ -0,0 +1,143 @@
+"""Attachment cache module."""
+import mmap
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from attrs import frozen
+
+from oes.webhooks.email.types import encode_base64
+
+MMAP_THRESHOLD = 1024 * 1024
+"""Files at least this large are memory-mapped to be encoded, instead of read."""
+
+STREAM_THRESHOLD = 4 * 1024 * 1024
+"""The default size of files streamed from disk instead of cached."""
+
+
+@frozen(kw_only=True)
+class CachedFile:
+    """A cached attachment file."""
+
+    path: Path
+    """The resolved path."""
+
+    mtime_ns: int
+    """The modification time when the file was read."""
+
+    encoded: str
+    """The base64 encoded contents."""
+
+    @property
+    def size(self) -> int:
+        """The memory accounted for this entry."""
+        return len(self.encoded)
+
+
+class AttachmentCache:
+    """Process-wide LRU cache of attachment files and their encoded contents.
+
+    Entries are keyed by resolved path and modification time, so a changed file is
+    read again. Only the encoded contents are kept, so entries can be removed while
+    messages using them are still being serialized.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 64 * 1024 * 1024,
+        check_mtime: bool = True,
+        stream_size: int = STREAM_THRESHOLD,
+    ):
+        """Create an :class:`AttachmentCache`.
+
+        Args:
+            max_size: The maximum total size of cached entries, in bytes.
+            check_mtime: Whether to check the modification time of a cached file
+                each time it is used. If not, changed files must be invalidated.
+            stream_size: Files at least this large are not cached, and are read
+                from disk each time a message is serialized.
+        """
+        self._max_size = max_size
+        self.check_mtime = check_mtime
+        self.stream_size = stream_size
+        self._size = 0
+        self._entries: OrderedDict[Path, CachedFile] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self) -> int:
+        """The maximum total size of cached entries, in bytes."""
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, value: int):
+        with self._lock:
+            self._max_size = value
+            self._evict()
+
+    def get(self, path: Path) -> CachedFile:
+        """Get the cached contents of a file, reading it if necessary."""
+        resolved = path.resolve()
+        if not self.check_mtime:
+            with self._lock:
+                entry = self._entries.get(resolved)
+                if entry is not None:
+                    self._entries.move_to_end(resolved)
+                    return entry
+
+        mtime_ns = resolved.stat().st_mtime_ns
+
+        with self._lock:
+            entry = self._entries.get(resolved)
+            if entry is not None and entry.mtime_ns == mtime_ns:
+                self._entries.move_to_end(resolved)
+                return entry
+
+        entry = _read_file(resolved, mtime_ns)
+
+        with self._lock:
+            self._remove(resolved)
+            if entry.size <= self._max_size:
+                self._entries[resolved] = entry
+                self._size += entry.size
+                self._evict()
+
+        return entry
+
+    def invalidate(self, path: Path):
+        """Remove a file from the cache."""
+        with self._lock:
+            self._remove(path.resolve())
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, path: Path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def _evict(self):
+        while self._size > self._max_size and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+
+
+def _read_file(path: Path, mtime_ns: int) -> CachedFile:
+    with path.open("rb") as f:
+        size = path.stat().st_size
+        if size >= MMAP_THRESHOLD:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            with mapped, memoryview(mapped) as view:
+                encoded = encode_base64(view)
+        else:
+            encoded = encode_base64(f.read())
+
+    return CachedFile(path=path, mtime_ns=mtime_ns, encoded=encoded)
+
+
+attachment_cache = AttachmentCache()
+"""The process-wide :class:`AttachmentCache`."""
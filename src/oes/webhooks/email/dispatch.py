@@ -0,0 +1,144 @@
+"""Email dispatch.
+
+Renders and sends, or queues, templated emails from already parsed data, for use by
+any view.
+"""
+import asyncio
+import functools
+from collections.abc import Callable, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional, TypeVar
+
+import jinja2
+from loguru import logger
+
+from oes.webhooks import metrics
+from oes.webhooks.admission import limit
+from oes.webhooks.app import app
+from oes.webhooks.email.queue import EmailQueue
+from oes.webhooks.email.render import RenderedMessage, RenderPool, make_email
+from oes.webhooks.email.sender import get_message_sender, get_sender, serialize_email
+from oes.webhooks.email.types import Email
+from oes.webhooks.settings import EmailSettings, Settings
+
+_T = TypeVar("_T")
+
+
+async def dispatch_email(path: str, body: Mapping[str, Any]) -> bool:
+    """Render an email from a template and send or enqueue it.
+
+    Args:
+        path: The template path.
+        body: The email hook body, with ``to`` and optional ``from`` and ``subject``
+            properties, also used as the template data.
+
+    Returns:
+        Whether the email was queued.
+
+    Raises:
+        BaseValidationError: If the body is invalid.
+        jinja2.exceptions.TemplateNotFound: If the template does not exist.
+    """
+    try:
+        render_pool: Optional[RenderPool] = app.config.get("email_render_pool")
+        if render_pool is not None:
+            rendered = await render_pool.render(path, body)
+            queued = await deliver_rendered_message(rendered)
+        else:
+            email = await render_email(path, body)
+            queued = await deliver_email(email)
+    except jinja2.exceptions.TemplateNotFound:
+        # not counted, to keep unknown paths out of the metric labels
+        raise
+    except Exception:
+        metrics.EMAILS.labels(path, "error").inc()
+        raise
+
+    metrics.EMAILS.labels(path, "queued" if queued else "sent").inc()
+    return queued
+
+
+async def render_email(path: str, body: Mapping[str, Any]) -> Email:
+    """Render an email from a template in the render executor.
+
+    Raises:
+        BaseValidationError: If the body is invalid.
+        jinja2.exceptions.TemplateNotFound: If the template does not exist.
+    """
+    settings: Settings = app.config["settings"]
+    env = app.config["email_template_env"]
+    return await run_render(
+        make_email,
+        env,
+        settings.email.template_path,
+        path,
+        body,
+        settings.email.email_from,
+    )
+
+
+async def deliver_email(email: Email, settings: Optional[EmailSettings] = None) -> bool:
+    """Send or enqueue an email.
+
+    Returns:
+        Whether the email was queued.
+    """
+    if settings is None:
+        settings = app.config["settings"].email
+
+    queue: Optional[EmailQueue] = app.config.get("email_queue")
+    if queue is not None:
+        await metrics.to_thread("enqueue", _enqueue_email, queue, email)
+        app.config["email_queue_wakeup"].set()
+        logger.info("Queued message to {}", email.to)
+        return True
+
+    assert settings.use
+    sender = get_sender(settings.use)
+    async with limit(settings.use.value):
+        await sender(email, settings)
+
+    logger.info("Sent message to {}", email.to)
+    return False
+
+
+async def deliver_rendered_message(
+    rendered: RenderedMessage, settings: Optional[EmailSettings] = None
+) -> bool:
+    """Send or enqueue a message rendered by the render pool.
+
+    Returns:
+        Whether the message was queued.
+    """
+    if settings is None:
+        settings = app.config["settings"].email
+
+    queue: Optional[EmailQueue] = app.config.get("email_queue")
+    if queue is not None:
+        await metrics.to_thread(
+            "enqueue", queue.put, rendered.from_, rendered.to, rendered.message
+        )
+        app.config["email_queue_wakeup"].set()
+        logger.info("Queued message to {}", rendered.to)
+        return True
+
+    assert settings.use
+    send = get_message_sender(settings.use)
+    async with limit(settings.use.value):
+        await send(rendered.from_, rendered.to, rendered.message, settings)
+
+    logger.info("Sent message to {}", rendered.to)
+    return False
+
+
+async def run_render(func: Callable[..., _T], *args: Any) -> _T:
+    """Run a rendering function in the render executor."""
+    executor: Optional[ThreadPoolExecutor] = app.config.get("email_render_executor")
+    loop = asyncio.get_running_loop()
+    with metrics.in_flight("render"):
+        return await loop.run_in_executor(executor, functools.partial(func, *args))
+
+
+def _enqueue_email(queue: EmailQueue, email: Email):
+    message = serialize_email(email)
+    queue.put(email.from_, email.to, message)
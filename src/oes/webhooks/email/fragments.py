@@ -0,0 +1,192 @@
+"""Template fragment cache module."""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Optional
+
+from jinja2 import TemplateNotFound, TemplateSyntaxError, meta, nodes
+from jinja2.environment import Environment
+from jinja2.ext import Extension
+from jinja2.parser import Parser
+from typing_extensions import TypeAlias
+
+FragmentKey: TypeAlias = tuple[Optional[str], int, Hashable]
+"""A fragment's template name, template compilation ID and key."""
+
+_compile_ids = itertools.count(1)
+
+
+class FragmentCache:
+    """LRU cache of rendered template fragments."""
+
+    def __init__(self, max_entries: int = 1024):
+        """Create a :class:`FragmentCache`.
+
+        Args:
+            max_entries: The maximum number of cached fragments.
+        """
+        self.max_entries = max_entries
+        self._entries: OrderedDict[
+            FragmentKey, tuple[Optional[float], str]
+        ] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: FragmentKey) -> Optional[str]:
+        """Get a cached fragment, unless it expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: FragmentKey, value: str, ttl: Optional[float] = None):
+        """Cache a fragment, for ``ttl`` seconds if set."""
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max(self.max_entries, 0):
+                self._entries.popitem(last=False)
+
+    def invalidate(self, template_name: str):
+        """Remove the fragments of a template."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == template_name]:
+                del self._entries[key]
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+
+
+class FragmentCacheExtension(Extension):
+    """Adds a ``{% cache key, ttl %}...{% endcache %}`` tag.
+
+    The content is rendered once per key and template, and reused until ``ttl``
+    seconds pass, if given, or the template, or a template it includes or imports,
+    is reloaded. The key is any hashable
+    expression. Calls with side effects, like adding attachments or setting the
+    subject, only happen when the fragment is rendered, so they should be made
+    outside of cached fragments.
+
+    The cache is available as the ``fragment_cache`` attribute of the environment.
+    """
+
+    tags = {"cache"}
+
+    def __init__(self, environment: Environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+        self._compiled: set[str] = set()
+        self._dependencies: dict[tuple[Optional[str], ...], Optional[list[str]]] = {}
+
+    def preprocess(
+        self, source: str, name: Optional[str], filename: Optional[str] = None
+    ) -> str:
+        """Clear the cache when a template is compiled again, i.e. reloaded."""
+        if name is not None:
+            if name in self._compiled:
+                self._dependencies.clear()
+                getattr(self.environment, "fragment_cache").clear()
+            else:
+                self._compiled.add(name)
+        return source
+
+    def parse(self, parser: Parser) -> nodes.Node:
+        """Parse a ``cache`` tag."""
+        lineno = next(parser.stream).lineno
+        key = parser.parse_expression()
+        if parser.stream.skip_if("comma"):
+            ttl = parser.parse_expression()
+        else:
+            ttl = nodes.Const(None)
+
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        refs = tuple(meta.find_referenced_templates(nodes.Template(body)))
+
+        # entries of a template's earlier versions are not reused once it is
+        # recompiled
+        args = [
+            nodes.Const(parser.name),
+            nodes.Const(next(_compile_ids)),
+            nodes.Const(refs),
+            key,
+            ttl,
+        ]
+        return nodes.CallBlock(
+            self.call_method("_render_cached", args), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(
+        self,
+        template_name: Optional[str],
+        compile_id: int,
+        refs: tuple[Optional[str], ...],
+        key: Hashable,
+        ttl: Optional[float],
+        caller: Callable[[], str],
+    ) -> str:
+        if refs and self.environment.auto_reload:
+            self._reload_dependencies(refs)
+        cache: FragmentCache = getattr(self.environment, "fragment_cache")
+        cache_key = (template_name, compile_id, key)
+        value = cache.get(cache_key)
+        if value is None:
+            value = caller()
+            cache.set(cache_key, value, ttl)
+        return value
+
+    def _reload_dependencies(self, refs: tuple[Optional[str], ...]):
+        """Reload the templates a fragment uses if they changed.
+
+        Reloading a template clears the cache. Without auto-reload, changed templates
+        are evicted along with the templates using them instead.
+        """
+        if refs not in self._dependencies:
+            self._dependencies[refs] = self._find_dependencies(refs)
+        names = self._dependencies[refs]
+
+        if names is None:
+            # a dynamic name may refer to any template
+            template_cache = self.environment.cache
+            templates = list(template_cache.values()) if template_cache else []
+            if not all(t.is_up_to_date for t in templates):
+                getattr(self.environment, "fragment_cache").clear()
+            return
+
+        for name in names:
+            self.environment.get_template(name)
+
+    def _find_dependencies(
+        self, refs: tuple[Optional[str], ...]
+    ) -> Optional[list[str]]:
+        """Get the templates referenced, transitively, or ``None`` if any is dynamic."""
+        loader = self.environment.loader
+        names: list[str] = []
+        pending = list(refs)
+        while pending:
+            name = pending.pop()
+            if name is None:
+                return None
+            if name in names or loader is None:
+                continue
+            names.append(name)
+            try:
+                source, _, _ = loader.get_source(self.environment, name)
+                pending.extend(
+                    meta.find_referenced_templates(self.environment.parse(source))
+                )
+            except (TemplateNotFound, TemplateSyntaxError):
+                continue
+        return names
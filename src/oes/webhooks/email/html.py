@@ -1,17 +1,171 @@
 """HTML module."""
+import re
+from collections.abc import Sequence
+from typing import Optional
+
 import css_inline
 from minify_html import minify_html
 
 inliner = css_inline.CSSInliner()
 
+JINJA_TAG_RE = re.compile(
+    r"\{%-?\s*raw\s*-?%\}.*?\{%-?\s*endraw\s*-?%\}|\{\{.*?\}\}|\{%.*?%\}|\{#.*?#\}",
+    re.S,
+)
+"""Matches a Jinja tag, or a whole ``raw`` block."""
+
+_comment_re = re.compile(r"<!--.*?-->", re.S)
+_placeholder_re = re.compile(r"<!--oes-jinja-([0-9]+)-->")
+_raw_text_re = re.compile(r"<(style|script)\b[^>]*>.*?</\1\s*>", re.S | re.I)
+_tag_re = re.compile(r"<[a-zA-Z][^>]*>", re.S)
+_quoted_attr_re = re.compile(r"""([^\s"'=<>/]+)\s*=\s*("[^"]*"|'[^']*')""", re.S)
+
+_css_attrs = frozenset({"class", "id", "style"})
+
+_style_re = re.compile(r"<style\b[^>]*>(.*?)</style\s*>", re.S | re.I)
+_css_comment_re = re.compile(r"/\*.*?\*/", re.S)
+_css_declarations_re = re.compile(r"\{[^{}]*\}")
+_structural_selector_re = re.compile(
+    r":(?:first-|last-|only-|nth-|empty\b|has\b)|[+~]", re.I
+)
+_include_re = re.compile(r"\{%-?\s*(?:include|import|from)\b")
+
 
 def process_html(html: str) -> str:
     """Minify HTML and inline CSS styles."""
     inlined = inliner.inline(html)
-    minified = minify_html.minify(
-        inlined,
+    minified = _minify(inlined, keep_comments=False)
+    return minified
+
+
+def precompile_html(source: str) -> Optional[str]:
+    """Inline CSS styles and minify the static parts of an HTML template.
+
+    Jinja tags are swapped for HTML comment placeholders while the source is
+    processed, then restored, so only the dynamic parts of a rendered message are
+    left unprocessed.
+
+    Args:
+        source: The template source, which must not use ``extends``.
+
+    Returns:
+        The processed template source, or ``None`` if the template can't be safely
+        processed ahead of time, e.g. because it has Jinja tags within ``<style>``
+        elements or in an HTML tag outside a quoted attribute value, includes other
+        templates, or has selectors that depend on the rendered document's structure,
+        like ``:first-child`` or ``+``.
+    """
+    stripped = _strip_comments(source)
+    if stripped is None:
+        return None
+    source = stripped
+
+    tags = [m.span() for m in JINJA_TAG_RE.finditer(source)]
+    if tags and (
+        _include_re.search(source)
+        or _has_structural_selectors(source)
+        or not _tags_are_safe(source, tags)
+    ):
+        return None
+
+    parts = []
+    pos = 0
+    for i, (start, end) in enumerate(tags):
+        parts.append(source[pos:start])
+        parts.append(f"<!--oes-jinja-{i}-->")
+        pos = end
+    parts.append(source[pos:])
+
+    try:
+        processed = _minify(inliner.inline("".join(parts)), keep_comments=True)
+    except Exception:
+        return None
+
+    # the placeholders must be intact and in the same order
+    found = [int(m.group(1)) for m in _placeholder_re.finditer(processed)]
+    if found != list(range(len(tags))):
+        return None
+
+    return _placeholder_re.sub(
+        lambda m: source[slice(*tags[int(m.group(1))])], processed
+    )
+
+
+def _minify(html: str, keep_comments: bool) -> str:
+    return minify_html.minify(
+        html,
         do_not_minify_doctype=True,
         ensure_spec_compliant_unquoted_attribute_values=True,
         keep_spaces_between_attributes=True,
+        keep_comments=keep_comments,
     )
-    return minified
+
+
+def _strip_comments(source: str) -> Optional[str]:
+    """Remove HTML comments, as minifying would.
+
+    Jinja statements within comments are kept in place of the comment. Returns
+    ``None`` if a comment contains a Jinja expression.
+    """
+
+    def replace(match: re.Match) -> str:
+        kept = []
+        for tag in JINJA_TAG_RE.finditer(match.group(0)):
+            text = tag.group(0)
+            if text.startswith("{{"):
+                raise ValueError("Expression in comment")
+            elif text.startswith("{%"):
+                kept.append(text)
+        return "".join(kept)
+
+    try:
+        return _comment_re.sub(replace, source)
+    except ValueError:
+        return None
+
+
+def _has_structural_selectors(source: str) -> bool:
+    """Check for selectors that match elements by their siblings or children.
+
+    Loops and conditionals change the siblings and children of rendered elements, so
+    these selectors can't be applied before rendering.
+    """
+    for match in _style_re.finditer(source):
+        css = _css_comment_re.sub("", match.group(1))
+        # remove the declarations, leaving selectors, and at-rules, which aren't inlined
+        prev = None
+        while css != prev:
+            prev = css
+            css = _css_declarations_re.sub(";", css)
+        if _structural_selector_re.search(css):
+            return True
+    return False
+
+
+def _tags_are_safe(source: str, tags: Sequence[tuple[int, int]]) -> bool:
+    """Check that Jinja tags are only in text or non-CSS quoted attribute values."""
+    # hide the tags so their contents are not mistaken for markup
+    masked = list(source)
+    for start, end in tags:
+        masked[start:end] = "\0" * (end - start)
+    masked_source = "".join(masked)
+
+    for match in _raw_text_re.finditer(masked_source):
+        if "\0" in match.group(0):
+            return False
+
+    for match in _tag_re.finditer(masked_source):
+        tag = match.group(0)
+        if "\0" not in tag:
+            continue
+
+        # remove allowed attribute values, nothing else may contain a tag
+        def check_attr(attr: re.Match) -> str:
+            if "\0" in attr.group(2) and attr.group(1).lower() in _css_attrs:
+                return "\0"
+            return ""
+
+        if "\0" in _quoted_attr_re.sub(check_attr, tag):
+            return False
+
+    return True
@@ -0,0 +1,122 @@
+"""Mailgun module."""
+import secrets
+from collections.abc import AsyncIterable, AsyncIterator, Mapping, Sequence
+from typing import Any, Optional, Union
+
+import httpx
+
+from oes.webhooks.settings import MailgunSettings
+
+
+class MailgunClient:
+    """A pooled HTTP client for the Mailgun API.
+
+    Keeps connections to the API open between requests, and counts how many requests
+    reused an existing connection.
+    """
+
+    def __init__(
+        self,
+        settings: MailgunSettings,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """Create a :class:`MailgunClient`.
+
+        Args:
+            settings: The Mailgun settings.
+            transport: An optional transport to use instead of the default pool.
+        """
+        self.requests = 0
+        """The number of requests made."""
+
+        self.connections = 0
+        """The number of connections opened."""
+
+        self._client = httpx.AsyncClient(
+            http2=settings.http2,
+            limits=httpx.Limits(
+                max_connections=settings.max_connections,
+                max_keepalive_connections=settings.max_keepalive_connections,
+                keepalive_expiry=settings.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                settings.read_timeout, connect=settings.connect_timeout
+            ),
+            transport=transport,
+        )
+
+    @property
+    def reused(self) -> int:
+        """The number of requests that reused an open connection."""
+        return max(self.requests - self.connections, 0)
+
+    async def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        """Make a ``POST`` request.
+
+        Args:
+            url: The URL.
+            **kwargs: Arguments for :meth:`httpx.AsyncClient.post`.
+        """
+        self.requests += 1
+        return await self._client.post(url, extensions={"trace": self._trace}, **kwargs)
+
+    async def post_stream(
+        self,
+        url: str,
+        data: Mapping[str, Union[str, Sequence[str]]],
+        name: str,
+        content: AsyncIterable[bytes],
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """Make a multipart ``POST`` request, streaming the content of a file field.
+
+        The body is sent as it is produced, without a ``Content-Length``.
+
+        Args:
+            url: The URL.
+            data: The form fields.
+            name: The name of the file field.
+            content: The chunks of the file.
+            **kwargs: Arguments for :meth:`httpx.AsyncClient.post`.
+        """
+        boundary = secrets.token_hex(16)
+        headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        return await self.post(
+            url,
+            content=_stream_form(boundary, data, name, content),
+            headers=headers,
+            **kwargs,
+        )
+
+    async def close(self):
+        """Close the client and its connections."""
+        await self._client.aclose()
+
+    async def _trace(self, event: str, info: dict[str, Any]):
+        if event == "connection.connect_tcp.complete":
+            self.connections += 1
+
+
+async def _stream_form(
+    boundary: str,
+    data: Mapping[str, Union[str, Sequence[str]]],
+    name: str,
+    content: AsyncIterable[bytes],
+) -> AsyncIterator[bytes]:
+    """Produce a ``multipart/form-data`` body."""
+    for key, value in data.items():
+        for item in [value] if isinstance(value, str) else value:
+            yield (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{key}"\r\n\r\n'
+                f"{item}\r\n"
+            ).encode()
+
+    yield (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{name}"; filename="{name}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    async for chunk in content:
+        yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
@@ -0,0 +1,309 @@
+"""MIME module.
+
+Serializes an :class:`Email` directly to bytes, producing the same output as
+``bytes(email.get_message())`` without building an :class:`EmailMessage` tree.
+"""
+import binascii
+import random
+import re
+import sys
+from collections.abc import Generator, Iterable, Iterator
+from email import policy, quoprimime
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from oes.webhooks.email.types import Attachment, AttachmentType, Email, encode_base64
+
+CHUNK_SIZE = 64 * 1024
+"""The approximate size of the chunks of :func:`iter_message_chunks`, in bytes."""
+
+_policy = policy.default
+_max_line_length = _policy.max_line_length or 78
+MAX_8BIT_LINE_LENGTH = 998
+"""The longest line allowed in a 7bit or 8bit body, in bytes, excluding CRLF."""
+
+# attachment data encoded at once, a whole number of base64 lines
+_line_bytes = _max_line_length // 4 * 3
+_chunk_bytes = CHUNK_SIZE // 4 * 3 // _line_bytes * _line_bytes
+_boundary_width = len(repr(sys.maxsize - 1))
+
+_simple_address_re = re.compile(
+    r"(?:[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?: [A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)* )?"
+    r"<[A-Za-z0-9!#$%&'*+/=?^_`{|}~.-]+@[A-Za-z0-9.-]+>"
+    r"|[A-Za-z0-9!#$%&'*+/=?^_`{|}~.-]+@[A-Za-z0-9.-]+"
+)
+_simple_text_re = re.compile(
+    r"[\x21\x23-\x5b\x5d-\x7e]+(?: [\x21\x23-\x5b\x5d-\x7e]+)*"
+)
+_simple_filename_re = re.compile(r"[A-Za-z0-9!#$%&'*+.^_`{|}~ -]*")
+_simple_disposition_re = re.compile(
+    r"(?:attachment|inline)(?:; filename=\"" + _simple_filename_re.pattern + r"\")?"
+)
+_simple_media_type_re = re.compile(r"[A-Za-z0-9!#$&^_.+-]+/[A-Za-z0-9!#$&^_.+-]+")
+_address_headers = frozenset({"from", "to", "cc", "bcc", "reply-to", "sender"})
+
+
+def serialize_message(
+    email: Email, date: Optional[str] = None, line_length: int = _max_line_length
+) -> bytes:
+    """Serialize an email.
+
+    Args:
+        email: The :class:`Email`.
+        date: The ``Date`` header value.
+        line_length: Text parts with longer lines are quoted-printable or base64
+            encoded, instead of being sent as they are.
+    """
+    return b"".join(write_message(email, date, line_length))
+
+
+def iter_message_chunks(
+    email: Email, date: Optional[str] = None, size: int = CHUNK_SIZE
+) -> Generator[bytes, None, None]:
+    """Serialize an email, yielding chunks of about ``size`` bytes.
+
+    File-backed attachments are read and encoded a chunk at a time, so the message
+    is never in memory all at once.
+
+    Args:
+        email: The :class:`Email`.
+        date: The ``Date`` header value.
+        size: The chunk size, in bytes.
+    """
+    parts: list[bytes] = []
+    length = 0
+    for part in write_message(email, date):
+        parts.append(part)
+        length += len(part)
+        if length >= size:
+            yield b"".join(parts)
+            parts.clear()
+            length = 0
+    if parts:
+        yield b"".join(parts)
+
+
+def write_message(
+    email: Email, date: Optional[str] = None, line_length: int = _max_line_length
+) -> Iterator[bytes]:
+    """Serialize an email, yielding chunks of bytes.
+
+    Args:
+        email: The :class:`Email`.
+        date: The ``Date`` header value.
+        line_length: Text parts with longer lines are quoted-printable or base64
+            encoded, instead of being sent as they are.
+    """
+    boundary = _make_boundary()
+    yield _multipart_header("mixed", boundary)
+    yield _header("From", email.from_)
+    yield _header("To", email.to)
+    if email.subject:
+        yield _header("Subject", email.subject)
+    if date is not None:
+        yield _header("Date", date)
+    yield b"\n"
+
+    yield f"--{boundary}\n".encode()
+    if email.html:
+        yield from _write_alternative(
+            email.text, email.html, email.attachments, line_length
+        )
+    else:
+        yield from _write_text("plain", email.text, line_length=line_length)
+
+    for att in email.attachments:
+        if att.attachment_type == AttachmentType.attachment:
+            yield f"\n--{boundary}\n".encode()
+            yield from write_attachment(att)
+
+    yield f"\n--{boundary}--\n".encode()
+
+
+def write_attachment(attachment: Attachment) -> Iterator[bytes]:
+    """Serialize an attachment part, yielding chunks of bytes."""
+    disposition = str(attachment.attachment_type.value)
+    if attachment.name is not None:
+        if _simple_filename_re.fullmatch(attachment.name):
+            disposition = f'{disposition}; filename="{attachment.name}"'
+        else:
+            disposition = _format_filename(disposition, attachment.name)
+
+    yield _header("Content-Type", attachment.media_type)
+    yield b"Content-Transfer-Encoding: base64\n"
+    yield _header("Content-Disposition", disposition)
+    yield _header("Content-ID", f"<{attachment.id}>")
+    yield b"\n"
+    yield from _write_base64(attachment)
+
+
+def _write_base64(attachment: Attachment) -> Iterator[bytes]:
+    """Base64 encode attachment data, a chunk at a time."""
+    data = attachment.data
+    if attachment.encoded is not None:
+        encoded = attachment.encoded
+        for start in range(0, len(encoded), CHUNK_SIZE):
+            end = start + CHUNK_SIZE
+            yield encoded[start:end].encode("ascii")
+    elif isinstance(data, Path):
+        with data.open("rb") as f:
+            yield from _write_base64_file(f)
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        for start in range(0, len(view), _chunk_bytes):
+            end = start + _chunk_bytes
+            yield encode_base64(view[start:end]).encode("ascii")
+    else:
+        yield from _write_base64_file(data)
+
+
+def _write_base64_file(f: BinaryIO) -> Iterator[bytes]:
+    while True:
+        data = f.read(_chunk_bytes)
+        # keep reading after short reads, so each chunk ends on a line boundary
+        while data and len(data) < _chunk_bytes:
+            more = f.read(_chunk_bytes - len(data))
+            if not more:
+                break
+            data += more
+        if not data:
+            break
+        yield encode_base64(data).encode("ascii")
+
+
+def _write_alternative(
+    text: str,
+    html: str,
+    attachments: Iterable[Attachment],
+    line_length: int = _max_line_length,
+) -> Iterator[bytes]:
+    boundary = _make_boundary()
+    yield _multipart_header("alternative", boundary)
+    yield b"\n"
+    yield f"--{boundary}\n".encode()
+    yield from _write_text("plain", text, line_length=line_length)
+    yield f"\n--{boundary}\n".encode()
+    yield from _write_related(html, attachments, line_length)
+    yield f"\n--{boundary}--\n".encode()
+
+
+def _write_related(
+    html: str,
+    attachments: Iterable[Attachment],
+    line_length: int = _max_line_length,
+) -> Iterator[bytes]:
+    boundary = _make_boundary()
+    yield _multipart_header("related", boundary)
+    yield b"\n"
+    yield f"--{boundary}\n".encode()
+    yield from _write_text("html", html, "inline", line_length)
+    for att in attachments:
+        if att.attachment_type == AttachmentType.inline:
+            yield f"\n--{boundary}\n".encode()
+            yield from write_attachment(att)
+    yield f"\n--{boundary}--\n".encode()
+
+
+def _write_text(
+    subtype: str,
+    text: str,
+    disposition: Optional[str] = None,
+    line_length: int = _max_line_length,
+) -> Iterator[bytes]:
+    cte, body = _encode_text(text, line_length)
+    yield f'Content-Type: text/{subtype}; charset="utf-8"\n'.encode()
+    yield f"Content-Transfer-Encoding: {cte}\n".encode()
+    if disposition is not None:
+        yield f"Content-Disposition: {disposition}\n".encode()
+    yield b"\n"
+    yield body
+
+
+def _encode_text(text: str, line_length: int = _max_line_length) -> tuple[str, bytes]:
+    """Choose a transfer encoding and encode text like :class:`MIMEPart` does."""
+    lines = text.encode("utf-8").splitlines()
+    normal_body = b"\n".join(lines) + b"\n"
+
+    if max((len(x) for x in lines), default=0) <= line_length:
+        # 7bit if it's ASCII, 8bit otherwise
+        return ("7bit" if normal_body.isascii() else "8bit"), normal_body
+
+    sniff = b"\n".join(lines[:10]) + b"\n"
+    sniff_qp = quoprimime.body_encode(sniff.decode("latin-1"), _max_line_length)
+    if len(sniff_qp) > len(binascii.b2a_base64(sniff)):
+        return "base64", encode_base64(normal_body).encode("ascii")
+    elif len(lines) <= 10:
+        return "quoted-printable", sniff_qp.encode("ascii")
+    else:
+        qp = quoprimime.body_encode(normal_body.decode("latin-1"), _max_line_length)
+        return "quoted-printable", qp.encode("ascii")
+
+
+def fold_lines(text: str, width: int) -> Optional[str]:
+    """Break lines longer than ``width`` characters at spaces.
+
+    Returns:
+        The folded text, or ``None`` if a long line has no space to break at.
+    """
+    lines = []
+    for line in text.split("\n"):
+        while len(line) > width:
+            cut = line.rfind(" ", 0, width + 1)
+            if cut < 0:
+                return None
+            lines.append(line[:cut])
+            # drop the space
+            rest = cut + 1
+            line = line[rest:]
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _header(name: str, value: str) -> bytes:
+    """Format a header, folding and encoding it only when necessary.
+
+    Raises:
+        ValueError: If the value contains a line break.
+    """
+    if "\r" in value or "\n" in value:
+        raise ValueError(
+            "Header values may not contain linefeed or carriage return characters"
+        )
+    line = f"{name}: {value}\n"
+    if len(line) <= _max_line_length + 1:
+        if name.lower() in _address_headers:
+            simple = _simple_address_re.fullmatch(value) is not None
+        elif name == "Content-Type":
+            simple = _simple_media_type_re.fullmatch(value) is not None
+        elif name == "Content-Disposition":
+            simple = _simple_disposition_re.fullmatch(value) is not None
+        else:
+            simple = _simple_text_re.fullmatch(value) is not None and "=?" not in value
+        if simple:
+            return line.encode("ascii")
+
+    header = _policy.header_factory(name, value)
+    return header.fold(policy=_policy).encode("ascii")
+
+
+def _format_filename(disposition: str, filename: str) -> str:
+    """Format a ``Content-Disposition`` value with a filename needing encoding."""
+    from email.message import MIMEPart
+
+    part = MIMEPart()
+    part["Content-Disposition"] = disposition
+    part.set_param("filename", filename, header="Content-Disposition")
+    return str(part["Content-Disposition"])
+
+
+def _multipart_header(subtype: str, boundary: str) -> bytes:
+    value = f'multipart/{subtype}; boundary="{boundary}"'
+    if len(value) + len("Content-Type: ") <= _max_line_length:
+        return f"Content-Type: {value}\n".encode()
+    else:
+        return f'Content-Type: multipart/{subtype};\n boundary="{boundary}"\n'.encode()
+
+
+def _make_boundary() -> str:
+    token = random.randrange(sys.maxsize)
+    return f"{'=' * 15}{token:0{_boundary_width}d}=="
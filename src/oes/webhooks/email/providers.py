@@ -0,0 +1,261 @@
+"""Multi-provider sending module."""
+import asyncio
+import random
+import time
+from collections.abc import Awaitable, Callable, Sequence
+from typing import Any, Optional
+
+from loguru import logger
+
+from oes.webhooks import metrics
+from oes.webhooks.email.ratelimit import RateLimited
+from oes.webhooks.settings import EmailSettings
+
+
+class NoProviderAvailable(Exception):
+    """Raised when every provider failed or is not being used after failures."""
+
+
+class CircuitBreaker:
+    """Stops using a provider after consecutive failures.
+
+    After ``failure_threshold`` failures in a row, the breaker opens and the provider
+    is not used for ``reset_timeout`` seconds. Then one send is let through: the
+    breaker closes if it succeeds, and opens again if it fails.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Create a :class:`CircuitBreaker`.
+
+        Args:
+            failure_threshold: The number of consecutive failures that open it.
+            reset_timeout: How long it stays open, in seconds.
+            clock: The time function.
+        """
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._clock = clock
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        """``closed``, ``open`` or ``half_open``."""
+        if self._opened_at is None:
+            return "closed"
+        elif self._trial or self._clock() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        else:
+            return "open"
+
+    def available(self) -> bool:
+        """Whether a send would be let through."""
+        if self._opened_at is None:
+            return True
+        return not self._trial and self._clock() - self._opened_at >= self.reset_timeout
+
+    def acquire(self) -> bool:
+        """Let a send through, if available."""
+        if not self.available():
+            return False
+        if self._opened_at is not None:
+            self._trial = True
+        return True
+
+    def release(self):
+        """Let another send through, after an acquired send did not finish."""
+        self._trial = False
+
+    def record_success(self):
+        """Record a successful send."""
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        """Record a failed send."""
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            self._opened_at = self._clock()
+        self._trial = False
+
+
+class Provider:
+    """A provider of a :class:`ProviderRouter`."""
+
+    def __init__(
+        self,
+        name: str,
+        settings: EmailSettings,
+        weight: float = 1,
+        concurrency: int = 10,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        """Create a :class:`Provider`.
+
+        Args:
+            name: The provider name.
+            settings: The email settings to send with.
+            weight: The share of messages sent with this provider.
+            concurrency: The number of messages sent at once.
+            breaker: The :class:`CircuitBreaker`.
+        """
+        self.name = name
+        self.settings = settings
+        self.weight = max(weight, 0)
+        self.concurrency = max(concurrency, 1)
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.in_flight = 0
+        self.sent = 0
+        self.errors = 0
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    @property
+    def saturated(self) -> bool:
+        """Whether all the provider's slots are in use."""
+        return self.in_flight >= self.concurrency
+
+    async def run(self, func: Callable[["Provider"], Awaitable[Any]]):
+        """Run a send with this provider, recording the result.
+
+        The breaker must have been acquired.
+        """
+        self.in_flight += 1
+        try:
+            async with self._semaphore:
+                await func(self)
+        except RateLimited:
+            # the provider was not used
+            self.breaker.release()
+            raise
+        except Exception as e:
+            if is_message_error(e):
+                # not the provider's fault
+                self.breaker.record_success()
+            else:
+                self.errors += 1
+                self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        else:
+            self.sent += 1
+            self.breaker.record_success()
+        finally:
+            self.in_flight -= 1
+            metrics.PROVIDER_CIRCUIT_OPEN.labels(self.name).set(
+                0 if self.breaker.state == "closed" else 1
+            )
+
+    def stats(self) -> dict[str, Any]:
+        """Get the provider statistics."""
+        return {
+            "state": self.breaker.state,
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+            "errors": self.errors,
+            "consecutive_failures": self.breaker.failures,
+        }
+
+
+class ProviderRouter:
+    """Spreads sends across providers by weight, failing over on errors.
+
+    Providers with free slots are preferred, so a slow provider does not hold back
+    the others. A send that fails because of the provider is tried with another one,
+    and providers that keep failing are skipped until their breaker lets a send
+    through again. A send that would wait too long for a provider's rate limit is
+    tried with another one too.
+    """
+
+    def __init__(self, providers: Sequence[Provider]):
+        """Create a :class:`ProviderRouter`."""
+        self.providers = list(providers)
+
+    def choose(self, exclude: Sequence[Provider] = ()) -> Optional[Provider]:
+        """Choose a provider by weight, not one of ``exclude``."""
+        available = [
+            p
+            for p in self.providers
+            if p not in exclude and p.weight > 0 and p.breaker.available()
+        ]
+        candidates = [p for p in available if not p.saturated] or available
+        if not candidates:
+            return None
+        return random.choices(candidates, weights=[p.weight for p in candidates])[0]
+
+    async def send(self, func: Callable[[Provider], Awaitable[Any]]):
+        """Send with a provider, trying the others if it fails.
+
+        Args:
+            func: A function sending with the given provider.
+
+        Raises:
+            NoProviderAvailable: If no provider could be used.
+            Exception: The error of the last provider tried, or of a provider that
+                rejected the message.
+        """
+        tried: list[Provider] = []
+        error: Optional[Exception] = None
+        while True:
+            provider = self.choose(tried)
+            if provider is None:
+                break
+            tried.append(provider)
+            if not provider.breaker.acquire():
+                continue
+
+            try:
+                await provider.run(func)
+            except RateLimited as e:
+                error = e
+                logger.debug("Sending with {} is rate limited: {}", provider.name, e)
+            except Exception as e:
+                if is_message_error(e):
+                    raise
+                error = e
+                metrics.PROVIDER_FAILOVERS.labels(provider.name).inc()
+                logger.warning("Sending with {} failed: {!r}", provider.name, e)
+            else:
+                return
+
+        if error is not None:
+            raise error
+        raise NoProviderAvailable("No email provider is available")
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """Get the statistics of each provider."""
+        return {p.name: p.stats() for p in self.providers}
+
+
+def is_message_error(exc: BaseException) -> bool:
+    """Whether a send failed because of the message, not the provider.
+
+    Other providers would reject the message too, so it is not retried with them.
+    """
+    # httpx.HTTPStatusError
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if isinstance(status, int):
+        return 400 <= status < 500 and status not in (401, 403, 408, 429)
+
+    # aiosmtplib.SMTPResponseException
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code >= 500 and code not in (530, 535)
+
+    # aiosmtplib.SMTPRecipientsRefused, raised when every recipient was refused
+    recipients = getattr(exc, "recipients", None)
+    if isinstance(recipients, list) and recipients:
+        return all(
+            isinstance(r, BaseException) and is_message_error(r) for r in recipients
+        )
+
+    return False
@@ -0,0 +1,283 @@
+"""Email queue module."""
+import asyncio
+import contextlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, cast
+
+from attrs import frozen
+from loguru import logger
+
+from oes.webhooks import metrics
+from oes.webhooks.email.ratelimit import RateLimited
+from oes.webhooks.email.sender import MessageSender
+from oes.webhooks.settings import EmailQueueSettings, EmailSettings
+
+_schema = """
+CREATE TABLE IF NOT EXISTS email_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    next_attempt REAL NOT NULL,
+    locked_until REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    from_ TEXT NOT NULL,
+    to_ TEXT NOT NULL,
+    message BLOB NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS email_queue_next_attempt
+    ON email_queue (failed, next_attempt);
+"""
+
+
+@frozen(kw_only=True)
+class QueuedMessage:
+    """A serialized message in the queue."""
+
+    id: int
+    """The queue entry ID."""
+
+    from_: str
+    """The envelope sender."""
+
+    to: str
+    """The envelope recipient."""
+
+    message: bytes
+    """The message data."""
+
+    attempts: int = 0
+    """The number of failed delivery attempts so far."""
+
+
+@frozen(kw_only=True)
+class QueueStats:
+    """Queue statistics."""
+
+    depth: int
+    """The number of messages waiting for delivery."""
+
+    oldest_age: Optional[float]
+    """The age in seconds of the oldest waiting message."""
+
+    retrying: int
+    """The number of waiting messages that have failed at least once."""
+
+    attempts: int
+    """The total number of failed attempts of waiting messages."""
+
+    failed: int
+    """The number of messages that exhausted their attempts."""
+
+
+class EmailQueue:
+    """A durable queue of serialized messages stored in SQLite.
+
+    The database is opened in WAL mode so it may be shared by several worker
+    processes. Messages are claimed with a lease so a message held by a crashed
+    process becomes available again once its lease expires.
+    """
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_schema)
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._conn.close()
+
+    def put(self, from_: str, to: str, message: bytes) -> int:
+        """Add a message to the queue.
+
+        Returns:
+            The queue entry ID.
+        """
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO email_queue (created, next_attempt, from_, to_, message) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (now, now, from_, to, message),
+            )
+        return cast(int, cur.lastrowid)
+
+    def claim(self, lease_time: float) -> Optional[QueuedMessage]:
+        """Claim the next message that is due for delivery.
+
+        Args:
+            lease_time: How long the message is reserved for the caller, in seconds.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, from_, to_, message, attempts FROM email_queue "
+                    "WHERE failed = 0 AND next_attempt <= ? AND locked_until <= ? "
+                    "ORDER BY next_attempt LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE email_queue SET locked_until = ? WHERE id = ?",
+                        (now + lease_time, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+
+        id_, from_, to, message, attempts = row
+        return QueuedMessage(
+            id=id_, from_=from_, to=to, message=message, attempts=attempts
+        )
+
+    def complete(self, id_: int):
+        """Remove a delivered message."""
+        with self._lock:
+            self._conn.execute("DELETE FROM email_queue WHERE id = ?", (id_,))
+
+    def release(self, id_: int):
+        """Release a claimed message without counting an attempt."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE email_queue SET locked_until = 0 WHERE id = ?", (id_,)
+            )
+
+    def postpone(self, id_: int, delay: float):
+        """Release a message to be tried after ``delay`` seconds, not as a retry."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE email_queue SET next_attempt = ?, locked_until = 0 "
+                "WHERE id = ?",
+                (time.time() + delay, id_),
+            )
+
+    def retry(self, id_: int, delay: float, error: str):
+        """Release a message to be retried after ``delay`` seconds."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE email_queue SET attempts = attempts + 1, next_attempt = ?, "
+                "locked_until = 0, last_error = ? WHERE id = ?",
+                (time.time() + delay, error, id_),
+            )
+
+    def fail(self, id_: int, error: str):
+        """Mark a message as permanently failed."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE email_queue SET attempts = attempts + 1, failed = 1, "
+                "locked_until = 0, last_error = ? WHERE id = ?",
+                (error, id_),
+            )
+
+    def stats(self) -> QueueStats:
+        """Get the queue statistics."""
+        with self._lock:
+            depth, oldest, retrying, attempts = self._conn.execute(
+                "SELECT COUNT(*), MIN(created), "
+                "COALESCE(SUM(attempts > 0), 0), COALESCE(SUM(attempts), 0) "
+                "FROM email_queue WHERE failed = 0"
+            ).fetchone()
+            (failed,) = self._conn.execute(
+                "SELECT COUNT(*) FROM email_queue WHERE failed = 1"
+            ).fetchone()
+
+        return QueueStats(
+            depth=depth,
+            oldest_age=time.time() - oldest if oldest is not None else None,
+            retrying=retrying,
+            attempts=attempts,
+            failed=failed,
+        )
+
+
+async def run_delivery_worker(
+    queue: EmailQueue,
+    send: MessageSender,
+    settings: EmailSettings,
+    queue_settings: EmailQueueSettings,
+    wakeup: asyncio.Event,
+):
+    """Deliver queued messages until cancelled.
+
+    Args:
+        queue: The :class:`EmailQueue`.
+        send: The :class:`MessageSender` to deliver with.
+        settings: The email settings.
+        queue_settings: The queue settings.
+        wakeup: An event set when a message is added to the queue.
+    """
+    while True:
+        queued = await metrics.to_thread(
+            "queue", queue.claim, queue_settings.lease_time
+        )
+        if queued is None:
+            wakeup.clear()
+            # wait for a new message or the next poll for retries/other processes
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(wakeup.wait(), queue_settings.poll_interval)
+            continue
+
+        await _deliver(queue, send, settings, queue_settings, queued)
+
+
+async def _deliver(
+    queue: EmailQueue,
+    send: MessageSender,
+    settings: EmailSettings,
+    queue_settings: EmailQueueSettings,
+    queued: QueuedMessage,
+):
+    try:
+        await send(queued.from_, queued.to, queued.message, settings)
+    except asyncio.CancelledError:
+        # shutting down, make the message available again immediately, without
+        # blocking the loop, and even if cancelled again while waiting
+        await asyncio.shield(metrics.to_thread("queue", queue.release, queued.id))
+        raise
+    except RateLimited as e:
+        # not a failure, try again once the limit allows it
+        logger.debug(
+            "Postponing message to {} for {}s: {}", queued.to, e.retry_after, e
+        )
+        await metrics.to_thread("queue", queue.postpone, queued.id, e.retry_after)
+    except Exception as e:
+        attempts = queued.attempts + 1
+        error = f"{type(e).__name__}: {e}"
+        if attempts >= queue_settings.max_attempts:
+            logger.error(
+                "Giving up on message to {} after {} attempts: {}",
+                queued.to,
+                attempts,
+                error,
+            )
+            await metrics.to_thread("queue", queue.fail, queued.id, error)
+        else:
+            delay = min(
+                queue_settings.retry_delay * 2 ** (attempts - 1),
+                queue_settings.max_retry_delay,
+            )
+            logger.warning(
+                "Failed to send message to {} (attempt {}), retrying in {:.0f}s: {}",
+                queued.to,
+                attempts,
+                delay,
+                error,
+            )
+            await metrics.to_thread("queue", queue.retry, queued.id, delay, error)
+    else:
+        await metrics.to_thread("queue", queue.complete, queued.id)
+        logger.info("Sent queued message to {}", queued.to)
@@ -0,0 +1,167 @@
+"""Email rate limit module."""
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+from collections.abc import Sequence
+from email.utils import parseaddr
+from pathlib import Path
+from typing import Optional
+
+from attrs import frozen
+
+from oes.webhooks import metrics
+from oes.webhooks.settings import RateLimitSettings
+
+_schema = """
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+class RateLimited(Exception):
+    """Raised when a message would wait too long for a rate limit."""
+
+    def __init__(self, bucket: str, wait: float):
+        super().__init__(f"Rate limit {bucket} exceeded, wait {wait:.1f}s")
+        self.bucket = bucket
+        self.wait = wait
+
+    @property
+    def retry_after(self) -> int:
+        """The wait in whole seconds."""
+        return max(math.ceil(self.wait), 1)
+
+
+@frozen
+class Bucket:
+    """A token bucket and the number of tokens to take from it."""
+
+    name: str
+    """The bucket name."""
+
+    settings: RateLimitSettings
+    """The rate and burst size."""
+
+    tokens: int = 1
+    """The number of tokens to take."""
+
+
+class TokenBuckets:
+    """Token buckets stored in SQLite.
+
+    The database is opened in WAL mode so the buckets are shared by several worker
+    processes. Tokens are reserved in advance: a caller takes its tokens even from an
+    empty bucket, and waits until the bucket would have refilled them. Concurrent
+    senders are spaced out evenly instead of all retrying when a token is added.
+    """
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_schema)
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._conn.close()
+
+    def reserve(
+        self, buckets: Sequence[Bucket], max_wait: float, now: Optional[float] = None
+    ) -> float:
+        """Take tokens from each bucket.
+
+        Args:
+            buckets: The buckets.
+            max_wait: The longest wait allowed, in seconds.
+            now: The current time.
+
+        Returns:
+            How long to wait before sending, in seconds.
+
+        Raises:
+            RateLimited: If the wait would be longer than ``max_wait``. No tokens
+                are taken.
+        """
+        if now is None:
+            now = time.time()
+        wait = 0.0
+        updates = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for bucket in buckets:
+                    rate = bucket.settings.rate
+                    burst = max(bucket.settings.burst, 1)
+                    row = self._conn.execute(
+                        "SELECT tokens, updated FROM rate_limit_buckets "
+                        "WHERE name = ?",
+                        (bucket.name,),
+                    ).fetchone()
+                    tokens, updated = row if row is not None else (burst, now)
+                    tokens = min(tokens + max(now - updated, 0) * rate, burst)
+                    tokens -= bucket.tokens
+                    bucket_wait = -tokens / rate if tokens < 0 else 0.0
+                    if bucket_wait > max_wait:
+                        raise RateLimited(bucket.name, bucket_wait)
+                    wait = max(wait, bucket_wait)
+                    updates.append((bucket.name, tokens, now))
+
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO rate_limit_buckets (name, tokens, updated) "
+                    "VALUES (?, ?, ?)",
+                    updates,
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._conn.execute("COMMIT")
+        return wait
+
+
+async def wait_for_tokens(
+    token_buckets: TokenBuckets,
+    provider: str,
+    buckets: Sequence[Bucket],
+    max_wait: float,
+):
+    """Take tokens from the buckets and wait until they may be used.
+
+    Args:
+        token_buckets: The :class:`TokenBuckets`.
+        provider: The provider name, for metrics.
+        buckets: The buckets.
+        max_wait: The longest wait allowed, in seconds.
+
+    Raises:
+        RateLimited: If the wait would be longer than ``max_wait``.
+    """
+    if not buckets:
+        return
+    start = time.perf_counter()
+    try:
+        wait = await metrics.to_thread(
+            "rate_limit", token_buckets.reserve, buckets, max_wait
+        )
+    except RateLimited:
+        metrics.RATE_LIMITED.labels(provider).inc()
+        raise
+    if wait > 0:
+        await asyncio.sleep(wait)
+    metrics.RATE_LIMIT_SECONDS.labels(provider).observe(time.perf_counter() - start)
+
+
+def get_domain(address: str) -> str:
+    """Get the lowercase domain of an address."""
+    _, addr = parseaddr(address)
+    _, at, domain = addr.rpartition("@")
+    return domain.lower() if at else ""
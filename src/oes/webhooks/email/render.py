@@ -0,0 +1,220 @@
+"""Email rendering and the render process pool."""
+import asyncio
+import multiprocessing
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+import jinja2
+from attrs import frozen
+from cattrs import ClassValidationError
+from loguru import logger
+
+from oes.webhooks import metrics
+from oes.webhooks.email.cache import attachment_cache
+from oes.webhooks.email.sender import serialize_email
+from oes.webhooks.email.template import (
+    Attachments,
+    Subject,
+    get_environment,
+    render_message,
+)
+from oes.webhooks.email.types import Email, EmailHookBody
+from oes.webhooks.email.watch import TemplateInvalidator, TemplateWatcher
+from oes.webhooks.log import setup_logging
+from oes.webhooks.serialization import converter
+from oes.webhooks.settings import EmailSettings, LogSettings
+
+
+def make_email(
+    env: jinja2.Environment,
+    base_path: Path,
+    path: str,
+    body: Mapping[str, Any],
+    default_from: Optional[str],
+) -> Email:
+    """Render an :class:`Email` from a template."""
+    try:
+        with metrics.timed("structure"):
+            hook = converter.structure(body, EmailHookBody)
+    except Exception as e:
+        raise ClassValidationError(str(e), (e,), EmailHookBody) from e
+
+    subject = Subject(hook.subject)
+    attachments = Attachments(base_path)
+
+    with metrics.timed("render"):
+        text, html = render_message(env, subject, attachments, path, body)
+
+    from_ = hook.from_ or default_from
+    if not from_:
+        exc = ValueError("Default 'email_from` is not set.")
+        raise ClassValidationError(str(exc), (exc,), EmailHookBody)
+
+    email = Email(
+        to=hook.to,
+        from_=from_,
+        subject=str(subject) or None,
+        text=text,
+        html=html,
+        attachments=tuple(attachments),
+    )
+
+    return email
+
+
+@frozen(kw_only=True)
+class RenderedMessage:
+    """A rendered and serialized message."""
+
+    to: str
+    """The ``To:`` address."""
+
+    from_: str
+    """The ``From:`` address."""
+
+    message: bytes
+    """The serialized message."""
+
+    stages: tuple[tuple[str, float], ...] = ()
+    """The time spent in each stage, recorded by the parent process."""
+
+
+class RenderPool:
+    """Renders and serializes messages in a pool of subprocesses.
+
+    Each subprocess loads its own template environment, with every template
+    compiled up front, and its own attachment cache. Stage timings are returned
+    with each message and recorded in this process.
+    """
+
+    def __init__(
+        self,
+        settings: EmailSettings,
+        processes: int,
+        log_settings: Optional[LogSettings] = None,
+        debug: bool = False,
+    ):
+        """Create a :class:`RenderPool`.
+
+        Args:
+            settings: The email settings.
+            processes: The number of subprocesses.
+            log_settings: The log settings. Subprocesses set up logging with these
+                settings, if given.
+            debug: Whether subprocesses log debug messages.
+        """
+        self.processes = processes
+        context = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(
+            processes,
+            mp_context=context,
+            initializer=_init_process,
+            initargs=(
+                context.Barrier(processes),
+                log_settings,
+                debug,
+                settings.template_path,
+                settings.precompile_html,
+                settings.fragment_cache_size,
+                settings.attachment_cache_size,
+                settings.attachment_stream_size,
+                settings.email_from,
+                settings.watch_templates,
+            ),
+        )
+
+    async def start(self):
+        """Start the subprocesses and wait until they are ready."""
+        loop = asyncio.get_running_loop()
+        # each task blocks its process until all are started, so every process
+        # runs one, after loading its templates
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(self._executor, _ready, READY_TIMEOUT)
+                for _ in range(self.processes)
+            )
+        )
+        logger.debug("Started {} render processes", self.processes)
+
+    async def render(self, path: str, body: Mapping[str, Any]) -> RenderedMessage:
+        """Render and serialize a message.
+
+        Raises:
+            BaseValidationError: If the body is invalid.
+            jinja2.exceptions.TemplateNotFound: If the template does not exist.
+        """
+        loop = asyncio.get_running_loop()
+        with metrics.in_flight("render_process"):
+            rendered = await loop.run_in_executor(
+                self._executor, _render_in_process, path, dict(body)
+            )
+        metrics.record_stages(rendered.stages)
+        return rendered
+
+    def close(self):
+        """Shut down the subprocesses."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+READY_TIMEOUT = 60.0
+"""Seconds to wait for the subprocesses to load their templates."""
+
+_env: Optional[jinja2.Environment] = None
+_template_path = Path()
+_email_from: Optional[str] = None
+_started: Optional[threading.Barrier] = None
+
+
+def _init_process(
+    started: threading.Barrier,
+    log_settings: Optional[LogSettings],
+    debug: bool,
+    template_path: Path,
+    precompile_html: bool,
+    fragment_cache_size: int,
+    attachment_cache_size: int,
+    attachment_stream_size: int,
+    email_from: Optional[str],
+    watch_templates: bool,
+):
+    global _env, _template_path, _email_from, _started
+    if log_settings is not None:
+        setup_logging(debug, log_settings)
+    _started = started
+    _env = get_environment(
+        template_path,
+        precompile_html,
+        fragment_cache_size,
+        auto_reload=not watch_templates,
+    )
+    _template_path = template_path
+    _email_from = email_from
+    attachment_cache.max_size = attachment_cache_size
+    attachment_cache.stream_size = attachment_stream_size
+    attachment_cache.check_mtime = not watch_templates
+    if watch_templates:
+        TemplateWatcher(TemplateInvalidator(_env, template_path)).start()
+
+    for name in _env.list_templates(extensions=("txt", "html")):
+        try:
+            _env.get_template(name)
+        except Exception:
+            logger.opt(exception=True).warning("Failed to load template {}", name)
+
+
+def _ready(timeout: float):
+    assert _started is not None
+    _started.wait(timeout)
+
+
+def _render_in_process(path: str, body: Mapping[str, Any]) -> RenderedMessage:
+    assert _env is not None
+    with metrics.collect_stages() as stages:
+        email = make_email(_env, _template_path, path, body, _email_from)
+        message = serialize_email(email)
+    return RenderedMessage(
+        to=email.to, from_=email.from_, message=message, stages=tuple(stages)
+    )
@@ -1,23 +1,64 @@
 """Sender module."""
+from __future__ import annotations
+
 import asyncio
-import smtplib
-from asyncio import Semaphore
-from collections.abc import Awaitable, Callable
+import functools
+import json
+import re
+import threading
+from collections import Counter
+from collections.abc import AsyncIterator, Awaitable, Callable, Collection, Mapping
 from datetime import datetime, timezone
-from email.message import EmailMessage
 from email.utils import format_datetime
+from typing import TYPE_CHECKING, Any, Optional, TypeVar
 
-import httpx
-from httpx import BasicAuth
+import attrs
 from loguru import logger
 from typing_extensions import TypeAlias
 
+from oes.webhooks import metrics
+from oes.webhooks.email.mime import (
+    MAX_8BIT_LINE_LENGTH,
+    fold_lines,
+    iter_message_chunks,
+    serialize_message,
+)
+from oes.webhooks.email.providers import CircuitBreaker, Provider, ProviderRouter
+from oes.webhooks.email.ratelimit import (
+    Bucket,
+    TokenBuckets,
+    get_domain,
+    wait_for_tokens,
+)
 from oes.webhooks.email.types import Email
-from oes.webhooks.settings import EmailSenderType, EmailSettings, SMTPSettings
+from oes.webhooks.settings import (
+    EmailSenderType,
+    EmailSettings,
+    MailgunSettings,
+    RateLimitSettings,
+    SMTPSettings,
+)
+
+if TYPE_CHECKING:
+    # the HTTP and SMTP clients are imported when the provider is first used
+    from oes.webhooks.email.mailgun import MailgunClient
+    from oes.webhooks.email.smtp import SMTPPool
 
 EmailSender: TypeAlias = Callable[[Email, EmailSettings], Awaitable]
 """A callable to send an email."""
 
+MAILGUN_BATCH_SIZE = 1000
+"""The maximum number of recipients of a Mailgun batch send."""
+
+MessageSender: TypeAlias = Callable[[str, str, bytes, EmailSettings], Awaitable]
+"""A callable to send a serialized message, given the from and to addresses."""
+
+_F = TypeVar("_F", bound=Callable[..., Awaitable])
+
+# at most 4 bytes per character, within MAX_8BIT_LINE_LENGTH
+_BATCH_LINE_WIDTH = 240
+_preformatted_re = re.compile(r"<(?:pre|textarea)\b|white-space\s*:\s*pre", re.I)
+
 
 def get_sender(typ: EmailSenderType) -> EmailSender:
     """Get a :class:`EmailSender`."""
@@ -27,57 +68,324 @@ def get_sender(typ: EmailSenderType) -> EmailSender:
         return smtp_email_sender
     elif typ == EmailSenderType.mailgun:
         return mailgun_email_sender
+    elif typ == EmailSenderType.providers:
+        return providers_email_sender
     else:
         raise ValueError(f"Invalid email sender type: {typ}")
 
 
-_client = httpx.AsyncClient()
-_semaphore = Semaphore(1)
+def get_message_sender(typ: EmailSenderType) -> MessageSender:
+    """Get a :class:`MessageSender`."""
+    if typ == EmailSenderType.mock:
+        return mock_message_sender
+    elif typ == EmailSenderType.smtp:
+        return smtp_message_sender
+    elif typ == EmailSenderType.mailgun:
+        return mailgun_message_sender
+    elif typ == EmailSenderType.providers:
+        return providers_message_sender
+    else:
+        raise ValueError(f"Invalid email sender type: {typ}")
+
+
+def serialize_email(email: Email) -> bytes:
+    """Serialize an email to the bytes of its message."""
+    with metrics.timed("serialize"):
+        return serialize_message(email, _format_date())
+
+
+def serialize_batch_email(email: Email) -> Optional[bytes]:
+    """Serialize an email with recipient variable placeholders for a batch send.
+
+    The text and HTML are not quoted-printable or base64 encoded, so Mailgun can
+    replace the placeholders in them. Long lines are broken at spaces instead.
+
+    Returns:
+        The message, or ``None`` if a long line has no space to break at, or the
+        HTML has preformatted text where breaking a line would show.
+    """
+    text = fold_lines(email.text, _BATCH_LINE_WIDTH)
+    html = email.html
+    if html is not None:
+        folded = fold_lines(html, _BATCH_LINE_WIDTH)
+        if folded != html and (folded is None or _preformatted_re.search(html)):
+            return None
+        html = folded
+    if text is None:
+        return None
+
+    with metrics.timed("serialize"):
+        return serialize_message(
+            attrs.evolve(email, text=text, html=html),
+            _format_date(),
+            MAX_8BIT_LINE_LENGTH,
+        )
+
+
+async def stream_email(email: Email) -> AsyncIterator[bytes]:
+    """Serialize an email in a thread, a chunk at a time.
+
+    Only one chunk of the message is in memory at once, besides the data the email
+    already holds, however large its file-backed attachments are.
+    """
+    chunks = iter_message_chunks(email, _format_date())
+    lock = threading.Lock()
+
+    def next_chunk() -> Optional[bytes]:
+        with lock:
+            return next(chunks, None)
+
+    def close():
+        with lock:
+            chunks.close()
+
+    try:
+        while True:
+            chunk = await metrics.to_thread("serialize", next_chunk)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        if lock.acquire(blocking=False):
+            try:
+                chunks.close()
+            finally:
+                lock.release()
+        else:
+            # cancelled while a chunk is serialized, close once it is done
+            asyncio.get_running_loop().run_in_executor(None, close)
+
+
+def _instrumented(provider: str) -> Callable[[_F], _F]:
+    """Record the send time and result of a sender for a provider."""
+
+    def decorator(func: _F) -> _F:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            try:
+                with metrics.timed("send"):
+                    result = await func(*args, **kwargs)
+            except Exception:
+                metrics.SENDS.labels(provider, "error").inc()
+                raise
+            metrics.SENDS.labels(provider, "success").inc()
+            return result
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
 
 
+_mailgun_clients: dict[tuple, MailgunClient] = {}
+_smtp_pools: dict[tuple, SMTPPool] = {}
+_provider_router: Optional[ProviderRouter] = None
+_token_buckets: Optional[TokenBuckets] = None
+
+
+def start_senders(settings: EmailSettings):
+    """Create the persistent sender clients for the running event loop."""
+    if settings.mailgun:
+        _get_mailgun_client(settings.mailgun)
+    for provider in settings.providers:
+        if provider.mailgun:
+            _get_mailgun_client(provider.mailgun)
+    if settings.use == EmailSenderType.providers:
+        _get_provider_router(settings)
+
+
+def get_sender_stats() -> dict[str, dict[str, Any]]:
+    """Get connection statistics for the persistent sender clients."""
+    stats: dict[str, dict[str, Any]] = {}
+    if _mailgun_clients:
+        clients = _mailgun_clients.values()
+        stats["mailgun"] = {
+            "requests": sum(c.requests for c in clients),
+            "connections": sum(c.connections for c in clients),
+            "reused": sum(c.reused for c in clients),
+        }
+    if _provider_router is not None:
+        stats["providers"] = _provider_router.stats()
+    return stats
+
+
+@_instrumented("mock")
 async def mock_email_sender(email: Email, settings: EmailSettings):
     """Mock email sender."""
     logger.info(
-        "Mock sending email:\n"
-        "\n"
-        f"To: {email.to}\n"
-        f"From: {email.from_}\n"
-        f"Subject: {email.subject}\n"
-        "\n"
-        f"{email.text}\n"
+        "Mock sending email to {} from {}: {}", email.to, email.from_, email.subject
+    )
+    logger.opt(lazy=True).debug("Mock email text:\n\n{}\n", lambda: email.text)
+
+
+@_instrumented("mock")
+async def mock_message_sender(
+    from_: str, to: str, message: bytes, settings: EmailSettings
+):
+    """Mock message sender."""
+    logger.info(
+        "Mock sending message from {} to {} ({} bytes)", from_, to, len(message)
     )
 
 
+@_instrumented("smtp")
 async def smtp_email_sender(email: Email, settings: EmailSettings):
-    """SMTP email sender."""
+    """SMTP email sender, writing the message as it is serialized."""
     smtp_settings = settings.smtp
     if not smtp_settings:
         raise ValueError("SMTP is not configured")
 
-    async with _semaphore:
-        await asyncio.to_thread(_smtp_email_sender, email, smtp_settings)
+    await _pace("smtp", _smtp_bucket(smtp_settings), (email.to,), settings)
+    pool = _get_smtp_pool(smtp_settings)
+    await pool.send_stream(email.from_, (email.to,), lambda: stream_email(email))
 
 
-def _smtp_email_sender(email: Email, settings: SMTPSettings):
-    smtp: smtplib.SMTP
-    if settings.tls == "ssl":
-        smtp = smtplib.SMTP_SSL(settings.server, settings.port)
-    else:
-        smtp = smtplib.SMTP(settings.server, settings.port)
+@_instrumented("smtp")
+async def smtp_message_sender(
+    from_: str, to: str, message: bytes, settings: EmailSettings
+):
+    """SMTP message sender."""
+    smtp_settings = settings.smtp
+    if not smtp_settings:
+        raise ValueError("SMTP is not configured")
+
+    await _pace("smtp", _smtp_bucket(smtp_settings), (to,), settings)
+    pool = _get_smtp_pool(smtp_settings)
+    await pool.send(from_, (to,), message)
+
+
+def _get_smtp_pool(settings: SMTPSettings) -> SMTPPool:
+    key = (settings.server, settings.port, settings.tls, settings.username)
+    pool = _smtp_pools.get(key)
+    if pool is None:
+        from oes.webhooks.email.smtp import SMTPPool
+
+        pool = SMTPPool(settings)
+        _smtp_pools[key] = pool
+    return pool
+
+
+def _smtp_bucket(settings: SMTPSettings) -> tuple[str, Optional[RateLimitSettings]]:
+    name = f"smtp:{settings.server}:{settings.port}:{settings.username or ''}"
+    return name, settings.rate_limit
+
+
+def _mailgun_bucket(
+    settings: MailgunSettings,
+) -> tuple[str, Optional[RateLimitSettings]]:
+    return f"mailgun:{settings.domain}", settings.rate_limit
+
+
+async def _pace(
+    provider: str,
+    bucket: tuple[str, Optional[RateLimitSettings]],
+    recipients: Collection[str],
+    settings: EmailSettings,
+):
+    """Wait for the provider's and the recipient domains' rate limits.
+
+    A token is taken for each recipient.
+    """
+    buckets = []
+    name, rate_limit = bucket
+    if rate_limit is not None:
+        buckets.append(Bucket(name, rate_limit, len(recipients)))
+
+    domain_limits = settings.rate_limits.domains
+    if domain_limits:
+        counts = Counter(get_domain(r) for r in recipients)
+        buckets.extend(
+            Bucket(f"domain:{domain}", domain_limits[domain], count)
+            for domain, count in sorted(counts.items())
+            if domain in domain_limits
+        )
+
+    if buckets:
+        await wait_for_tokens(
+            _get_token_buckets(settings),
+            provider,
+            buckets,
+            settings.rate_limits.max_wait,
+        )
+
 
-    with smtp:
-        if settings.tls == "starttls":
-            smtp.starttls()
+def _get_token_buckets(settings: EmailSettings) -> TokenBuckets:
+    global _token_buckets
+    if _token_buckets is None:
+        _token_buckets = TokenBuckets(settings.rate_limits.path)
+    return _token_buckets
 
-        smtp.login(settings.username, settings.password)
 
-        msg = email.get_message()
-        _set_date(msg)
-        smtp.send_message(msg, from_addr=email.from_, to_addrs=(email.to,))
+def _get_mailgun_client(settings: MailgunSettings) -> MailgunClient:
+    key = (
+        settings.http2,
+        settings.max_connections,
+        settings.max_keepalive_connections,
+        settings.keepalive_expiry,
+        settings.connect_timeout,
+        settings.read_timeout,
+    )
+    client = _mailgun_clients.get(key)
+    if client is None:
+        from oes.webhooks.email.mailgun import MailgunClient
+
+        client = MailgunClient(settings)
+        _mailgun_clients[key] = client
+    return client
+
+
+async def close_senders():
+    """Close any persistent sender connections."""
+    global _provider_router, _token_buckets
+    _provider_router = None
+    if _token_buckets is not None:
+        _token_buckets.close()
+        _token_buckets = None
 
+    clients = list(_mailgun_clients.values())
+    _mailgun_clients.clear()
+    for client in clients:
+        logger.debug(
+            "Mailgun client made {} requests over {} connections",
+            client.requests,
+            client.connections,
+        )
+        await client.close()
 
+    pools = list(_smtp_pools.values())
+    _smtp_pools.clear()
+    for pool in pools:
+        await pool.close()
+
+
+@_instrumented("mailgun")
 async def mailgun_email_sender(email: Email, settings: EmailSettings):
-    """Mailgun API."""
+    """Mailgun API, uploading the message as it is serialized."""
+    mg_cfg = settings.mailgun
+    if not mg_cfg:
+        raise ValueError("Mailgun is not configured")
+
+    url = f"{mg_cfg.base_url}/v3/{mg_cfg.domain}/messages.mime"
+
+    await _pace("mailgun", _mailgun_bucket(mg_cfg), (email.to,), settings)
+    client = _get_mailgun_client(mg_cfg)
+    res = await client.post_stream(
+        url,
+        {"to": email.to},
+        "message",
+        stream_email(email),
+        auth=("api", mg_cfg.api_key),
+    )
+    if res.is_error:
+        logger.error("Mailgun API request returned {}: {}", res.status_code, res.text)
+
+    res.raise_for_status()
+
+
+@_instrumented("mailgun")
+async def mailgun_message_sender(
+    from_: str, to: str, message: bytes, settings: EmailSettings
+):
+    """Mailgun API message sender."""
     mg_cfg = settings.mailgun
     if not mg_cfg:
         raise ValueError("Mailgun is not configured")
@@ -86,29 +394,147 @@ async def mailgun_email_sender(email: Email, settings: EmailSettings):
     user = "api"
     secret = mg_cfg.api_key
 
-    msg = await asyncio.to_thread(email.get_message)
-    _set_date(msg)
+    params = {
+        "to": to,
+    }
+
+    files = {
+        "message": message,
+    }
+
+    await _pace("mailgun", _mailgun_bucket(mg_cfg), (to,), settings)
+    client = _get_mailgun_client(mg_cfg)
+    res = await client.post(
+        url,
+        auth=(user, secret),
+        data=params,
+        files=files,
+    )
+    if res.is_error:
+        logger.error("Mailgun API request returned {}: {}", res.status_code, res.text)
+
+    res.raise_for_status()
+
+
+def get_mailgun_batch_size(settings: EmailSettings) -> int:
+    """Get the maximum number of recipients of a Mailgun batch send.
+
+    A batch takes a token per recipient from the rate limits, so with a rate limit,
+    batches are limited to what it allows within ``rate_limits.max_wait`` seconds.
+    Larger batches would always wait too long, even for an idle limit.
+    """
+    limits = list(settings.rate_limits.domains.values())
+    if settings.mailgun and settings.mailgun.rate_limit:
+        limits.append(settings.mailgun.rate_limit)
+
+    size = MAILGUN_BATCH_SIZE
+    for limit in limits:
+        size = min(size, int(limit.rate * settings.rate_limits.max_wait))
+    return max(size, 1)
+
+
+@_instrumented("mailgun")
+async def mailgun_batch_sender(
+    recipient_variables: Mapping[str, Mapping[str, Any]],
+    message: bytes,
+    settings: EmailSettings,
+):
+    """Send a message to many recipients with a Mailgun batch send.
+
+    Args:
+        recipient_variables: A mapping of up to :func:`get_mailgun_batch_size`
+            recipient addresses to their ``%recipient.*%`` variables.
+        message: The message, containing recipient variable placeholders.
+        settings: The email settings.
+    """
+    mg_cfg = settings.mailgun
+    if not mg_cfg:
+        raise ValueError("Mailgun is not configured")
+
+    if len(recipient_variables) > get_mailgun_batch_size(settings):
+        raise ValueError(f"Too many recipients: {len(recipient_variables)}")
+
+    url = f"{mg_cfg.base_url}/v3/{mg_cfg.domain}/messages.mime"
 
     params = {
-        "to": email.to,
+        "to": list(recipient_variables),
+        "recipient-variables": json.dumps(recipient_variables),
     }
 
     files = {
-        "message": bytes(msg),
+        "message": message,
     }
 
-    res = await _client.post(
+    await _pace("mailgun", _mailgun_bucket(mg_cfg), list(recipient_variables), settings)
+    client = _get_mailgun_client(mg_cfg)
+    res = await client.post(
         url,
-        auth=BasicAuth(user, secret),
+        auth=("api", mg_cfg.api_key),
         data=params,
         files=files,
     )
     if res.is_error:
-        logger.error(f"Mailgun API request returned {res.status_code}: {res.text}")
+        logger.error("Mailgun API request returned {}: {}", res.status_code, res.text)
 
     res.raise_for_status()
 
 
-def _set_date(msg: EmailMessage):
+def make_provider_router(settings: EmailSettings) -> ProviderRouter:
+    """Create a :class:`ProviderRouter` for the configured providers."""
+    providers = []
+    for provider in settings.providers:
+        if provider.use == EmailSenderType.providers:
+            raise ValueError(f"Invalid provider type: {provider.use}")
+        provider_settings = attrs.evolve(  # type: ignore[misc]
+            settings,
+            use=provider.use,
+            smtp=provider.smtp,
+            mailgun=provider.mailgun,
+            providers=(),
+        )
+        providers.append(
+            Provider(
+                provider.name,
+                provider_settings,
+                provider.weight,
+                provider.concurrency,
+                CircuitBreaker(provider.failure_threshold, provider.reset_timeout),
+            )
+        )
+    return ProviderRouter(providers)
+
+
+def _get_provider_router(settings: EmailSettings) -> ProviderRouter:
+    global _provider_router
+    if _provider_router is None:
+        _provider_router = make_provider_router(settings)
+    return _provider_router
+
+
+async def providers_email_sender(email: Email, settings: EmailSettings):
+    """Send with one of several providers, failing over to the others."""
+
+    async def send(provider: Provider):
+        assert provider.settings.use
+        await get_sender(provider.settings.use)(email, provider.settings)
+
+    await _get_provider_router(settings).send(send)
+
+
+async def providers_message_sender(
+    from_: str, to: str, message: bytes, settings: EmailSettings
+):
+    """Send a message with one of several providers, failing over to the others."""
+
+    async def send(provider: Provider):
+        assert provider.settings.use
+        await get_message_sender(provider.settings.use)(
+            from_, to, message, provider.settings
+        )
+
+    await _get_provider_router(settings).send(send)
+
+
+def _format_date() -> str:
     now = datetime.now(tz=timezone.utc).astimezone()
-    msg.add_header("Date", format_datetime(now))
+    return format_datetime(now)
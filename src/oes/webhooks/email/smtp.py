@@ -0,0 +1,257 @@
+"""SMTP module."""
+import asyncio
+import contextlib
+import re
+from collections.abc import AsyncIterable, Callable, Sequence
+from typing import Optional, Union
+
+import aiosmtplib
+from aiosmtplib import (
+    SMTPDataError,
+    SMTPResponseException,
+    SMTPServerDisconnected,
+    SMTPStatus,
+)
+from loguru import logger
+
+from oes.webhooks.settings import SMTPSettings
+
+MessageStream = Callable[[], AsyncIterable[bytes]]
+"""A callable returning the chunks of a message, called again for each attempt."""
+
+WRITE_BUFFER_LIMIT = 256 * 1024
+"""Wait for the data written while streaming a message to drain below this size."""
+
+_line_endings_re = re.compile(rb"\r\n|\n|\r(?!\n)")
+_inner_period_re = re.compile(rb"(?<=\n)\.")
+
+
+class SMTPPool:
+    """A pool of persistent, authenticated SMTP sessions.
+
+    At most ``pool_size`` messages are sent at once. Idle sessions are kept open and
+    reused, probed with ``NOOP`` after ``noop_interval`` seconds, and replaced when the
+    server drops them.
+    """
+
+    def __init__(self, settings: SMTPSettings):
+        self._settings = settings
+        self._semaphore = asyncio.Semaphore(max(settings.pool_size, 1))
+        self._idle: list[tuple[aiosmtplib.SMTP, float]] = []
+
+    async def send(self, sender: str, recipients: Sequence[str], message: bytes):
+        """Send a message.
+
+        Args:
+            sender: The envelope sender.
+            recipients: The envelope recipients.
+            message: The message data.
+        """
+        await self._send_message(sender, recipients, message)
+
+    async def send_stream(
+        self, sender: str, recipients: Sequence[str], message: MessageStream
+    ):
+        """Send a message, writing it to the server as it is produced.
+
+        Args:
+            sender: The envelope sender.
+            recipients: The envelope recipients.
+            message: A callable returning the chunks of the message.
+        """
+        await self._send_message(sender, recipients, message)
+
+    async def _send_message(
+        self,
+        sender: str,
+        recipients: Sequence[str],
+        message: Union[bytes, MessageStream],
+    ):
+        async with self._semaphore:
+            smtp, reused = await self._acquire()
+            try:
+                await self._send(smtp, sender, recipients, message)
+            except SMTPServerDisconnected:
+                if not reused:
+                    raise
+                # the idle session went stale between the probe and the send
+                logger.debug("SMTP session disconnected, reconnecting")
+                smtp = await self._connect()
+                await self._send(smtp, sender, recipients, message)
+
+    async def close(self):
+        """Close all idle sessions."""
+        idle = self._idle
+        self._idle = []
+        for smtp, _ in idle:
+            await _quit(smtp)
+
+    async def _send(
+        self,
+        smtp: aiosmtplib.SMTP,
+        sender: str,
+        recipients: Sequence[str],
+        message: Union[bytes, MessageStream],
+    ):
+        try:
+            if isinstance(message, bytes):
+                await smtp.sendmail(sender, recipients, message)
+            else:
+                await _sendmail_stream(smtp, sender, recipients, message())
+        except SMTPResponseException:
+            # the server rejected the message, the session is still usable
+            self._release(smtp)
+            raise
+        except BaseException:
+            smtp.close()
+            raise
+        else:
+            self._release(smtp)
+
+    async def _acquire(self) -> tuple[aiosmtplib.SMTP, bool]:
+        loop = asyncio.get_running_loop()
+        while self._idle:
+            smtp, last_used = self._idle.pop()
+            idle_time = loop.time() - last_used
+            if not smtp.is_connected or idle_time > self._settings.max_idle:
+                await _quit(smtp)
+            elif idle_time <= self._settings.noop_interval or await _probe(smtp):
+                return smtp, True
+
+        return await self._connect(), False
+
+    def _release(self, smtp: aiosmtplib.SMTP):
+        if smtp.is_connected:
+            self._idle.append((smtp, asyncio.get_running_loop().time()))
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        settings = self._settings
+        smtp = aiosmtplib.SMTP(
+            hostname=settings.server,
+            port=settings.port,
+            username=settings.username or None,
+            password=settings.password or None,
+            timeout=settings.timeout,
+            use_tls=settings.tls == "ssl",
+            start_tls=settings.tls == "starttls",
+        )
+        await smtp.connect()
+        logger.debug("Connected to SMTP server {}:{}", settings.server, settings.port)
+        return smtp
+
+
+async def _sendmail_stream(
+    smtp: aiosmtplib.SMTP,
+    sender: str,
+    recipients: Sequence[str],
+    chunks: AsyncIterable[bytes],
+):
+    """Send a message like :meth:`aiosmtplib.SMTP.sendmail`, writing it in chunks.
+
+    Uses the ``DATA`` handling of aiosmtplib's protocol, so the aiosmtplib version is
+    pinned in ``pyproject.toml``.
+    """
+    try:
+        await smtp.mail(sender)
+        for recipient in recipients:
+            await smtp.rcpt(recipient)
+
+        response = await smtp.execute_command(b"DATA")
+        if response.code != SMTPStatus.start_input:
+            raise SMTPDataError(response.code, response.message)
+
+        protocol = smtp.protocol
+        if protocol is None:
+            raise SMTPServerDisconnected("Connection lost")
+        encoder = DataEncoder()
+        async for chunk in chunks:
+            protocol.write(encoder.encode(chunk))
+            # bound the memory used by data the server has not read yet
+            await _wait_for_write_buffer(protocol.transport, WRITE_BUFFER_LIMIT)
+        protocol.write(encoder.finish())
+
+        response = await protocol.read_response(timeout=smtp.timeout)
+        if response.code != SMTPStatus.completed:
+            raise SMTPDataError(response.code, response.message)
+    except SMTPResponseException:
+        with contextlib.suppress(ConnectionError, SMTPResponseException):
+            await smtp.rset()
+        raise
+
+
+async def _wait_for_write_buffer(
+    transport: Optional[asyncio.BaseTransport], limit: int
+):
+    """Wait until a transport's write buffer is no larger than ``limit`` bytes.
+
+    aiosmtplib's protocol only waits for the buffer to drain in a private method,
+    so the buffer size is polled instead, a few times per chunk at most when the
+    server keeps up. This is only used while streaming large messages.
+    """
+    delay = 0.001
+    while True:
+        if not isinstance(transport, asyncio.WriteTransport) or transport.is_closing():
+            raise SMTPServerDisconnected("Connection lost")
+        if transport.get_write_buffer_size() <= limit:
+            return
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+
+class DataEncoder:
+    """Encodes message chunks for the SMTP ``DATA`` command.
+
+    Converts line endings to CRLF and escapes lines starting with a period, across
+    chunk boundaries.
+    """
+
+    def __init__(self):
+        self._line_start = True
+        self._pending_cr = False
+
+    def encode(self, chunk: bytes) -> bytes:
+        """Encode a chunk."""
+        if self._pending_cr:
+            chunk = b"\r" + chunk
+        # a CR at the end may be the start of a CRLF
+        self._pending_cr = chunk.endswith(b"\r")
+        if self._pending_cr:
+            chunk = chunk[:-1]
+        if not chunk:
+            return b""
+
+        chunk = _line_endings_re.sub(b"\r\n", chunk)
+        chunk = _inner_period_re.sub(b"..", chunk)
+        if self._line_start and chunk.startswith(b"."):
+            chunk = b"." + chunk
+        self._line_start = chunk.endswith(b"\n")
+        return chunk
+
+    def finish(self) -> bytes:
+        """Get the end of the data, including the terminating line."""
+        end = b""
+        if self._pending_cr:
+            self._pending_cr = False
+            end = b"\r\n"
+        elif not self._line_start:
+            end = b"\r\n"
+        return end + b".\r\n"
+
+
+async def _probe(smtp: aiosmtplib.SMTP) -> bool:
+    try:
+        await smtp.noop()
+    except aiosmtplib.SMTPException:
+        smtp.close()
+        return False
+    else:
+        return True
+
+
+async def _quit(smtp: aiosmtplib.SMTP, timeout: Optional[float] = 5):
+    if not smtp.is_connected:
+        return
+    try:
+        await smtp.quit(timeout=timeout)
+    except aiosmtplib.SMTPException:
+        smtp.close()
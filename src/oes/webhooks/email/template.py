@@ -1,14 +1,19 @@
 """Template module."""
 import itertools
 import mimetypes
-from collections.abc import Iterator
+import re
+from collections.abc import Callable, Collection, Iterator, Mapping
 from pathlib import Path
-from typing import Optional, Union
+from typing import Any, Optional, Union
 
 import jinja2.sandbox
-from jinja2 import ChainableUndefined
+from attrs import frozen
+from jinja2 import ChainableUndefined, meta, nodes
 
-from oes.webhooks.email.html import process_html
+from oes.webhooks import metrics
+from oes.webhooks.email.cache import AttachmentCache, attachment_cache
+from oes.webhooks.email.fragments import FragmentCache, FragmentCacheExtension
+from oes.webhooks.email.html import precompile_html, process_html
 from oes.webhooks.email.types import Attachment, AttachmentType
 
 
@@ -17,11 +22,19 @@ class Attachments:
 
     _base_path: Path
     _attachments: dict[str, Attachment]
+    _cache: AttachmentCache
 
-    def __init__(self, base_path: Path):
+    def __init__(self, base_path: Path, cache: Optional[AttachmentCache] = None):
+        """Create an :class:`Attachments` instance.
+
+        Args:
+            base_path: The base template directory.
+            cache: The :class:`AttachmentCache`. Defaults to the process-wide cache.
+        """
         self._base_path = base_path
         self._attachments = {}
         self._ids = itertools.count(1)
+        self._cache = cache if cache is not None else attachment_cache
 
     def __iter__(self) -> Iterator[Attachment]:
         return iter(self._attachments.values())
@@ -49,8 +62,12 @@ class Attachments:
             raise ValueError(f"Path is not within the template directory: {path}")
 
         id_ = f"attachment{next(self._ids)}"
-        with path_obj.open("rb") as f:
-            data = f.read()
+        encoded: Optional[str]
+        if path_obj.stat().st_size >= self._cache.stream_size:
+            # encoded from the file while the message is sent
+            encoded = None
+        else:
+            encoded = self._cache.get(path_obj).encoded
 
         filename = name if name is not None else path_obj.parts[-1]
 
@@ -61,7 +78,8 @@ class Attachments:
         self._attachments[id_] = Attachment(
             id=id_,
             name=filename,
-            data=data,
+            data=path_obj.resolve(),
+            encoded=encoded,
             media_type=media_type,
             attachment_type=AttachmentType.inline
             if inline
@@ -139,26 +157,419 @@ class Subject:
         return bool(str(self))
 
 
-def get_environment(base_path: Path) -> jinja2.Environment:
+class RecipientVariables:
+    """Placeholders for Mailgun recipient variables.
+
+    Rendering ``recipient.name`` produces ``%recipient.name%``, which Mailgun replaces
+    with each recipient's value in a batch send.
+    """
+
+    def __getattr__(self, name: str) -> str:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return f"%recipient.{name}%"
+
+    def __getitem__(self, name: str) -> str:
+        return f"%recipient.{name}%"
+
+    def __str__(self) -> str:
+        return "%recipient%"
+
+
+_extends_re = re.compile(r"""\s*extends\s+(["'])([^"']+)\1\s*""")
+_newline_re = re.compile(r"\r\n?")
+
+_tag_types = {
+    "block_begin": ("block", "block_end"),
+    "variable_begin": ("variable", "variable_end"),
+    "comment_begin": ("comment", "comment_end"),
+    "raw_begin": ("raw", "raw_end"),
+}
+
+
+@frozen
+class _Tag:
+    """A Jinja tag and its position in the source."""
+
+    kind: str
+    """``block``, ``variable``, ``comment`` or ``raw``."""
+
+    name: str
+    """The first name in the tag, i.e. the statement of a ``block`` tag."""
+
+    args: str
+    """The source between the tag's delimiters."""
+
+    start: int
+    end: int
+
+    names: frozenset[str]
+    """All the names in the tag."""
+
+    def text(self, source: str) -> str:
+        """Get the tag from the source it was found in."""
+        return source[slice(self.start, self.end)]
+
+
+class PrecompilingLoader(jinja2.BaseLoader):
+    """Loader that inlines CSS and minifies HTML templates when they are loaded.
+
+    ``.html`` templates are processed with :func:`precompile_html`. Static
+    ``extends`` inheritance is flattened first, so styles from a parent template
+    apply to the blocks of its children. Templates that can't be processed are
+    loaded unchanged, and must be processed with :func:`process_html` when rendered.
+    """
+
+    def __init__(self, loader: jinja2.BaseLoader):
+        self.loader = loader
+        self._precompiled: set[str] = set()
+
+    def get_source(
+        self, environment: jinja2.Environment, template: str
+    ) -> tuple[str, Optional[str], Optional[Callable[[], bool]]]:
+        source, filename, uptodate = self.loader.get_source(environment, template)
+        if not template.endswith(".html"):
+            return source, filename, uptodate
+
+        flattened = _flatten_template(environment, self.loader, source)
+        result = precompile_html(flattened[0]) if flattened is not None else None
+        if flattened is None or result is None:
+            self._precompiled.discard(template)
+            return source, filename, uptodate
+
+        uptodates = [f for f in (uptodate, *flattened[1]) if f is not None]
+        self._precompiled.add(template)
+        return result, filename, lambda: all(f() for f in uptodates)
+
+    def list_templates(self) -> list[str]:
+        return self.loader.list_templates()
+
+    def is_precompiled(self, template: str) -> bool:
+        """Whether the named template was loaded precompiled."""
+        return template in self._precompiled
+
+
+def _find_tags(env: jinja2.Environment, source: str) -> Optional[list[_Tag]]:
+    """Find the tags in a template with the environment's lexer.
+
+    Comments and ``raw`` blocks are single tags, so their contents are not mistaken
+    for statements. Returns ``None`` if the source can't be tokenized.
+    """
+    try:
+        tokens = list(env.lexer.tokeniter(source, None))
+    except jinja2.exceptions.TemplateSyntaxError:
+        return None
+
+    tags = []
+    pos = 0
+    current: Optional[tuple[str, str, int, int]] = None
+    names: list[str] = []
+    for _, token_type, value in tokens:
+        # the tokens cover the source, except whitespace removed by "-"
+        token_start = source.find(value, pos)
+        if token_start < 0 or source[pos:token_start].strip():
+            return None
+        pos = token_start + len(value)
+
+        if current is None:
+            if token_type not in _tag_types:
+                # data, or line statements which are not supported
+                if token_type != "data":
+                    return None
+                continue
+            kind, end_type = _tag_types[token_type]
+            current = (kind, end_type, token_start, pos)
+            names = []
+        elif token_type == "name":
+            names.append(value)
+        elif token_type == current[1]:
+            kind, _, tag_start, args_start = current
+            tags.append(
+                _Tag(
+                    kind=kind,
+                    name=names[0] if names else "",
+                    args=source[args_start:token_start],
+                    start=tag_start,
+                    end=token_start + len(value.rstrip()),
+                    names=frozenset(names),
+                )
+            )
+            current = None
+
+    return tags if current is None else None
+
+
+def _flatten_template(
+    env: jinja2.Environment, loader: jinja2.BaseLoader, source: str
+) -> Optional[tuple[str, list[Optional[Callable[[], bool]]]]]:
+    """Merge a template with the templates it extends.
+
+    Returns:
+        The merged source and the ``uptodate`` functions of the parent templates, or
+        ``None`` if the inheritance can't be resolved statically.
+    """
+    # positions are found in the source as the lexer sees it
+    source = _newline_re.sub("\n", source)
+    tags = _find_tags(env, source)
+    if tags is None:
+        return None
+
+    extends = [t for t in tags if t.kind == "block" and t.name == "extends"]
+    if not extends:
+        return source, []
+
+    # extends must be the first tag, with a constant name
+    name_match = _extends_re.fullmatch(extends[0].args)
+    if (
+        len(extends) > 1
+        or tags[0] is not extends[0]
+        or source[: extends[0].start].strip()
+        or name_match is None
+    ):
+        return None
+
+    child_blocks = _find_blocks(source, tags)
+    if child_blocks is None:
+        return None
+
+    # only blocks and comments may follow extends
+    outside = _remove_top_level_blocks(source, tags, extends[0].end)
+    if outside is None or outside.strip():
+        return None
+
+    try:
+        parent_source, _, parent_uptodate = loader.get_source(env, name_match.group(2))
+    except jinja2.exceptions.TemplateNotFound:
+        return None
+
+    parent = _flatten_template(env, loader, parent_source)
+    if parent is None:
+        return None
+
+    merged = _replace_blocks(env, parent[0], child_blocks)
+    if merged is None:
+        return None
+
+    return merged, [parent_uptodate, *parent[1]]
+
+
+def _is_statement(tag: _Tag, name: str) -> bool:
+    return tag.kind == "block" and tag.name == name
+
+
+def _find_blocks(
+    source: str, tags: list[_Tag]
+) -> Optional[dict[str, tuple[str, list[str]]]]:
+    """Map block names to their opening tag and content, at any depth.
+
+    The content is split where it calls ``{{ super() }}``. Returns ``None`` if
+    ``super`` is used any other way, or in a nested block.
+    """
+    blocks = {}
+    stack: list[tuple[_Tag, list[_Tag]]] = []
+    for tag in tags:
+        if "super" in tag.names:
+            if (
+                len(stack) != 1
+                or tag.kind != "variable"
+                or tag.args.strip() != "super()"
+            ):
+                return None
+            stack[-1][1].append(tag)
+        elif _is_statement(tag, "block"):
+            stack.append((tag, []))
+        elif _is_statement(tag, "endblock"):
+            if not stack:
+                return None
+            start, supers = stack.pop()
+            parts = []
+            pos = start.end
+            for call in supers:
+                parts.append(source[slice(pos, call.start)])
+                pos = call.end
+            parts.append(source[slice(pos, tag.start)])
+            blocks[_block_name(start)] = (start.text(source), parts)
+    return blocks if not stack else None
+
+
+def _block_name(tag: _Tag) -> str:
+    args = tag.args.split()
+    return args[1] if len(args) > 1 else ""
+
+
+def _remove_top_level_blocks(
+    source: str, tags: list[_Tag], start: int
+) -> Optional[str]:
+    """Remove the top-level blocks and comments from the part after ``start``."""
+    parts = []
+    pos = start
+    depth = 0
+    for tag in tags:
+        if tag.start < start:
+            continue
+        if _is_statement(tag, "block"):
+            if depth == 0:
+                parts.append(source[slice(pos, tag.start)])
+            depth += 1
+        elif _is_statement(tag, "endblock"):
+            depth -= 1
+            if depth < 0:
+                return None
+            if depth == 0:
+                pos = tag.end
+        elif tag.kind == "comment" and depth == 0:
+            parts.append(source[slice(pos, tag.start)])
+            pos = tag.end
+    parts.append(source[pos:])
+    return "".join(parts)
+
+
+def _replace_blocks(
+    env: jinja2.Environment,
+    source: str,
+    child_blocks: dict[str, tuple[str, list[str]]],
+) -> Optional[str]:
+    """Replace the content of blocks in ``source`` overridden in ``child_blocks``."""
+    tags = _find_tags(env, source)
+    if tags is None:
+        return None
+
+    parts = []
+    pos = 0
+    depth = 0
+    replacing: Optional[_Tag] = None
+    for tag in tags:
+        if _is_statement(tag, "block"):
+            if replacing is None and _block_name(tag) in child_blocks:
+                replacing = tag
+                depth = 0
+            elif replacing is not None:
+                depth += 1
+        elif _is_statement(tag, "endblock") and replacing is not None:
+            if depth > 0:
+                depth -= 1
+                continue
+            open_tag, content = child_blocks[_block_name(replacing)]
+            original = source[slice(replacing.end, tag.start)]
+            parts.append(source[slice(pos, replacing.start)])
+            parts.append(open_tag + original.join(content) + tag.text(source))
+            pos = tag.end
+            replacing = None
+
+    if replacing is not None:
+        return None
+
+    parts.append(source[pos:])
+    return "".join(parts)
+
+
+def get_environment(
+    base_path: Path,
+    precompile_html: bool = False,
+    fragment_cache_size: int = 1024,
+    auto_reload: bool = True,
+) -> jinja2.Environment:
     """Configure a Jinja2 environment.
 
     Args:
         base_path: The base template directory.
+        precompile_html: Whether to inline CSS in HTML templates when they are loaded.
+        fragment_cache_size: The maximum number of fragments cached by the
+            ``cache`` tag.
+        auto_reload: Whether to check if a template changed each time it is used.
+            If not, changed templates must be evicted from the environment's cache.
     """
-    loader = jinja2.FileSystemLoader(base_path)
+    loader: jinja2.BaseLoader = jinja2.FileSystemLoader(base_path)
+    if precompile_html:
+        loader = PrecompilingLoader(loader)
     environment = jinja2.sandbox.ImmutableSandboxedEnvironment(
         loader=loader,
         undefined=ChainableUndefined,
+        extensions=[FragmentCacheExtension],
+        auto_reload=auto_reload,
     )
+    get_fragment_cache(environment).max_entries = fragment_cache_size
     return environment
 
 
+def get_fragment_cache(env: jinja2.Environment) -> FragmentCache:
+    """Get the fragment cache of an environment."""
+    return getattr(env, "fragment_cache")
+
+
+def get_template_variables(
+    env: jinja2.Environment, template_name: str, placeholders: Collection[str] = ()
+) -> Optional[frozenset[str]]:
+    """Get the names of the variables a template uses from its context.
+
+    Templates it extends, includes or imports are included.
+
+    Args:
+        env: The Jinja2 environment.
+        template_name: The template name, with its extension.
+        placeholders: Variables that will hold placeholders, like
+            :class:`RecipientVariables`, which only render correctly when output as
+            they are, e.g. ``{{ recipient.name }}``.
+
+    Returns:
+        The variable names, or ``None`` if a referenced template name is dynamic or
+        a placeholder variable is used any other way.
+    """
+    if env.loader is None:
+        raise jinja2.exceptions.TemplateNotFound(template_name)
+
+    names: set[str] = set()
+    seen = set()
+    pending = [template_name]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+
+        source, _, _ = env.loader.get_source(env, name)
+        ast = env.parse(source)
+        names.update(meta.find_undeclared_variables(ast))
+        if placeholders and not _outputs_only(ast, placeholders):
+            return None
+        for ref in meta.find_referenced_templates(ast):
+            if ref is None:
+                return None
+            pending.append(ref)
+
+    return frozenset(names)
+
+
+def _outputs_only(ast: nodes.Template, names: Collection[str]) -> bool:
+    """Whether the variables are only output directly, or an attribute of them.
+
+    Placeholders would be wrong in conditions, loops, filters, tests and arguments.
+    """
+    output = set()
+    for node in ast.find_all(nodes.Output):
+        for child in node.nodes:
+            if isinstance(child, nodes.Getattr) or (
+                isinstance(child, nodes.Getitem)
+                and isinstance(child.arg, nodes.Const)
+                and isinstance(child.arg.value, str)
+            ):
+                child = child.node
+            if isinstance(child, nodes.Name):
+                output.add(id(child))
+
+    return all(
+        id(node) in output
+        for node in ast.find_all(nodes.Name)
+        if node.name in names and node.ctx == "load"
+    )
+
+
 def render_message(
     env: jinja2.Environment,
     subject: Subject,
     attachments: Attachments,
     template_name: str,
-    data: dict,
+    data: Mapping[str, Any],
 ) -> tuple[str, Optional[str]]:
     """Render the text and HTML messages for an email.
 
@@ -188,36 +599,57 @@ def render_message(
             f"{template_name}.html",
             data,
         )
-        html = process_html(html)
+        if not _is_precompiled(env, f"{template_name}.html"):
+            with metrics.timed("process_html"):
+                html = process_html(html)
     except jinja2.exceptions.TemplateNotFound:
         html = None
 
     return text, html
 
 
+def _is_precompiled(env: jinja2.Environment, template_name: str) -> bool:
+    loader = env.loader
+    return isinstance(loader, PrecompilingLoader) and loader.is_precompiled(
+        template_name
+    )
+
+
 def render_template(
     env: jinja2.Environment,
     subject: Subject,
     attachments: Attachments,
     template_name: str,
-    data: dict,
+    data: Mapping[str, Any],
 ) -> str:
-    """Load and render the given template."""
-    tmpl = env.get_template(
-        template_name,
-        globals={
-            "set_subject": subject.set_subject,
-            "default_subject": subject.set_subject_or_default,
-            "attach": attachments.attach,
-            "inline": attachments.inline,
-        },
-    )
+    """Load and render the given template.
+
+    The subject and attachment functions are passed in the render context, so the
+    cached template is never modified and may be rendered by several threads at once.
+    """
+    tmpl = env.get_template(template_name)
 
     result = tmpl.render(
         {
             **data,
-            "subject": subject,
+            **get_template_context(subject, attachments),
         }
     )
 
     return result
+
+
+def get_template_context(subject: Subject, attachments: Attachments) -> dict:
+    """Get the per-render template context for a message.
+
+    Args:
+        subject: The message's :class:`Subject`.
+        attachments: The message's :class:`Attachments`.
+    """
+    return {
+        "subject": subject,
+        "set_subject": subject.set_subject,
+        "default_subject": subject.set_subject_or_default,
+        "attach": attachments.attach,
+        "inline": attachments.inline,
+    }
@@ -1,13 +1,17 @@
 """Email webhook types."""
-from collections.abc import Iterable, Sequence
+import binascii
+from collections.abc import Iterable, Mapping, Sequence
+from email import policy
 from email.message import EmailMessage, MIMEPart
 from enum import Enum
-from typing import BinaryIO, Optional, Union
+from pathlib import Path
+from typing import Any, BinaryIO, Optional, Union
 
-from attrs import frozen
+from attrs import field, frozen
 from typing_extensions import TypeAlias
 
-AttachmentData: TypeAlias = Union[bytes, bytearray, memoryview, BinaryIO]
+AttachmentData: TypeAlias = Union[bytes, bytearray, memoryview, BinaryIO, Path]
+"""Attachment data, or a file read each time the message is serialized."""
 
 
 class AttachmentType(str, Enum):
@@ -36,11 +40,18 @@ class Attachment:
     attachment_type: AttachmentType = AttachmentType.attachment
     """The attachment type."""
 
+    encoded: Optional[str] = field(default=None, eq=False)
+    """The data, already base64 encoded with :func:`encode_base64`."""
+
     def make_attachment(self) -> MIMEPart:
         """Return a :class:`MIMEPart` for this attachment."""
         part = MIMEPart()
 
-        if hasattr(self.data, "read"):
+        if self.encoded is not None:
+            content = b""
+        elif isinstance(self.data, Path):
+            content = self.data.read_bytes()
+        elif hasattr(self.data, "read"):
             content = self.data.read()
         else:
             content = bytes(self.data)
@@ -57,9 +68,26 @@ class Attachment:
             filename=self.name,
         )
 
+        if self.encoded is not None:
+            # the headers are the same, just swap in the shared encoded body
+            part.set_payload(self.encoded)
+
         return part
 
 
+def encode_base64(data: Union[bytes, bytearray, memoryview]) -> str:
+    """Base64 encode attachment data the same way :class:`MIMEPart` does."""
+    line_length = policy.default.max_line_length
+    assert line_length is not None
+    bytes_per_line = line_length // 4 * 3
+    view = memoryview(data)
+    lines = []
+    for start in range(0, len(view), bytes_per_line):
+        end = start + bytes_per_line
+        lines.append(binascii.b2a_base64(view[start:end]).decode("ascii"))
+    return "".join(lines)
+
+
 @frozen(kw_only=True)
 class Email:
     """An email."""
@@ -131,6 +159,15 @@ class EmailHookBody:
     subject: Optional[str] = None
 
 
+@frozen(kw_only=True)
+class EmailBatchHookBody:
+    """The body of a batch email hook."""
+
+    recipients: Sequence[Mapping[str, Any]]
+    from_: Optional[str] = None
+    subject: Optional[str] = None
+
+
 def _make_text_part(text: str) -> MIMEPart:
     part = MIMEPart()
     part.set_content(text)
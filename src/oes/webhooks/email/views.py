@@ -1,24 +1,44 @@
 """Email views."""
 import asyncio
+import functools
+import logging
 import traceback
-from pathlib import Path
-from typing import Optional
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
 
 import jinja2
-from cattrs import BaseValidationError, ClassValidationError
+from cattrs import BaseValidationError
 from loguru import logger
-from quart import Response, request
-from werkzeug.exceptions import NotFound, UnprocessableEntity
+from quart import Response, jsonify, request
+from werkzeug.exceptions import NotFound, ServiceUnavailable, UnprocessableEntity
 
+from oes.webhooks import metrics
+from oes.webhooks.admission import admitted, limit
 from oes.webhooks.app import app
-from oes.webhooks.email.sender import get_sender
-from oes.webhooks.email.template import Attachments, Subject, render_message
-from oes.webhooks.email.types import Email, EmailHookBody
+from oes.webhooks.email.dispatch import dispatch_email, render_email
+from oes.webhooks.email.queue import EmailQueue, run_delivery_worker
+from oes.webhooks.email.ratelimit import RateLimited
+from oes.webhooks.email.render import RenderPool
+from oes.webhooks.email.sender import (
+    close_senders,
+    get_mailgun_batch_size,
+    get_message_sender,
+    get_sender_stats,
+    mailgun_batch_sender,
+    serialize_batch_email,
+    start_senders,
+)
+from oes.webhooks.email.template import RecipientVariables, get_template_variables
+from oes.webhooks.email.types import EmailBatchHookBody
+from oes.webhooks.email.watch import TemplateInvalidator, TemplateWatcher
+from oes.webhooks.ndjson import is_ndjson, iter_records, process_records
 from oes.webhooks.serialization import converter
-from oes.webhooks.settings import Settings
+from oes.webhooks.settings import EmailSenderType, Settings
 
 
 @app.post("/email/<path:path>")
+@admitted("email")
 async def send_email(path: str) -> Response:
     """Send an email."""
     settings: Settings = app.config["settings"]
@@ -26,59 +46,302 @@ async def send_email(path: str) -> Response:
     if not settings.email.use:
         raise NotFound
 
-    sender = get_sender(settings.email.use)
+    if is_ndjson(request):
+        results = await process_records(
+            iter_records(request.body),
+            functools.partial(_ingest_email, path),
+            settings.email.batch_concurrency,
+        )
+        return jsonify({"results": results})
 
-    body = await request.get_json()
-    template_path = settings.email.template_path
-    env = app.config["email_template_env"]
+    with metrics.timed("parse"):
+        body = await request.get_json()
 
     try:
-        _email = await asyncio.to_thread(
-            _make_email, env, template_path, path, body, settings.email.email_from
-        )
+        queued = await dispatch_email(path, body)
     except BaseValidationError:
-        logger.error(f"Invalid email hook body:\n{traceback.format_exc()}")
+        logger.error("Invalid email hook body:\n{}", traceback.format_exc())
         raise UnprocessableEntity
     except jinja2.exceptions.TemplateNotFound:
-        logger.error(f"The template {path!r} was not found.")
+        logger.error("The template {!r} was not found.", path)
         raise NotFound
+    except RateLimited as e:
+        logger.warning("Not sending email: {}", e)
+        raise ServiceUnavailable(retry_after=e.retry_after)
 
-    await sender(_email, settings.email)
+    return Response(status=202 if queued else 204)
 
-    logger.info(f"Sent message to {_email.to}")
 
-    return Response(status=204)
+@app.post("/email/<path:path>/batch")
+@admitted("email")
+async def send_email_batch(path: str) -> Response:
+    """Send an email to a list of recipients."""
+    settings: Settings = app.config["settings"]
 
+    if not settings.email.use:
+        raise NotFound
 
-def _make_email(
-    env: jinja2.Environment,
-    base_path: Path,
-    path: str,
-    body: dict,
-    default_from: Optional[str],
-) -> Email:
+    with metrics.timed("parse"):
+        body = await request.get_json()
     try:
-        hook = converter.structure(body, EmailHookBody)
+        with metrics.timed("structure"):
+            batch = converter.structure(body, EmailBatchHookBody)
+    except Exception:
+        logger.error("Invalid email batch hook body:\n{}", traceback.format_exc())
+        raise UnprocessableEntity
+
+    shared = {k: v for k, v in body.items() if k != "recipients"}
+    env = app.config["email_template_env"]
+
+    try:
+        use_batch = settings.email.use == EmailSenderType.mailgun and (
+            await metrics.to_thread("render", _can_batch, env, path, batch.recipients)
+        )
+    except jinja2.exceptions.TemplateNotFound:
+        logger.error("The template {!r} was not found.", path)
+        raise NotFound
+
+    if use_batch:
+        results = await _send_mailgun_batch(path, shared, batch.recipients, settings)
+    else:
+        results = await _send_fan_out(path, shared, batch.recipients, settings)
+
+    return jsonify({"results": results})
+
+
+async def _ingest_email(path: str, record: Any) -> dict[str, Any]:
+    if not isinstance(record, dict):
+        return _result(None, "error", "Not an object")
+
+    try:
+        queued = await dispatch_email(path, record)
     except Exception as e:
-        raise ClassValidationError(str(e), (e,), EmailHookBody) from e
+        logger.error("Failed to send message to {}: {}", record.get("to"), e)
+        return _result(record.get("to"), "error", str(e))
+    else:
+        return _result(record.get("to"), "queued" if queued else "sent")
+
+
+_BATCH_PLACEHOLDERS = ("recipient", "to")
+
+
+def _can_batch(
+    env: jinja2.Environment, path: str, recipients: Sequence[Mapping[str, Any]]
+) -> bool:
+    """Whether a message rendered once with placeholders is right for every recipient.
+
+    Per-recipient data must only be used via ``recipient`` variables, and
+    ``recipient`` and ``to`` must only be output as they are.
+    """
+    used = get_template_variables(env, f"{path}.txt", _BATCH_PLACEHOLDERS)
+    if used is None:
+        return False
+
+    try:
+        html_used = get_template_variables(env, f"{path}.html", _BATCH_PLACEHOLDERS)
+    except jinja2.exceptions.TemplateNotFound:
+        html_used = frozenset()
+    if html_used is None:
+        return False
+
+    used = used | html_used
+    for recipient in recipients:
+        keys = set(recipient) - {"to"}
+        if "from" in keys or "subject" in keys or keys & used:
+            return False
+
+    return True
+
+
+async def _send_mailgun_batch(
+    path: str,
+    shared: Mapping[str, Any],
+    recipients: Sequence[Mapping[str, Any]],
+    settings: Settings,
+) -> list[dict[str, Any]]:
+    body = {**shared, "to": "%recipient%", "recipient": RecipientVariables()}
+    try:
+        _email = await render_email(path, body)
+    except BaseValidationError as e:
+        metrics.EMAILS.labels(path, "error").inc(len(recipients))
+        return [_result(r.get("to"), "error", str(e)) for r in recipients]
+
+    message = await metrics.to_thread("serialize", serialize_batch_email, _email)
+    if message is None:
+        logger.debug("The message can't be batched, sending one per recipient")
+        return await _send_fan_out(path, shared, recipients, settings)
+
+    results: list[dict[str, Any]] = []
+    batch_size = get_mailgun_batch_size(settings.email)
+    for start in range(0, len(recipients), batch_size):
+        end = start + batch_size
+        chunk = recipients[start:end]
+        valid = [r for r in chunk if isinstance(r.get("to"), str)]
+        results.extend(
+            _result(r.get("to"), "error", "Missing 'to'")
+            for r in chunk
+            if not isinstance(r.get("to"), str)
+        )
+        metrics.EMAILS.labels(path, "error").inc(len(chunk) - len(valid))
+
+        recipient_vars = {
+            r["to"]: {k: v for k, v in r.items() if k != "to"} for r in valid
+        }
+        try:
+            async with limit("mailgun"):
+                await mailgun_batch_sender(recipient_vars, message, settings.email)
+        except Exception as e:
+            logger.error("Batch send to {} recipients failed: {}", len(valid), e)
+            metrics.EMAILS.labels(path, "error").inc(len(valid))
+            results.extend(_result(r["to"], "error", str(e)) for r in valid)
+        else:
+            logger.info("Sent batch message to {} recipients", len(valid))
+            metrics.EMAILS.labels(path, "sent").inc(len(valid))
+            results.extend(_result(r["to"], "sent") for r in valid)
+
+    return results
+
+
+async def _send_fan_out(
+    path: str,
+    shared: Mapping[str, Any],
+    recipients: Sequence[Mapping[str, Any]],
+    settings: Settings,
+) -> list[dict[str, Any]]:
+    semaphore = asyncio.Semaphore(max(settings.email.batch_concurrency, 1))
+
+    async def send_one(recipient: Mapping[str, Any]) -> dict[str, Any]:
+        body = {**shared, **recipient, "recipient": recipient}
+        async with semaphore:
+            try:
+                queued = await dispatch_email(path, body)
+            except Exception as e:
+                logger.error("Failed to send message to {}: {}", body.get("to"), e)
+                return _result(body.get("to"), "error", str(e))
+            else:
+                return _result(body.get("to"), "queued" if queued else "sent")
+
+    return list(await asyncio.gather(*(send_one(r) for r in recipients)))
 
-    subject = Subject(hook.subject)
-    attachments = Attachments(base_path)
 
-    text, html = render_message(env, subject, attachments, path, body)
+def _result(to: Any, status: str, error: Optional[str] = None) -> dict[str, Any]:
+    result = {"to": to, "status": status}
+    if error is not None:
+        result["error"] = error
+    return result
 
-    from_ = hook.from_ or default_from
-    if not from_:
-        exc = ValueError("Default 'email_from` is not set.")
-        raise ClassValidationError(str(exc), (exc,), EmailHookBody)
 
-    email = Email(
-        to=hook.to,
-        from_=from_,
-        subject=str(subject) or None,
-        text=text,
-        html=html,
-        attachments=tuple(attachments),
+@app.get("/email-queue")
+async def email_queue_stats() -> Response:
+    """Get email queue statistics."""
+    queue: Optional[EmailQueue] = app.config.get("email_queue")
+    if queue is None:
+        raise NotFound
+
+    stats = await metrics.to_thread("queue", queue.stats)
+    return jsonify(
+        {
+            "depth": stats.depth,
+            "oldest_age": stats.oldest_age,
+            "retrying": stats.retrying,
+            "attempts": stats.attempts,
+            "failed": stats.failed,
+        }
     )
 
-    return email
+
+@app.get("/email-senders")
+async def email_sender_stats() -> Response:
+    """Get sender connection and provider statistics."""
+    return jsonify(get_sender_stats())
+
+
+@app.before_serving
+async def start_email_senders():
+    """Create the sender clients in the worker's event loop."""
+    settings: Settings = app.config["settings"]
+    if settings.email.use:
+        start_senders(settings.email)
+
+
+@app.before_serving
+async def start_template_watcher():
+    """Watch the templates for changes, if configured."""
+    settings: Settings = app.config["settings"]
+    if settings.email.use and settings.email.watch_templates:
+        env = app.config["email_template_env"]
+        watcher = TemplateWatcher(
+            TemplateInvalidator(env, settings.email.template_path)
+        )
+        watcher.start()
+        app.config["email_template_watcher"] = watcher
+
+
+@app.before_serving
+async def start_render_executor():
+    """Start the render thread pool and process pool, if configured."""
+    settings: Settings = app.config["settings"]
+    if settings.email.render_threads:
+        app.config["email_render_executor"] = ThreadPoolExecutor(
+            settings.email.render_threads, thread_name_prefix="email-render"
+        )
+
+    if settings.email.use and settings.email.render_processes:
+        render_pool = RenderPool(
+            settings.email,
+            settings.email.render_processes,
+            settings.log,
+            debug=logging.getLogger().isEnabledFor(logging.DEBUG),
+        )
+        app.config["email_render_pool"] = render_pool
+        await render_pool.start()
+
+
+@app.before_serving
+async def start_email_queue():
+    """Open the email queue and start the delivery workers, if configured."""
+    settings: Settings = app.config["settings"]
+    queue_settings = settings.email.queue
+    if not settings.email.use or not queue_settings:
+        return
+
+    queue = EmailQueue(queue_settings.path)
+    wakeup = asyncio.Event()
+    send = get_message_sender(settings.email.use)
+    app.config["email_queue"] = queue
+    app.config["email_queue_wakeup"] = wakeup
+    app.config["email_queue_workers"] = [
+        asyncio.create_task(
+            run_delivery_worker(queue, send, settings.email, queue_settings, wakeup)
+        )
+        for _ in range(queue_settings.workers)
+    ]
+
+
+@app.after_serving
+async def close_email_senders():
+    """Stop the delivery workers and close pooled sender connections on shutdown."""
+    workers: list[asyncio.Task] = app.config.pop("email_queue_workers", [])
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+    queue: Optional[EmailQueue] = app.config.pop("email_queue", None)
+    if queue is not None:
+        await asyncio.to_thread(queue.close)
+
+    await close_senders()
+
+    executor: Optional[ThreadPoolExecutor] = app.config.pop(
+        "email_render_executor", None
+    )
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+    render_pool: Optional[RenderPool] = app.config.pop("email_render_pool", None)
+    if render_pool is not None:
+        render_pool.close()
+
+    watcher: Optional[TemplateWatcher] = app.config.pop("email_template_watcher", None)
+    if watcher is not None:
+        await asyncio.to_thread(watcher.stop)
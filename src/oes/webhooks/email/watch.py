@@ -0,0 +1,157 @@
+"""Template file watching module."""
+import contextlib
+import threading
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Optional
+
+import jinja2
+import watchfiles
+from jinja2 import meta
+from loguru import logger
+
+from oes.webhooks.email.cache import AttachmentCache, attachment_cache
+from oes.webhooks.email.template import PrecompilingLoader, get_fragment_cache
+
+
+class TemplateInvalidator:
+    """Evicts changed templates, and the templates that use them, from the caches.
+
+    Compiled templates, including their precompiled HTML, are evicted from the
+    environment's template cache, along with their cached fragments. Changed
+    attachment files are evicted from the attachment cache, which only holds their
+    encoded contents, so messages using them are unaffected.
+
+    The templates each template references are parsed once, and again only when the
+    template changes.
+    """
+
+    def __init__(
+        self,
+        env: jinja2.Environment,
+        base_path: Path,
+        cache: Optional[AttachmentCache] = None,
+    ):
+        """Create a :class:`TemplateInvalidator`.
+
+        Args:
+            env: The Jinja2 environment.
+            base_path: The base template directory.
+            cache: The :class:`AttachmentCache`. Defaults to the process-wide cache.
+        """
+        self.env = env
+        self.base_path = base_path.resolve()
+        self._cache = cache if cache is not None else attachment_cache
+        self._refs: Optional[dict[str, frozenset[Optional[str]]]] = None
+
+    def invalidate(self, paths: Iterable[Path]) -> set[str]:
+        """Invalidate changed files.
+
+        Args:
+            paths: The paths of the changed files.
+
+        Returns:
+            The names of the evicted templates.
+        """
+        names = set()
+        for path in paths:
+            self._cache.invalidate(path)
+            resolved = path.resolve()
+            if resolved.is_relative_to(self.base_path):
+                names.add(resolved.relative_to(self.base_path).as_posix())
+
+        evicted = self._get_dependents(names)
+        template_cache = self.env.cache
+        if template_cache is not None:
+            for key in list(template_cache.keys()):
+                if key[1] in evicted:
+                    with contextlib.suppress(KeyError):
+                        del template_cache[key]
+
+        fragment_cache = get_fragment_cache(self.env)
+        for name in evicted:
+            fragment_cache.invalidate(name)
+
+        return evicted
+
+    def _get_dependents(self, names: set[str]) -> set[str]:
+        """Get the names and the names of the templates using them, transitively."""
+        loader = self.env.loader
+        if isinstance(loader, PrecompilingLoader):
+            loader = loader.loader
+        if loader is None or not names:
+            return names
+
+        if self._refs is None:
+            self._refs = {}
+            self._update_refs(loader, loader.list_templates())
+        else:
+            self._update_refs(loader, names)
+
+        used_by: dict[Optional[str], set[str]] = {}
+        for name, refs in self._refs.items():
+            for ref in refs:
+                used_by.setdefault(ref, set()).add(name)
+
+        result = set(names)
+        # templates with a dynamic reference may use any template
+        result.update(used_by.get(None, ()))
+        pending = list(result)
+        while pending:
+            name = pending.pop()
+            for dependent in used_by.get(name, ()):
+                if dependent not in result:
+                    result.add(dependent)
+                    pending.append(dependent)
+        return result
+
+    def _update_refs(self, loader: jinja2.BaseLoader, names: Iterable[str]):
+        """Parse the templates referenced by each of the named templates."""
+        assert self._refs is not None
+        for name in names:
+            try:
+                source, _, _ = loader.get_source(self.env, name)
+                refs = meta.find_referenced_templates(self.env.parse(source))
+                self._refs[name] = frozenset(refs)
+            except Exception:
+                # removed, not a template, e.g. an attachment, or a syntax error
+                self._refs.pop(name, None)
+
+
+class TemplateWatcher:
+    """Watches the template directory and invalidates changed files in a thread."""
+
+    def __init__(self, invalidator: TemplateInvalidator):
+        """Create a :class:`TemplateWatcher`.
+
+        Args:
+            invalidator: The :class:`TemplateInvalidator`.
+        """
+        self.invalidator = invalidator
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="template-watcher", daemon=True
+        )
+
+    def start(self):
+        """Start watching."""
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching."""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        for changes in watchfiles.watch(
+            self.invalidator.base_path, stop_event=self._stop, raise_interrupt=False
+        ):
+            paths = {Path(path) for _, path in changes}
+            try:
+                evicted = self.invalidator.invalidate(paths)
+            except Exception:
+                logger.opt(exception=True).error("Failed to invalidate templates")
+            else:
+                if evicted:
+                    logger.info("Reloading templates: {}", ", ".join(sorted(evicted)))
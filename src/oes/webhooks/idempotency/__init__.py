@@ -0,0 +1,157 @@
+"""Idempotency key module."""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from attrs import frozen
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+"""The request header with the idempotency key."""
+
+_schema = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    expires REAL NOT NULL,
+    request_hash TEXT,
+    complete INTEGER NOT NULL DEFAULT 0,
+    status INTEGER,
+    content_type TEXT,
+    body BLOB
+);
+CREATE INDEX IF NOT EXISTS idempotency_keys_expires ON idempotency_keys (expires);
+"""
+
+
+@frozen(kw_only=True)
+class StoredResponse:
+    """The state of an idempotency key held by another request."""
+
+    complete: bool
+    """Whether the response is stored, or the key is still being handled."""
+
+    status: int = 0
+    """The response status code."""
+
+    content_type: Optional[str] = None
+    """The response content type."""
+
+    body: bytes = b""
+    """The response body."""
+
+    request_hash: Optional[str] = None
+    """The hash of the body of the request that used the key."""
+
+
+class IdempotencyStore:
+    """A store of idempotency keys and their responses in SQLite.
+
+    The database is opened in WAL mode so it may be shared by several worker
+    processes. A key is held while its request is handled, then completed with the
+    response, which is kept until the key expires.
+    """
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_schema)
+        columns = {
+            row[1] for row in self._conn.execute("PRAGMA table_info(idempotency_keys)")
+        }
+        if "request_hash" not in columns:
+            # databases created before request hashes were stored
+            self._conn.execute(
+                "ALTER TABLE idempotency_keys ADD COLUMN request_hash TEXT"
+            )
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._conn.close()
+
+    def begin(
+        self, key: str, lock_time: float, request_hash: Optional[str] = None
+    ) -> Optional[StoredResponse]:
+        """Hold a key for a request, unless another request already holds it.
+
+        Args:
+            key: The idempotency key.
+            lock_time: How long the key is held if it is never completed or
+                released, in seconds.
+            request_hash: The hash of the request body, stored with the key.
+
+        Returns:
+            ``None`` if the key is now held by the caller, otherwise the state of
+            the key.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT complete, status, content_type, body, request_hash "
+                    "FROM idempotency_keys WHERE key = ? AND expires > ?",
+                    (key, now),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO idempotency_keys "
+                        "(key, expires, request_hash) VALUES (?, ?, ?)",
+                        (key, now + lock_time, request_hash),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+
+        complete, status, content_type, body, stored_hash = row
+        return StoredResponse(
+            complete=bool(complete),
+            status=status or 0,
+            content_type=content_type,
+            body=body or b"",
+            request_hash=stored_hash,
+        )
+
+    def complete(
+        self,
+        key: str,
+        status: int,
+        content_type: Optional[str],
+        body: bytes,
+        ttl: float,
+    ):
+        """Store the response for a held key, for ``ttl`` seconds."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE idempotency_keys SET complete = 1, expires = ?, status = ?, "
+                "content_type = ?, body = ? WHERE key = ?",
+                (time.time() + ttl, status, content_type, body, key),
+            )
+
+    def release(self, key: str):
+        """Release a held key without storing a response, so it may be retried."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE key = ? AND complete = 0", (key,)
+            )
+
+    def purge(self) -> int:
+        """Remove expired keys.
+
+        Returns:
+            The number of keys removed.
+        """
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE expires <= ?", (time.time(),)
+            )
+        return cur.rowcount
@@ -0,0 +1,144 @@
+"""Idempotency key request handling."""
+import asyncio
+import contextlib
+import hashlib
+import inspect
+from typing import Any, Optional
+
+from loguru import logger
+from quart import Response, g, request
+from werkzeug.exceptions import BadRequest, UnprocessableEntity
+
+from oes.webhooks import metrics
+from oes.webhooks.app import app
+from oes.webhooks.idempotency import IDEMPOTENCY_KEY_HEADER, IdempotencyStore
+from oes.webhooks.settings import Settings
+
+MAX_KEY_LENGTH = 255
+"""The maximum length of an idempotency key."""
+
+PURGE_INTERVAL = 600
+"""How often expired keys are removed, in seconds."""
+
+
+@app.before_request
+async def check_idempotency_key() -> Optional[Response]:
+    """Replay the response of an earlier request with the same idempotency key."""
+    store: Optional[IdempotencyStore] = app.config.get("idempotency_store")
+    key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+    if store is None or request.method != "POST" or not key:
+        return None
+
+    if len(key) > MAX_KEY_LENGTH:
+        raise BadRequest(f"{IDEMPOTENCY_KEY_HEADER} is too long")
+
+    settings: Settings = app.config["settings"]
+    assert settings.idempotency
+    scoped_key = f"{request.path}\n{key}"
+    # the body is read in full, and kept for the view, to detect a reused key
+    body: bytes = await request.get_data(as_text=False)
+    request_hash = hashlib.sha256(body).hexdigest()
+    stored = await metrics.to_thread(
+        "idempotency",
+        store.begin,
+        scoped_key,
+        settings.idempotency.lock_time,
+        request_hash,
+    )
+    if stored is None:
+        g.idempotency_key = scoped_key
+        return None
+
+    if stored.request_hash is not None and stored.request_hash != request_hash:
+        raise UnprocessableEntity(
+            f"{IDEMPOTENCY_KEY_HEADER} was used with a different request body"
+        )
+
+    if not stored.complete:
+        return Response(status=409, headers={"Retry-After": "1"})
+
+    return Response(
+        stored.body,
+        status=stored.status,
+        content_type=stored.content_type,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+@app.after_request
+async def store_idempotent_response(response: Response) -> Response:
+    """Store the response for the request's idempotency key."""
+    store: Optional[IdempotencyStore] = app.config.get("idempotency_store")
+    key: Optional[str] = g.get("idempotency_key")
+    if store is None or key is None:
+        return response
+
+    # let the client retry errors that may be temporary, the key is released on
+    # teardown
+    if response.status_code >= 500 or response.status_code == 429:
+        return response
+
+    settings: Settings = app.config["settings"]
+    assert settings.idempotency
+    body: Any = response.get_data()
+    if inspect.isawaitable(body):
+        # Quart responses, unlike Werkzeug error responses
+        body = await body
+    await metrics.to_thread(
+        "idempotency",
+        store.complete,
+        key,
+        response.status_code,
+        response.content_type,
+        body,
+        settings.idempotency.ttl,
+    )
+    g.pop("idempotency_key", None)
+    return response
+
+
+@app.teardown_request
+async def release_idempotency_key(exc: Optional[BaseException]):
+    """Release the idempotency key of a request that was not completed."""
+    store: Optional[IdempotencyStore] = app.config.get("idempotency_store")
+    key: Optional[str] = g.pop("idempotency_key", None)
+    if store is not None and key is not None:
+        await metrics.to_thread("idempotency", store.release, key)
+
+
+@app.before_serving
+async def open_idempotency_store():
+    """Open the idempotency key store, if configured."""
+    settings: Settings = app.config["settings"]
+    if not settings.idempotency:
+        return
+
+    store = IdempotencyStore(settings.idempotency.path)
+    app.config["idempotency_store"] = store
+    app.config["idempotency_purge_task"] = asyncio.create_task(_purge_keys(store))
+
+
+@app.after_serving
+async def close_idempotency_store():
+    """Close the idempotency key store on shutdown."""
+    task: Optional[asyncio.Task] = app.config.pop("idempotency_purge_task", None)
+    if task is not None:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    store: Optional[IdempotencyStore] = app.config.pop("idempotency_store", None)
+    if store is not None:
+        store.close()
+
+
+async def _purge_keys(store: IdempotencyStore):
+    while True:
+        try:
+            count = await metrics.to_thread("idempotency", store.purge)
+        except Exception:
+            logger.opt(exception=True).error("Failed to purge idempotency keys")
+        else:
+            if count:
+                logger.debug("Purged {} expired idempotency keys", count)
+        await asyncio.sleep(PURGE_INTERVAL)
@@ -1,16 +1,197 @@
 """Logging module."""
 import logging
+import queue
+import random
 import sys
+import threading
+import time
+import traceback
+from collections.abc import Mapping
+from typing import Any, Optional, TextIO
 
+import orjson
 from loguru import logger
-from oes.util.logging import InterceptHandler
 
+from oes.webhooks import metrics
+from oes.webhooks.settings import LogSettings
+
+
+def setup_logging(debug: bool = False, settings: Optional[LogSettings] = None):
+    """Set up the logger.
+
+    Args:
+        debug: Whether to log debug messages.
+        settings: The log settings. Logs to stderr synchronously if not set.
+    """
+    from oes.util.logging import InterceptHandler
 
-def setup_logging(debug: bool = False):
-    """Set up the logger."""
     level = logging.DEBUG if debug else logging.INFO
 
     logger.remove()
-    logger.add(sys.stderr, level=level)
+    if settings is None:
+        logger.add(sys.stderr, level=level)
+    else:
+        log_filter = LogFilter(settings.sample, settings.rate_limit)
+        if settings.queued:
+            logger.add(
+                QueuedSink(sys.stderr, settings.json, settings.queue_size),
+                level=level,
+                format="{message}",
+                colorize=False,
+                filter=log_filter,
+            )
+        else:
+            logger.add(
+                sys.stderr, level=level, serialize=settings.json, filter=log_filter
+            )
 
     logging.basicConfig(handlers=[InterceptHandler()], level=level, force=True)
+
+
+class LogFilter:
+    """Samples and rate limits records by logger name.
+
+    Settings for a name also apply to the loggers below it, and the longest
+    matching name is used. Warnings and errors are never sampled, but are rate
+    limited.
+    """
+
+    def __init__(
+        self,
+        sample: Mapping[str, float],
+        rate_limit: Mapping[str, float],
+    ):
+        """Create a :class:`LogFilter`.
+
+        Args:
+            sample: The fraction of records kept, by logger name.
+            rate_limit: The number of records per second kept, by logger name.
+        """
+        self.sample = dict(sample)
+        self.rate_limit = dict(rate_limit)
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record: Mapping[str, Any]) -> bool:
+        name = record["name"] or ""
+        if record["level"].no < logging.WARNING:
+            rate = _get_for_logger(self.sample, name)
+            if rate is not None and random.random() >= rate:
+                metrics.LOG_DROPPED.labels("sampled").inc()
+                return False
+
+        limit_name = _get_logger_key(self.rate_limit, name)
+        if limit_name is not None and not self._take(limit_name):
+            metrics.LOG_DROPPED.labels("rate_limited").inc()
+            return False
+        return True
+
+    def _take(self, name: str) -> bool:
+        """Take a token from the logger's bucket.
+
+        The bucket holds a second of records, and at least one.
+        """
+        rate = self.rate_limit[name]
+        size = max(rate, 1)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(name, (size, now))
+            tokens = min(tokens + (now - updated) * rate, size)
+            if tokens < 1:
+                self._buckets[name] = (tokens, now)
+                return False
+            self._buckets[name] = (tokens - 1, now)
+            return True
+
+
+def _get_logger_key(values: Mapping[str, float], name: str) -> Optional[str]:
+    """Get the longest key that is the logger name or a parent of it."""
+    while True:
+        if name in values:
+            return name
+        if not name:
+            return None
+        name = name.rpartition(".")[0]
+
+
+def _get_for_logger(values: Mapping[str, float], name: str) -> Optional[float]:
+    key = _get_logger_key(values, name)
+    return values[key] if key is not None else None
+
+
+class QueuedSink:
+    """A sink that formats and writes records in a thread.
+
+    Logging calls only put the record in a bounded queue, so they never wait for
+    the stream. Records are dropped while the queue is full.
+    """
+
+    def __init__(self, stream: TextIO, json: bool = False, max_size: int = 10000):
+        """Create a :class:`QueuedSink`.
+
+        Args:
+            stream: The stream to write to.
+            json: Whether to write each record as a JSON object.
+            max_size: The maximum number of queued records.
+        """
+        self.stream = stream
+        self.json = json
+        self._queue: queue.Queue[Optional[Mapping[str, Any]]] = queue.Queue(max_size)
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, message: Any):
+        """Queue a record."""
+        try:
+            self._queue.put_nowait(message.record)
+        except queue.Full:
+            metrics.LOG_DROPPED.labels("full").inc()
+
+    def stop(self):
+        """Write the queued records and stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            try:
+                self.stream.write(self.format(record))
+                if self._queue.empty():
+                    self.stream.flush()
+            except Exception:
+                traceback.print_exc()
+
+    def format(self, record: Mapping[str, Any]) -> str:
+        """Format a record as a line."""
+        exception = record["exception"]
+        exc_text = (
+            "".join(traceback.format_exception(*exception))
+            if exception is not None
+            else None
+        )
+
+        if self.json:
+            obj = {
+                "time": record["time"].isoformat(),
+                "level": record["level"].name,
+                "name": record["name"],
+                "function": record["function"],
+                "line": record["line"],
+                "message": record["message"],
+                "extra": record["extra"],
+                "exception": exc_text,
+            }
+            return orjson.dumps(obj, default=str).decode() + "\n"
+
+        time_str = record["time"].strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        line = (
+            f"{time_str} | {record['level'].name:<8} | "
+            f"{record['name']}:{record['function']}:{record['line']} - "
+            f"{record['message']}\n"
+        )
+        return line + exc_text if exc_text else line
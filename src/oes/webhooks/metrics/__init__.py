@@ -0,0 +1,212 @@
+"""Metrics.
+
+When running several worker processes, set ``PROMETHEUS_MULTIPROC_DIR`` before this
+module is imported so each process records its metrics to a shared directory.
+"""
+import asyncio
+import contextlib
+import os
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextvars import ContextVar
+from typing import Any, Optional, TypeVar
+
+from prometheus_client import Counter, Gauge, Histogram
+
+_T = TypeVar("_T")
+
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+"""The environment variable naming the multiprocess metrics directory."""
+
+STAGE_SECONDS = Histogram(
+    "webhooks_stage_seconds",
+    "Time spent in each stage of handling a webhook.",
+    ["stage"],
+    buckets=(
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+    ),
+)
+"""Stage durations: ``parse``, ``structure``, ``render``, ``process_html``,
+``serialize``, ``send`` and ``sheets_append``."""
+
+EMAILS = Counter(
+    "webhooks_emails_total",
+    "Emails handled, by template and result.",
+    ["template", "result"],
+)
+"""Emails by template and result: ``sent``, ``queued`` or ``error``."""
+
+SENDS = Counter(
+    "webhooks_sends_total",
+    "Messages sent to a provider, by provider and result.",
+    ["provider", "result"],
+)
+"""Provider sends by provider and result: ``success`` or ``error``."""
+
+SHEETS_ROWS = Counter(
+    "webhooks_sheets_rows_total",
+    "Sheets rows handled, by hook ID and result.",
+    ["hook", "result"],
+)
+"""Sheets rows by hook ID and result: ``appended``, ``error`` (raised to a waiting
+request), ``retried`` (once per retry) or ``dropped`` (after failed attempts)."""
+
+THREADS_IN_FLIGHT = Gauge(
+    "webhooks_threads_in_flight",
+    "Work currently running in or waiting for a thread, by task.",
+    ["task"],
+    multiprocess_mode="livesum",
+)
+"""Work running in a thread pool, by task."""
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "webhooks_admission_in_flight",
+    "Requests being handled under a concurrency limit, by limit.",
+    ["limit"],
+    multiprocess_mode="livesum",
+)
+"""Requests holding a slot of a concurrency limit."""
+
+ADMISSION_QUEUED = Gauge(
+    "webhooks_admission_queued",
+    "Requests waiting for a concurrency limit, by limit.",
+    ["limit"],
+    multiprocess_mode="livesum",
+)
+"""Requests waiting for a slot of a concurrency limit."""
+
+ADMISSION_REJECTED = Counter(
+    "webhooks_admission_rejected_total",
+    "Requests rejected by a concurrency limit, by limit and status.",
+    ["limit", "status"],
+)
+"""Requests rejected by a concurrency limit, by status code."""
+
+PROVIDER_CIRCUIT_OPEN = Gauge(
+    "webhooks_email_provider_circuit_open",
+    "Whether an email provider is not being used after failures, by provider.",
+    ["provider"],
+    multiprocess_mode="livemax",
+)
+"""1 while a provider's circuit breaker is open or half open, else 0."""
+
+PROVIDER_FAILOVERS = Counter(
+    "webhooks_email_provider_failovers_total",
+    "Sends that failed with an email provider, by provider.",
+    ["provider"],
+)
+"""Sends that failed with a provider, and were tried with another one if possible."""
+
+RATE_LIMIT_SECONDS = Histogram(
+    "webhooks_email_rate_limit_seconds",
+    "Time messages waited for email rate limits, by provider.",
+    ["provider"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+"""Time messages were held back by provider and recipient domain rate limits."""
+
+RATE_LIMITED = Counter(
+    "webhooks_email_rate_limited_total",
+    "Messages that would have waited too long for a rate limit, by provider.",
+    ["provider"],
+)
+"""Messages not sent because a rate limit's wait was longer than ``max_wait``."""
+
+LOG_DROPPED = Counter(
+    "webhooks_log_dropped_total",
+    "Log records dropped, by reason.",
+    ["reason"],
+)
+"""Log records dropped, by reason: ``sampled``, ``rate_limited`` or ``full``."""
+
+LOOP_LAG = Histogram(
+    "webhooks_event_loop_lag_seconds",
+    "How late the event loop ran a scheduled callback.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+"""Event loop lag, caused by blocking work like logging on the loop's thread."""
+
+
+def is_multiprocess() -> bool:
+    """Whether metrics are recorded for several processes."""
+    return bool(os.environ.get(MULTIPROC_DIR_ENV))
+
+
+_collected_stages: ContextVar[Optional[list[tuple[str, float]]]] = ContextVar(
+    "_collected_stages", default=None
+)
+
+
+@contextlib.contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Record the time spent in a stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        collected = _collected_stages.get()
+        if collected is not None:
+            collected.append((stage, seconds))
+        else:
+            STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextlib.contextmanager
+def collect_stages() -> Iterator[list[tuple[str, float]]]:
+    """Collect the stages timed within, instead of recording them.
+
+    Used in subprocesses, whose metrics are not exported, to return the stage
+    durations to be recorded with :func:`record_stages`.
+    """
+    stages: list[tuple[str, float]] = []
+    token = _collected_stages.set(stages)
+    try:
+        yield stages
+    finally:
+        _collected_stages.reset(token)
+
+
+def record_stages(stages: Iterable[tuple[str, float]]):
+    """Record stage durations collected with :func:`collect_stages`."""
+    for stage, seconds in stages:
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextlib.contextmanager
+def in_flight(task: str) -> Iterator[None]:
+    """Count work running in a thread."""
+    gauge = THREADS_IN_FLIGHT.labels(task)
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+
+async def monitor_loop_lag(interval: float = 0.5):
+    """Record the event loop lag every ``interval`` seconds until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(loop.time() - start - interval, 0))
+
+
+async def to_thread(task: str, func: Callable[..., _T], *args: Any) -> _T:
+    """Run a function with :func:`asyncio.to_thread`, counting it as in flight."""
+    with in_flight(task):
+        return await asyncio.to_thread(func, *args)
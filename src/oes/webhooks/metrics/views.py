@@ -0,0 +1,42 @@
+"""Metrics views."""
+import asyncio
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    generate_latest,
+)
+from prometheus_client.multiprocess import MultiProcessCollector
+from quart import Response
+
+from oes.webhooks.app import app
+from oes.webhooks.metrics import is_multiprocess, monitor_loop_lag
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Get metrics in the Prometheus text format, for all worker processes."""
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    data = generate_latest(registry)
+    return Response(data, content_type=CONTENT_TYPE_LATEST)
+
+
+@app.before_serving
+async def start_loop_lag_monitor():
+    """Start recording the event loop lag."""
+    app.config["loop_lag_task"] = asyncio.create_task(monitor_loop_lag())
+
+
+@app.after_serving
+async def stop_loop_lag_monitor():
+    """Stop recording the event loop lag."""
+    task: Optional[asyncio.Task] = app.config.pop("loop_lag_task", None)
+    if task is not None:
+        task.cancel()
@@ -0,0 +1,92 @@
+"""NDJSON ingestion module."""
+import asyncio
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable
+from typing import Any
+
+import orjson
+from loguru import logger
+from quart import Request
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+"""The NDJSON media type."""
+
+
+class InvalidRecord:
+    """A line that could not be parsed as JSON."""
+
+    def __init__(self, error: str):
+        self.error = error
+
+
+def is_ndjson(request: Request) -> bool:
+    """Whether the request body is NDJSON."""
+    return request.mimetype == NDJSON_MIMETYPE
+
+
+async def iter_records(chunks: AsyncIterable[bytes]) -> AsyncIterator[Any]:
+    """Parse NDJSON records from chunks of bytes as they arrive.
+
+    Blank lines are skipped. Lines that are not valid JSON yield an
+    :class:`InvalidRecord`.
+    """
+    pending: list[bytes] = []
+    async for chunk in chunks:
+        start = 0
+        while (end := chunk.find(b"\n", start)) != -1:
+            pending.append(chunk[start:end])
+            line = b"".join(pending)
+            pending.clear()
+            if line.strip():
+                yield _parse_line(line)
+            start = end + 1
+        pending.append(chunk[start:])
+
+    line = b"".join(pending)
+    if line.strip():
+        yield _parse_line(line)
+
+
+async def process_records(
+    records: AsyncIterable[Any],
+    handle: Callable[[Any], Awaitable[dict[str, Any]]],
+    concurrency: int,
+) -> list[dict[str, Any]]:
+    """Handle records as they are parsed, at most ``concurrency`` at a time.
+
+    Reading pauses while ``concurrency`` records are being handled.
+
+    Args:
+        records: The records.
+        handle: A function to handle a record, returning its result.
+        concurrency: The maximum number of records handled at once.
+
+    Returns:
+        The result for each record, in order. Invalid records and records whose
+        handler raised an exception have an ``error`` status.
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    tasks = []
+
+    async def run(record: Any) -> dict[str, Any]:
+        try:
+            if isinstance(record, InvalidRecord):
+                return {"status": "error", "error": record.error}
+            return await handle(record)
+        except Exception as e:
+            logger.error("Failed to handle record: {}", e)
+            return {"status": "error", "error": str(e)}
+        finally:
+            semaphore.release()
+
+    async for record in records:
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(run(record)))
+
+    return list(await asyncio.gather(*tasks))
+
+
+def _parse_line(line: bytes) -> Any:
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError as e:
+        return InvalidRecord(f"Invalid JSON: {e}")
@@ -1,35 +1,120 @@
 """Receipt veiws."""
-from typing import Optional
+import asyncio
+import traceback
+from collections.abc import Mapping
+from typing import Any, Optional
 
-import httpx
-from quart import Response, request
+import jinja2
+from cattrs import BaseValidationError
+from loguru import logger
+from quart import Response, jsonify, request
+from werkzeug.exceptions import NotFound, ServiceUnavailable, UnprocessableEntity
 
+from oes.webhooks import metrics
+from oes.webhooks.admission import admitted
 from oes.webhooks.app import app
-
-_client = httpx.AsyncClient(app=app)
+from oes.webhooks.email.dispatch import dispatch_email
+from oes.webhooks.email.ratelimit import RateLimited
+from oes.webhooks.ndjson import is_ndjson, iter_records, process_records
+from oes.webhooks.settings import Settings
 
 
 @app.post("/receipt")
+@admitted("receipt")
 async def send_receipt():
     """Send a receipt email."""
-    body = await request.get_json()
-
-    email = _get_email(body["cart_data"])
-    total = _get_total_without_modifiers(body["pricing_result"])
-    if email and total != 0:
-        # kind of hacky to re-use a view
-        res = await _client.post(
-            f"{request.root_url}email/receipt",
-            json={
-                "to": email,
-                "subject": "Order Confirmation",
-                "checkout": body,
-            },
+    settings: Settings = app.config["settings"]
+    if not settings.email.use:
+        raise NotFound
+
+    if is_ndjson(request):
+        results = await process_records(
+            iter_records(request.body),
+            _send_receipt_with_result,
+            settings.email.batch_concurrency,
         )
-        res.raise_for_status()
+        return jsonify({"results": results})
+
+    with metrics.timed("parse"):
+        body = await request.get_json()
+
+    try:
+        await _send_receipt(body)
+    except BaseValidationError:
+        logger.error("Invalid receipt email:\n{}", traceback.format_exc())
+        raise UnprocessableEntity
+    except jinja2.exceptions.TemplateNotFound:
+        logger.error("The receipt template was not found.")
+        raise NotFound
+    except RateLimited as e:
+        logger.warning("Not sending email: {}", e)
+        raise ServiceUnavailable(retry_after=e.retry_after)
     return Response(status=204)
 
 
+@app.post("/receipt/batch")
+@admitted("receipt")
+async def send_receipt_batch():
+    """Send receipt emails for a list of checkouts."""
+    settings: Settings = app.config["settings"]
+    if not settings.email.use:
+        raise NotFound
+
+    with metrics.timed("parse"):
+        body = await request.get_json()
+    checkouts = body.get("checkouts") if isinstance(body, dict) else None
+    if not isinstance(checkouts, list):
+        raise UnprocessableEntity
+
+    semaphore = asyncio.Semaphore(max(settings.email.batch_concurrency, 1))
+
+    async def send_one(checkout: Any) -> dict[str, Any]:
+        async with semaphore:
+            return await _send_receipt_with_result(checkout)
+
+    results = await asyncio.gather(*(send_one(c) for c in checkouts))
+    return jsonify({"results": results})
+
+
+async def _send_receipt_with_result(checkout: Any) -> dict[str, Any]:
+    try:
+        to, status = await _send_receipt(checkout)
+    except Exception as e:
+        logger.error("Failed to send receipt: {}", e)
+        return {"to": _get_email_or_none(checkout), "status": "error", "error": str(e)}
+    else:
+        return {"to": to, "status": status}
+
+
+async def _send_receipt(checkout: Mapping[str, Any]) -> tuple[Optional[str], str]:
+    """Send a receipt for a checkout.
+
+    Returns:
+        A pair of the recipient and status: ``sent``, ``queued`` or ``skipped``.
+    """
+    email = _get_email(checkout["cart_data"])
+    total = _get_total_without_modifiers(checkout["pricing_result"])
+    if not email or total == 0:
+        return email, "skipped"
+
+    queued = await dispatch_email(
+        "receipt",
+        {
+            "to": email,
+            "subject": "Order Confirmation",
+            "checkout": checkout,
+        },
+    )
+    return email, "queued" if queued else "sent"
+
+
+def _get_email_or_none(checkout: Any) -> Optional[str]:
+    try:
+        return _get_email(checkout["cart_data"])
+    except Exception:
+        return None
+
+
 def _get_email(cart_data: dict) -> Optional[str]:
     meta_email = cart_data.get("meta", {}).get("email")
     if meta_email:
@@ -1,12 +1,59 @@
 """Serialization module."""
+from typing import Any, Union
+
+import orjson
 from cattrs.gen import make_dict_structure_fn
 from cattrs.preconf.orjson import make_converter
+from quart import Response
+from quart.json.provider import DefaultJSONProvider
 
-from oes.webhooks.email.types import Email, EmailHookBody
+from oes.webhooks.email.types import Email, EmailBatchHookBody, EmailHookBody
 
 converter = make_converter()
 
 
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider using :mod:`orjson`.
+
+    Falls back to :mod:`json` when given arguments ``orjson`` does not support.
+    """
+
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, object_: Any, **kwargs: Any) -> str:
+        """Serialize data as JSON to a string."""
+        return self._dumps(object_, **kwargs).decode()
+
+    def loads(self, object_: Union[str, bytes], **kwargs: Any) -> Any:
+        """Deserialize data as JSON from a string or bytes."""
+        if kwargs:
+            return super().loads(object_, **kwargs)
+        return orjson.loads(object_)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        """Serialize the given arguments as a JSON response."""
+        object_ = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        data = self._dumps(object_, indent=2 if pretty else None)
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+    def _dumps(self, object_: Any, **kwargs: Any) -> bytes:
+        kwargs.pop("separators", None)
+        indent = kwargs.pop("indent", None)
+        if kwargs or indent not in (None, 2):
+            return super().dumps(object_, indent=indent, **kwargs).encode()
+
+        # dates are formatted by the default function, as with json
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+
+        return orjson.dumps(object_, default=self.default, option=option)
+
+
 def make_structure_email_with_from(c, t):
     """Structure function for classes with a ``from`` field."""
     structure_dict = make_dict_structure_fn(t, c)
@@ -27,3 +74,6 @@ converter.register_structure_hook(
 converter.register_structure_hook(
     EmailHookBody, make_structure_email_with_from(converter, EmailHookBody)
 )
+converter.register_structure_hook(
+    EmailBatchHookBody, make_structure_email_with_from(converter, EmailBatchHookBody)
+)
@@ -5,19 +5,12 @@ from enum import Enum
 from pathlib import Path
 from typing import Literal, NewType, Optional
 
-import jinja2
 import typed_settings as ts
-from attrs import field
-from jinja2 import ChainableUndefined
-from jinja2.sandbox import ImmutableSandboxedEnvironment
+from attrs import field, validators
 from ruamel.yaml import YAML
 from typed_settings import EnvLoader, FileLoader, SecretStr
 from typed_settings.types import OptionList, SettingsClass, SettingsDict
 
-_jinja2_env = ImmutableSandboxedEnvironment(
-    undefined=ChainableUndefined,
-)
-
 
 class EmailSenderType(str, Enum):
     """An email sender type."""
@@ -25,6 +18,25 @@ class EmailSenderType(str, Enum):
     mock = "mock"
     smtp = "smtp"
     mailgun = "mailgun"
+    providers = "providers"
+
+
+class SheetsClientType(str, Enum):
+    """A Google Sheets client type."""
+
+    discovery = "discovery"
+    httpx = "httpx"
+
+
+@ts.settings(kw_only=True)
+class RateLimitSettings:
+    """Token bucket settings."""
+
+    rate: float = field(validator=validators.gt(0))
+    """The number of messages sent per second."""
+
+    burst: float = field(default=1, validator=validators.ge(1))
+    """The number of messages that may be sent at once after a pause."""
 
 
 @ts.settings(kw_only=True)
@@ -46,6 +58,21 @@ class SMTPSettings:
     password: SecretStr = ts.secret(default="")
     """The SMTP password."""
 
+    pool_size: int = 1
+    """The maximum number of concurrent SMTP sessions."""
+
+    timeout: float = 60
+    """The SMTP command timeout, in seconds."""
+
+    noop_interval: float = 30
+    """Probe sessions idle for longer than this many seconds with ``NOOP``."""
+
+    max_idle: float = 300
+    """Close sessions idle for longer than this many seconds."""
+
+    rate_limit: Optional[RateLimitSettings] = None
+    """Pace the messages sent with this server, if set."""
+
 
 @ts.settings(kw_only=True)
 class MailgunSettings:
@@ -60,6 +87,100 @@ class MailgunSettings:
     api_key: SecretStr = ts.secret()
     """The API key."""
 
+    http2: bool = True
+    """Use HTTP/2 if the server supports it."""
+
+    max_connections: int = 10
+    """The maximum number of connections per process."""
+
+    max_keepalive_connections: int = 10
+    """The maximum number of idle connections kept open."""
+
+    keepalive_expiry: float = 60
+    """Close idle connections after this many seconds."""
+
+    connect_timeout: float = 10
+    """The connect timeout, in seconds."""
+
+    read_timeout: float = 30
+    """The read, write and pool timeout, in seconds."""
+
+    rate_limit: Optional[RateLimitSettings] = None
+    """Pace the messages sent with this domain, if set."""
+
+
+@ts.settings(kw_only=True)
+class EmailRateLimitsSettings:
+    """Email rate limit settings.
+
+    The token buckets are stored in a database shared by the worker processes, so
+    they share each limit.
+    """
+
+    path: Path = Path("email-rate-limits.db")
+    """Path to the token bucket database."""
+
+    domains: Mapping[str, RateLimitSettings] = field(factory=dict)
+    """Limits on the messages sent to a recipient domain, by all providers."""
+
+    max_wait: float = 30
+    """How long a message may wait for a rate limit before the send fails."""
+
+
+@ts.settings(kw_only=True)
+class EmailQueueSettings:
+    """Email queue settings."""
+
+    path: Path = Path("email-queue.db")
+    """Path to the queue database."""
+
+    workers: int = 4
+    """The number of delivery workers per process."""
+
+    max_attempts: int = 10
+    """The number of delivery attempts before a message is marked as failed."""
+
+    retry_delay: float = 10
+    """The delay before the first retry, in seconds. Doubled after each failure."""
+
+    max_retry_delay: float = 3600
+    """The maximum delay between retries, in seconds."""
+
+    lease_time: float = 300
+    """How long a worker may hold a message before another worker may retry it."""
+
+    poll_interval: float = 1
+    """How often idle workers check for due messages, in seconds."""
+
+
+@ts.settings(kw_only=True)
+class EmailProviderSettings:
+    """An email provider used with ``use: providers``."""
+
+    name: str
+    """The provider name, for statistics and metrics."""
+
+    use: EmailSenderType
+    """The implementation to use."""
+
+    smtp: Optional[SMTPSettings] = None
+    """SMTP settings."""
+
+    mailgun: Optional[MailgunSettings] = None
+    """Mailgun settings."""
+
+    weight: float = 1
+    """The share of messages sent with this provider, relative to the others."""
+
+    concurrency: int = 10
+    """The number of messages sent with this provider at once."""
+
+    failure_threshold: int = 5
+    """The number of failures in a row after which the provider is not used."""
+
+    reset_timeout: float = 30
+    """How long a failing provider is not used before it is tried again, in seconds."""
+
 
 @ts.settings(kw_only=True)
 class EmailSettings:
@@ -71,6 +192,12 @@ class EmailSettings:
     template_path: Path = Path("templates/email")
     """Path to the email template directory."""
 
+    precompile_html: bool = False
+    """Inline CSS and minify HTML templates once, when they are loaded.
+
+    Markup output by template variables is then not processed.
+    """
+
     use: Optional[EmailSenderType] = None
     """The implementation to use."""
 
@@ -80,6 +207,45 @@ class EmailSettings:
     mailgun: Optional[MailgunSettings] = None
     """Mailgun settings."""
 
+    providers: Sequence[EmailProviderSettings] = ()
+    """The providers to spread messages across, with ``use: providers``."""
+
+    rate_limits: EmailRateLimitsSettings = field(factory=EmailRateLimitsSettings)
+    """Rate limit settings."""
+
+    queue: Optional[EmailQueueSettings] = None
+    """Queue messages for background delivery, if set."""
+
+    attachment_cache_size: int = 64 * 1024 * 1024
+    """The maximum size of cached, base64 encoded attachment data, in bytes."""
+
+    attachment_stream_size: int = 4 * 1024 * 1024
+    """Attachment files at least this large are not cached, and are read and encoded
+    a chunk at a time while the message is sent."""
+
+    fragment_cache_size: int = 1024
+    """The maximum number of template fragments cached by the ``cache`` tag."""
+
+    watch_templates: bool = False
+    """Compile templates once and reload them when a file watcher sees them change.
+
+    Otherwise, each template and attachment file is checked for changes each time it
+    is used.
+    """
+
+    render_threads: Optional[int] = None
+    """The number of threads rendering messages. Uses the default executor if unset."""
+
+    render_processes: Optional[int] = None
+    """The number of subprocesses rendering and serializing messages, if set.
+
+    Rendering is mostly CPU-bound, so this lets one server process render on several
+    cores at once.
+    """
+
+    batch_concurrency: int = 10
+    """The number of batch messages to render and send at once."""
+
 
 @ts.settings(kw_only=True)
 class GoogleSheetsHook:
@@ -94,10 +260,30 @@ class GoogleSheetsHook:
     range: str = "1:2"
     """The range to search for a table in."""
 
-    values: Sequence[jinja2.environment.TemplateExpression] = ()
+    values: Sequence[str] = ()
     """Column value template expressions."""
 
 
+@ts.settings(kw_only=True)
+class SheetsBufferSettings:
+    """Google Sheets row buffer settings."""
+
+    flush_interval: float = 0.5
+    """How long rows are buffered before they are appended, in seconds."""
+
+    flush_rows: int = 100
+    """Append buffered rows as soon as this many are waiting for a range."""
+
+    wait_for_flush: bool = False
+    """Respond only once the row is appended, unless the request sets ``wait``."""
+
+    max_attempts: int = 5
+    """The number of append attempts before buffered rows are dropped."""
+
+    retry_delay: float = 1
+    """The delay before the first retry, in seconds. Doubled after each failure."""
+
+
 _ServiceAccountCredentials = NewType("_ServiceAccountCredentials", Mapping[str, str])
 
 
@@ -113,6 +299,88 @@ class GoogleSettings:
     sheets_hooks: Sequence[GoogleSheetsHook] = ()
     """Google Sheets hooks."""
 
+    sheets_client: SheetsClientType = SheetsClientType.discovery
+    """The Sheets client implementation to use."""
+
+    sheets_buffer: SheetsBufferSettings = field(factory=SheetsBufferSettings)
+    """Google Sheets row buffer settings."""
+
+
+@ts.settings(kw_only=True)
+class IdempotencySettings:
+    """Idempotency key settings."""
+
+    path: Path = Path("idempotency.db")
+    """Path to the idempotency key database."""
+
+    ttl: float = 86400
+    """How long the response for a key is kept, in seconds."""
+
+    lock_time: float = 300
+    """How long a key being handled blocks duplicates if it is never completed."""
+
+
+@ts.settings(kw_only=True)
+class LimitSettings:
+    """Concurrency limit settings."""
+
+    concurrency: int = 10
+    """The number of requests handled at once."""
+
+    queue: int = 100
+    """The number of requests waiting to be handled before more are rejected."""
+
+    queue_timeout: float = 10
+    """How long a request may wait to be handled before it is rejected, in seconds."""
+
+
+@ts.settings(kw_only=True)
+class LimitsSettings:
+    """Admission control settings.
+
+    Requests over a limit are rejected with ``429 Too Many Requests``, or
+    ``503 Service Unavailable`` if they waited too long. No limit is applied to
+    unset ones.
+    """
+
+    email: Optional[LimitSettings] = None
+    """Limits for the email endpoints."""
+
+    receipt: Optional[LimitSettings] = None
+    """Limits for the receipt endpoints."""
+
+    sheets: Optional[LimitSettings] = None
+    """Limits for the Sheets endpoint."""
+
+    smtp: Optional[LimitSettings] = None
+    """Limits for sending messages with SMTP while handling a request."""
+
+    mailgun: Optional[LimitSettings] = None
+    """Limits for sending messages with Mailgun while handling a request."""
+
+    retry_after: int = 1
+    """The ``Retry-After`` value of rejected requests, in seconds."""
+
+
+@ts.settings(kw_only=True)
+class LogSettings:
+    """Log settings."""
+
+    queued: bool = True
+    """Format and write log records in a thread, so logging calls do not block."""
+
+    queue_size: int = 10000
+    """The number of queued records, above which records are dropped."""
+
+    json: bool = False
+    """Write each record as a JSON object."""
+
+    sample: Mapping[str, float] = field(factory=dict)
+    """The fraction of debug and info records kept, by logger name."""
+
+    rate_limit: Mapping[str, float] = field(factory=dict)
+    """The number of records kept per second, by logger name."""
+
 
 @ts.settings(kw_only=True)
 class Settings:
@@ -120,6 +388,9 @@ class Settings:
 
     email: EmailSettings = field(factory=EmailSettings)
     google: GoogleSettings = field(factory=GoogleSettings)
+    idempotency: Optional[IdempotencySettings] = None
+    limits: LimitsSettings = field(factory=LimitsSettings)
+    log: LogSettings = field(factory=LogSettings)
 
 
 yaml = YAML(typ="safe")
@@ -133,9 +404,6 @@ def load_settings(config: Optional[Path]) -> Settings:
     converter.register_structure_hook(
         _ServiceAccountCredentials, lambda v, t: _parse_service_account_credentials(v)
     )
-    converter.register_structure_hook(
-        jinja2.environment.TemplateExpression, lambda v, t: _compile_expression(v)
-    )
 
     if config is not None:
         loaders.append(
@@ -153,13 +421,6 @@ def load_settings(config: Optional[Path]) -> Settings:
     return ts.load_settings(Settings, loaders, converter=converter)
 
 
-def _compile_expression(v):
-    if isinstance(v, str):
-        return _jinja2_env.compile_expression(v)
-    else:
-        return v
-
-
 def _parse_service_account_credentials(v):
     if v and isinstance(v, str):
         return json.loads(v)
@@ -0,0 +1,140 @@
+"""Async Sheets client."""
+import asyncio
+import time
+from collections.abc import Mapping, Sequence
+from typing import Any, Optional
+from urllib.parse import quote
+
+import httpx
+from google.auth import crypt, jwt
+from loguru import logger
+
+SHEETS_URL = "https://sheets.googleapis.com"
+"""The Sheets API base URL."""
+
+SHEETS_SCOPE = "https://www.googleapis.com/auth/spreadsheets"
+"""The OAuth scope to request."""
+
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+"""The default OAuth token URI."""
+
+TOKEN_LIFETIME = 3600
+"""The requested access token lifetime, in seconds."""
+
+_grant_type = "urn:ietf:params:oauth:grant-type:jwt-bearer"
+
+
+class AsyncGoogleSheetsClient:
+    """Google Sheets API client using :class:`httpx.AsyncClient`.
+
+    Access tokens are requested with a JWT signed with the service account key,
+    cached, and refreshed ``refresh_margin`` seconds before they expire. Requests
+    are not serialized, so appends to different sheets run concurrently.
+    """
+
+    def __init__(
+        self,
+        account_info: Mapping[str, str],
+        refresh_margin: float = 300,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """Create a :class:`AsyncGoogleSheetsClient`.
+
+        Args:
+            account_info: The service account credentials.
+            refresh_margin: Refresh tokens this many seconds before they expire.
+            transport: An optional transport to use instead of the default pool.
+        """
+        self._signer = crypt.RSASigner.from_service_account_info(account_info)
+        self._email = account_info["client_email"]
+        self._token_uri = account_info.get("token_uri", TOKEN_URI)
+        self._refresh_margin = refresh_margin
+        self._token: Optional[str] = None
+        self._expiry = 0.0
+        self._token_lock = asyncio.Lock()
+        self._client = httpx.AsyncClient(http2=True, transport=transport)
+
+    async def append_rows(
+        self, sheet_id: str, range: str, values: Sequence[Sequence[Any]]
+    ):
+        """Append rows to a sheet with one request."""
+        url = (
+            f"{SHEETS_URL}/v4/spreadsheets/{quote(sheet_id, safe='')}"
+            f"/values/{quote(range, safe='')}:append"
+        )
+        params = {"valueInputOption": "USER_ENTERED"}
+        body = {"values": values}
+
+        token = await self._get_token()
+        res = await self._client.post(
+            url, params=params, json=body, headers=_auth_headers(token)
+        )
+        if res.status_code == 401:
+            # the token was revoked or expired early
+            token = await self._get_token(expired=token)
+            res = await self._client.post(
+                url, params=params, json=body, headers=_auth_headers(token)
+            )
+
+        if res.is_error:
+            logger.error(
+                "Sheets API request returned {}: {}", res.status_code, res.text
+            )
+        res.raise_for_status()
+        logger.debug("Appended {} rows to {}", len(values), sheet_id)
+
+    async def close(self):
+        """Close the client and its connections."""
+        await self._client.aclose()
+
+    async def _get_token(self, expired: Optional[str] = None) -> str:
+        """Get a valid access token.
+
+        Args:
+            expired: A token known to be invalid, to refresh even if not expired.
+        """
+        if self._is_valid(expired):
+            assert self._token is not None
+            return self._token
+
+        async with self._token_lock:
+            # another task may have refreshed it while waiting
+            if not self._is_valid(expired):
+                await self._refresh()
+            assert self._token is not None
+            return self._token
+
+    def _is_valid(self, expired: Optional[str]) -> bool:
+        return (
+            self._token is not None
+            and self._token != expired
+            and time.time() < self._expiry - self._refresh_margin
+        )
+
+    async def _refresh(self):
+        now = int(time.time())
+        payload = {
+            "iss": self._email,
+            "scope": SHEETS_SCOPE,
+            "aud": self._token_uri,
+            "iat": now,
+            "exp": now + TOKEN_LIFETIME,
+        }
+        assertion = jwt.encode(self._signer, payload)
+
+        res = await self._client.post(
+            self._token_uri,
+            data={"grant_type": _grant_type, "assertion": assertion.decode()},
+        )
+        if res.is_error:
+            logger.error("Token request returned {}: {}", res.status_code, res.text)
+        res.raise_for_status()
+
+        data = res.json()
+        self._token = data["access_token"]
+        self._expiry = now + data.get("expires_in", TOKEN_LIFETIME)
+        logger.debug("Refreshed the Sheets access token")
+
+
+def _auth_headers(token: str) -> dict[str, str]:
+    return {"Authorization": f"Bearer {token}"}
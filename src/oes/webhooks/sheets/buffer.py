@@ -0,0 +1,166 @@
+"""Sheets row buffer."""
+import asyncio
+from collections.abc import Awaitable, Callable, Sequence
+from typing import Any, Optional
+
+import httpx
+from loguru import logger
+from typing_extensions import TypeAlias
+
+from oes.webhooks import metrics
+from oes.webhooks.settings import SheetsBufferSettings
+
+RowAppender: TypeAlias = Callable[[str, str, Sequence[Sequence[Any]]], Awaitable]
+"""A callable to append rows, given the sheet ID and range."""
+
+_Key: TypeAlias = tuple[str, str]
+_Row: TypeAlias = tuple[Sequence[Any], Optional[asyncio.Future], str, int]
+"""A row, the future of a request waiting for it, its label and its attempts."""
+
+
+class SheetsRowBuffer:
+    """Buffers rows and appends them to each sheet range in batches.
+
+    Rows for a sheet ID and range are appended with one request once
+    ``flush_rows`` rows are waiting or ``flush_interval`` seconds after the first
+    one was added, whichever is sooner. Batches for the same range are appended in
+    order.
+
+    When an append fails with an error that may not happen again, like a rate limit,
+    a server error or a connection error, the rows are buffered again after a delay,
+    up to ``max_attempts`` times. Rows of requests waiting for the append are not
+    retried: the error is raised to the request instead.
+    """
+
+    def __init__(self, append: RowAppender, settings: SheetsBufferSettings):
+        """Create a :class:`SheetsRowBuffer`.
+
+        Args:
+            append: The function to append rows with.
+            settings: The buffer settings.
+        """
+        self._append = append
+        self._settings = settings
+        self._pending: dict[_Key, list[_Row]] = {}
+        self._timers: dict[_Key, asyncio.TimerHandle] = {}
+        self._locks: dict[_Key, asyncio.Lock] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def add(
+        self,
+        sheet_id: str,
+        range: str,
+        row: Sequence[Any],
+        wait: bool = False,
+        label: str = "",
+    ):
+        """Add a row.
+
+        Args:
+            sheet_id: The sheet ID.
+            range: The range to append to.
+            row: The column values.
+            wait: Wait until the row is appended, raising any error appending it.
+            label: The hook ID to count the row under in the metrics.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future() if wait else None
+        key = (sheet_id, range)
+        rows = self._pending.setdefault(key, [])
+        rows.append((row, future, label, 0))
+
+        if len(rows) >= max(self._settings.flush_rows, 1):
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(
+                self._settings.flush_interval, self._flush, key
+            )
+
+        if future is not None:
+            await future
+
+    async def close(self):
+        """Append all buffered rows and wait for pending appends to finish."""
+        while self._pending or self._tasks:
+            for key in list(self._pending):
+                self._flush(key)
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _flush(self, key: _Key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+        rows = self._pending.pop(key, None)
+        if rows:
+            task = asyncio.create_task(self._append_rows(key, rows))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _append_rows(self, key: _Key, rows: list[_Row]):
+        sheet_id, range = key
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            try:
+                with metrics.timed("sheets_append"):
+                    await self._append(sheet_id, range, [r[0] for r in rows])
+            except Exception as e:
+                retry = self._failed(key, rows, e)
+            else:
+                retry = []
+                logger.debug("Appended {} rows to {}", len(rows), sheet_id)
+                for _, future, label, _ in rows:
+                    metrics.SHEETS_ROWS.labels(label, "appended").inc()
+                    if future is not None and not future.done():
+                        future.set_result(None)
+
+        if retry:
+            attempts = max(r[3] for r in retry)
+            await asyncio.sleep(self._settings.retry_delay * 2 ** (attempts - 1))
+            self._requeue(key, retry)
+
+    def _failed(self, key: _Key, rows: list[_Row], exc: Exception) -> list[_Row]:
+        """Handle a failed append, returning the rows to retry."""
+        sheet_id, _ = key
+        retryable = is_retryable(exc)
+        retry: list[_Row] = []
+        dropped = 0
+        for row, future, label, attempts in rows:
+            if future is not None:
+                metrics.SHEETS_ROWS.labels(label, "error").inc()
+                if not future.done():
+                    future.set_exception(exc)
+            elif retryable and attempts + 1 < self._settings.max_attempts:
+                metrics.SHEETS_ROWS.labels(label, "retried").inc()
+                retry.append((row, None, label, attempts + 1))
+            else:
+                metrics.SHEETS_ROWS.labels(label, "dropped").inc()
+                dropped += 1
+
+        logger.opt(exception=exc).error(
+            "Failed to append {} rows to {}: retrying {}, dropped {}",
+            len(rows),
+            sheet_id,
+            len(retry),
+            dropped,
+        )
+        return retry
+
+    def _requeue(self, key: _Key, rows: list[_Row]):
+        """Buffer rows to retry ahead of the rows added since they were taken."""
+        self._pending[key] = rows + self._pending.get(key, [])
+        self._flush(key)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Whether an append that failed with an error may succeed if tried again."""
+    # httpx.HTTPStatusError
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status is None:
+        # googleapiclient.errors.HttpError
+        status = getattr(getattr(exc, "resp", None), "status", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+
+    # connection errors and timeouts
+    return isinstance(exc, (OSError, httpx.TransportError))
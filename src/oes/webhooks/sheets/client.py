@@ -1,31 +1,54 @@
 """Sheets client."""
+import json
 import threading
 from collections.abc import Mapping, Sequence
-from typing import Any
+from pathlib import Path
+from typing import Any, Optional
 
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
 from loguru import logger
 
 from oes.webhooks.settings import GoogleSheetsHook
+from oes.webhooks.sheets.hooks import render_values
+
+DISCOVERY_DOCUMENT_PATH = Path(__file__).parent / "sheets.v4.json"
+"""The Sheets API discovery document, limited to the methods used by the client."""
 
 
 class GoogleSheetsClient:
-    """Google Sheets API client."""
+    """Google Sheets API client.
+
+    The Google API libraries are imported, and the API service is built from the
+    bundled discovery document, on first use.
+    """
 
     def __init__(self, account_info: Mapping[str, str]):
-        creds = Credentials.from_service_account_info(account_info)
-        self._service = build("sheets", "v4", credentials=creds)
+        self._account_info = account_info
+        self._service: Optional[Any] = None
         self._lock = threading.Lock()
 
     def append(self, hook: GoogleSheetsHook, data: Mapping[str, Any]):
         """Append a row to the sheet."""
-        values = _render_values(hook, data)
+        values = render_values(hook, data)
+        self.append_rows(hook.sheet_id, hook.range, [values])
+
+    def append_rows(self, sheet_id: str, range: str, values: Sequence[Sequence[Any]]):
+        """Append rows to a sheet with one request."""
         with self._lock:
-            self._append(hook.sheet_id, hook.range, [values])
+            self._append(sheet_id, range, values)
+
+    def _get_service(self) -> Any:
+        if self._service is None:
+            from google.oauth2.service_account import Credentials
+            from googleapiclient.discovery import build_from_document
+
+            creds = Credentials.from_service_account_info(self._account_info)
+            self._service = build_from_document(
+                json.loads(DISCOVERY_DOCUMENT_PATH.read_text()), credentials=creds
+            )
+        return self._service
 
     def _append(self, sheet_id: str, range: str, values: Sequence[Sequence[Any]]):
-        sheets = self._service.spreadsheets()
+        sheets = self._get_service().spreadsheets()
         values_obj = sheets.values()
 
         request = values_obj.append(
@@ -37,12 +60,4 @@ class GoogleSheetsClient:
             },
         )
         request.execute()
-        logger.debug(f"Appended {values!r} row to {sheet_id}")
-
-
-def _render_values(hook: GoogleSheetsHook, data: Mapping[str, Any]) -> Sequence[str]:
-    columns = []
-    for value_tmpl in hook.values:
-        result = value_tmpl(data)
-        columns.append(str(result) if result is not None else "")
-    return columns
+        logger.debug("Appended {} rows to {}", len(values), sheet_id)
@@ -0,0 +1,120 @@
+"""Sheets hooks."""
+import functools
+import time
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from typing import Any, Optional, cast
+
+from attrs import define
+from jinja2 import ChainableUndefined, TemplateSyntaxError, Undefined, nodes
+from jinja2.environment import TemplateExpression
+from jinja2.parser import Parser
+from jinja2.sandbox import ImmutableSandboxedEnvironment
+from typing_extensions import TypeAlias
+
+from oes.webhooks.settings import GoogleSheetsHook
+
+RowRenderer: TypeAlias = Callable[[Mapping[str, Any]], Sequence[str]]
+"""A callable to render a row's column values from the hook data."""
+
+_jinja2_env = ImmutableSandboxedEnvironment(
+    undefined=ChainableUndefined,
+)
+
+
+@define
+class HookStats:
+    """Row rendering statistics for a hook."""
+
+    renders: int = 0
+    """The number of rows rendered."""
+
+    total_time: float = 0.0
+    """The total time spent rendering, in seconds."""
+
+    max_time: float = 0.0
+    """The longest time spent rendering a row, in seconds."""
+
+
+class SheetsHookRegistry:
+    """The configured Sheets hooks, by ID, with their compiled row renderers."""
+
+    def __init__(self, hooks: Iterable[GoogleSheetsHook]):
+        """Compile the row renderers for the hooks.
+
+        Raises:
+            TemplateSyntaxError: If a column value expression is invalid.
+        """
+        self._hooks: dict[str, tuple[GoogleSheetsHook, RowRenderer]] = {}
+        self._stats: dict[str, HookStats] = {}
+        for hook in hooks:
+            self._hooks[hook.id] = (hook, compile_row(tuple(hook.values)))
+            self._stats[hook.id] = HookStats()
+
+    def get(self, hook_id: str) -> Optional[GoogleSheetsHook]:
+        """Get a hook by ID."""
+        entry = self._hooks.get(hook_id)
+        return entry[0] if entry is not None else None
+
+    def render(self, hook_id: str, data: Mapping[str, Any]) -> Sequence[str]:
+        """Render a row for a hook, recording the time taken."""
+        _, renderer = self._hooks[hook_id]
+        start = time.perf_counter()
+        row = renderer(data)
+        elapsed = time.perf_counter() - start
+
+        stats = self._stats[hook_id]
+        stats.renders += 1
+        stats.total_time += elapsed
+        stats.max_time = max(stats.max_time, elapsed)
+        return row
+
+    def stats(self) -> Mapping[str, HookStats]:
+        """Get the row rendering statistics by hook ID."""
+        return self._stats
+
+
+@functools.lru_cache(maxsize=128)
+def compile_row(expressions: tuple[str, ...]) -> RowRenderer:
+    """Compile column value expressions into one row renderer.
+
+    The expressions are combined into a single list expression, so rendering a row
+    evaluates one sandboxed template instead of one per column.
+
+    Raises:
+        TemplateSyntaxError: If an expression is invalid.
+    """
+    columns = [_parse_expression(source) for source in expressions]
+    row = nodes.List(columns, lineno=1)
+    row.set_environment(_jinja2_env)
+    body = [nodes.Assign(nodes.Name("result", "store"), row, lineno=1)]
+    template = _jinja2_env.from_string(nodes.Template(body, lineno=1))
+    expr = TemplateExpression(template, undefined_to_none=False)
+
+    def render(data: Mapping[str, Any]) -> Sequence[str]:
+        return [_format_value(v) for v in cast(list, expr(data))]
+
+    return render
+
+
+def render_values(hook: GoogleSheetsHook, data: Mapping[str, Any]) -> Sequence[str]:
+    """Render a hook's column values."""
+    return compile_row(tuple(hook.values))(data)
+
+
+def _parse_expression(source: str) -> nodes.Expr:
+    parser = Parser(_jinja2_env, source, state="variable")
+    try:
+        expr = parser.parse_expression()
+        if not parser.stream.eos:
+            raise TemplateSyntaxError(
+                "chunk after expression", parser.stream.current.lineno, None, None
+            )
+    except TemplateSyntaxError:
+        _jinja2_env.handle_exception(source=source)
+    return expr
+
+
+def _format_value(value: Any) -> str:
+    if value is None or isinstance(value, Undefined):
+        return ""
+    return str(value)
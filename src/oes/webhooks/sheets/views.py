@@ -1,32 +1,139 @@
 """Sheets hook views."""
 from __future__ import annotations
 
-import asyncio
-from typing import TYPE_CHECKING, Optional
+from collections.abc import Sequence
+from typing import TYPE_CHECKING, Any, Optional
 
-from quart import Response, request
+from loguru import logger
+from quart import Response, jsonify, request
 from werkzeug.exceptions import NotFound
 
+from oes.webhooks import metrics
+from oes.webhooks.admission import admitted
 from oes.webhooks.app import app
-from oes.webhooks.settings import Settings
+from oes.webhooks.ndjson import is_ndjson, iter_records, process_records
+from oes.webhooks.settings import Settings, SheetsClientType
+from oes.webhooks.sheets.buffer import RowAppender, SheetsRowBuffer
+from oes.webhooks.sheets.hooks import SheetsHookRegistry
 
 if TYPE_CHECKING:
+    from oes.webhooks.sheets.async_client import AsyncGoogleSheetsClient
     from oes.webhooks.sheets.client import GoogleSheetsClient
 
 
 @app.post("/sheets/<string:hook_id>")
+@admitted("sheets")
 async def sheets_hook(hook_id: str) -> Response:
     """Append a row."""
     settings: Settings = app.config["settings"]
-    sheets_client: Optional[GoogleSheetsClient] = app.config.get("sheets_client")
-    if sheets_client is None:
+    sheets_buffer: Optional[SheetsRowBuffer] = app.config.get("sheets_buffer")
+    if sheets_buffer is None:
         raise NotFound
 
-    hook = next((h for h in settings.google.sheets_hooks if h.id == hook_id), None)
+    hooks: SheetsHookRegistry = app.config["sheets_hooks"]
+    hook = hooks.get(hook_id)
     if hook is None:
         raise NotFound
 
-    data = await request.get_json()
+    wait = request.args.get(
+        "wait", settings.google.sheets_buffer.wait_for_flush, type=_parse_bool
+    )
+
+    if is_ndjson(request):
+
+        async def ingest(record: Any) -> dict[str, Any]:
+            if not isinstance(record, dict):
+                return {"status": "error", "error": "Not an object"}
+            values = hooks.render(hook_id, record)
+            await sheets_buffer.add(
+                hook.sheet_id, hook.range, values, wait=wait, label=hook_id
+            )
+            return {"status": "appended" if wait else "buffered"}
 
-    await asyncio.to_thread(sheets_client.append, hook, data)
+        results = await process_records(
+            iter_records(request.body),
+            ingest,
+            settings.google.sheets_buffer.flush_rows,
+        )
+        return jsonify({"results": results})
+
+    with metrics.timed("parse"):
+        data = await request.get_json()
+    values = hooks.render(hook_id, data)
+    await sheets_buffer.add(hook.sheet_id, hook.range, values, wait=wait, label=hook_id)
     return Response(status=204)
+
+
+@app.get("/sheets-hooks")
+async def sheets_hook_stats() -> Response:
+    """Get row rendering statistics by hook ID."""
+    hooks: SheetsHookRegistry = app.config["sheets_hooks"]
+    return jsonify(
+        {
+            hook_id: {
+                "renders": stats.renders,
+                "total_time": stats.total_time,
+                "mean_time": stats.total_time / stats.renders if stats.renders else 0,
+                "max_time": stats.max_time,
+            }
+            for hook_id, stats in hooks.stats().items()
+        }
+    )
+
+
+def _parse_bool(value: str) -> bool:
+    return value.lower() not in ("", "0", "false", "no")
+
+
+@app.before_serving
+async def start_sheets_buffer():
+    """Create the row buffer, if Sheets is configured."""
+    settings: Settings = app.config["settings"]
+    append = _get_row_appender(settings)
+    if append is not None:
+        app.config["sheets_buffer"] = SheetsRowBuffer(
+            append, settings.google.sheets_buffer
+        )
+
+
+def _get_row_appender(settings: Settings) -> Optional[RowAppender]:
+    if settings.google.sheets_client == SheetsClientType.httpx:
+        if not settings.google.service_account_credentials:
+            return None
+
+        try:
+            from oes.webhooks.sheets.async_client import AsyncGoogleSheetsClient
+        except ImportError:
+            logger.error("google-auth is required for the httpx Sheets client")
+            return None
+
+        async_client = AsyncGoogleSheetsClient(
+            settings.google.service_account_credentials
+        )
+        app.config["sheets_async_client"] = async_client
+        return async_client.append_rows
+
+    sheets_client: Optional[GoogleSheetsClient] = app.config.get("sheets_client")
+    if sheets_client is None:
+        return None
+
+    append_rows = sheets_client.append_rows
+
+    async def append(sheet_id: str, range: str, values: Sequence[Sequence[Any]]):
+        await metrics.to_thread("sheets_append", append_rows, sheet_id, range, values)
+
+    return append
+
+
+@app.after_serving
+async def flush_sheets_buffer():
+    """Append any buffered rows on shutdown."""
+    sheets_buffer: Optional[SheetsRowBuffer] = app.config.pop("sheets_buffer", None)
+    if sheets_buffer is not None:
+        await sheets_buffer.close()
+
+    async_client: Optional[AsyncGoogleSheetsClient] = app.config.pop(
+        "sheets_async_client", None
+    )
+    if async_client is not None:
+        await async_client.close()
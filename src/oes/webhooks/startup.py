@@ -0,0 +1,69 @@
+"""Startup profiling module."""
+import contextlib
+import functools
+import os
+import time
+from collections.abc import Awaitable, Callable, Iterator
+
+from loguru import logger
+from quart import Quart
+
+
+class StartupProfile:
+    """Records the time taken by each startup step."""
+
+    def __init__(self, name: str):
+        """Create a :class:`StartupProfile`.
+
+        Args:
+            name: The name of the process, for the report.
+        """
+        self.name = name
+        self.steps: list[tuple[str, float]] = []
+
+    @contextlib.contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        """Time a step."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - start))
+
+    def report(self) -> str:
+        """Get a report of the step times."""
+        width = max((len(name) for name, _ in self.steps), default=0)
+        total = sum(elapsed for _, elapsed in self.steps)
+        lines = [f"{self.name} startup (pid {os.getpid()}):", ""]
+        lines.extend(
+            f"\t{name:<{width}}  {elapsed * 1000:8.1f} ms"
+            for name, elapsed in self.steps
+        )
+        lines.append(f"\t{'total':<{width}}  {total * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+def profile_serving(app: Quart, profile: StartupProfile):
+    """Time each of the app's ``before_serving`` functions.
+
+    The report is logged once they have all run.
+    """
+    app.before_serving_funcs[:] = [
+        _timed(profile, func) for func in app.before_serving_funcs
+    ]
+
+    @app.before_serving
+    async def log_startup_profile():
+        logger.info(profile.report())
+
+
+def _timed(
+    profile: StartupProfile, func: Callable[[], Awaitable[None]]
+) -> Callable[[], Awaitable[None]]:
+    @functools.wraps(func)
+    async def wrapper():
+        module = func.__module__.removeprefix("oes.webhooks.")
+        with profile.step(f"start {module}.{func.__name__}"):
+            await func()
+
+    return wrapper
@@ -0,0 +1,69 @@
+import os
+
+from oes.webhooks.email import cache
+from oes.webhooks.email.cache import AttachmentCache
+from oes.webhooks.email.types import encode_base64
+
+
+def test_cache_hit(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_bytes(b"data")
+    attachment_cache = AttachmentCache()
+
+    entry = attachment_cache.get(path)
+    assert entry.encoded == encode_base64(b"data")
+    assert attachment_cache.get(path) is entry
+
+
+def test_cache_reload_changed(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_bytes(b"data")
+    attachment_cache = AttachmentCache()
+    entry = attachment_cache.get(path)
+
+    path.write_bytes(b"changed")
+    os.utime(path, ns=(entry.mtime_ns + 1_000_000, entry.mtime_ns + 1_000_000))
+
+    assert attachment_cache.get(path).encoded == encode_base64(b"changed")
+
+
+def test_cache_evict(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"file{i}.txt"
+        path.write_bytes(b"x" * 30)
+        paths.append(path)
+
+    # each entry is 41 encoded bytes
+    attachment_cache = AttachmentCache(max_size=100)
+    first = attachment_cache.get(paths[0])
+    attachment_cache.get(paths[1])
+    attachment_cache.get(paths[2])
+
+    assert attachment_cache.get(paths[0]) is not first
+
+
+def test_cache_mmap(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "MMAP_THRESHOLD", 4)
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"large data")
+    attachment_cache = AttachmentCache()
+
+    entry = attachment_cache.get(path)
+    assert entry.encoded == encode_base64(b"large data")
+    assert entry.size == len(entry.encoded)
+
+
+def test_cache_max_size_change_evicts(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"file{i}.txt"
+        path.write_bytes(b"x" * 30)
+        paths.append(path)
+
+    attachment_cache = AttachmentCache()
+    entries = [attachment_cache.get(p) for p in paths]
+
+    attachment_cache.max_size = 100
+    assert attachment_cache.get(paths[2]) is entries[2]
+    assert attachment_cache.get(paths[0]) is not entries[0]
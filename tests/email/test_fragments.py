@@ -0,0 +1,80 @@
+import os
+from pathlib import Path
+
+from oes.webhooks.email.fragments import FragmentCache
+from oes.webhooks.email.template import get_environment, get_fragment_cache
+
+
+def test_fragment_cache(tmp_path: Path):
+    (tmp_path / "cached.txt").write_text(
+        '{% cache "key" %}{{ value }}{% endcache %} {{ value }}'
+    )
+    env = get_environment(tmp_path)
+
+    assert env.get_template("cached.txt").render(value=1) == "1 1"
+    assert env.get_template("cached.txt").render(value=2) == "1 2"
+    assert len(get_fragment_cache(env)) == 1
+
+
+def test_fragment_cache_keys(tmp_path: Path):
+    (tmp_path / "cached.txt").write_text(
+        "{% cache ('event', id) %}{{ value }}{% endcache %}"
+    )
+    env = get_environment(tmp_path)
+    template = env.get_template("cached.txt")
+
+    assert template.render(id=1, value="a") == "a"
+    assert template.render(id=2, value="b") == "b"
+    assert template.render(id=1, value="c") == "a"
+
+
+def test_fragment_cache_ttl(tmp_path: Path):
+    (tmp_path / "cached.txt").write_text(
+        '{% cache "key", 0 %}{{ value }}{% endcache %}'
+    )
+    env = get_environment(tmp_path)
+
+    assert env.get_template("cached.txt").render(value=1) == "1"
+    assert env.get_template("cached.txt").render(value=2) == "2"
+
+
+def test_fragment_cache_template_changed(tmp_path: Path):
+    path = tmp_path / "cached.txt"
+    path.write_text('{% cache "key" %}old {{ value }}{% endcache %}')
+    env = get_environment(tmp_path)
+    assert env.get_template("cached.txt").render(value=1) == "old 1"
+
+    path.write_text('{% cache "key" %}new {{ value }}{% endcache %}')
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert env.get_template("cached.txt").render(value=2) == "new 2"
+
+
+def test_fragment_cache_include_changed(tmp_path: Path):
+    (tmp_path / "cached.txt").write_text(
+        '{% cache "key" %}{% include "included.txt" %}{% endcache %}'
+    )
+    path = tmp_path / "included.txt"
+    path.write_text("old {{ value }}")
+    env = get_environment(tmp_path)
+    assert env.get_template("cached.txt").render(value=1) == "old 1"
+
+    path.write_text("new {{ value }}")
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert env.get_template("cached.txt").render(value=2) == "new 2"
+
+
+def test_fragment_cache_lru():
+    cache = FragmentCache(max_entries=2)
+    cache.set(("t", 1, "a"), "a")
+    cache.set(("t", 1, "b"), "b")
+    cache.get(("t", 1, "a"))
+    cache.set(("t", 1, "c"), "c")
+
+    assert cache.get(("t", 1, "a")) == "a"
+    assert cache.get(("t", 1, "b")) is None
+    assert cache.get(("t", 1, "c")) == "c"
+
+    cache.invalidate("t")
+    assert len(cache) == 0
@@ -1,4 +1,6 @@
-from oes.webhooks.email.html import process_html
+import pytest
+
+from oes.webhooks.email.html import precompile_html, process_html
 
 html = """
 <!DOCTYPE html>
@@ -33,3 +35,54 @@ expected = (
 def test_process_html():
     res = process_html(html)
     assert res == expected
+
+
+template = """
+<!DOCTYPE html>
+<html>
+    <!-- {% set x = 1 %} {# comment #} -->
+    <head>
+        <title>{{ title }}</title>
+        <style>
+            a {
+                text-decoration: underline;
+            }
+        </style>
+    </head>
+    <body>
+        {% for item in items %}
+        <p>
+            {{ item }} <a style="color: red" href="{{ item.url }}">link</a>.
+        </p>
+        {% endfor %}
+    </body>
+</html>
+"""
+
+expected_template = (
+    "<!doctype html>{% set x = 1 %}<title>{{ title }}</title><body>"
+    "{% for item in items %}<p>{{ item }} "
+    '<a href="{{ item.url }}" style="color: red;text-decoration: underline">link</a>.'
+    "{% endfor %}"
+)
+
+
+def test_precompile_html():
+    res = precompile_html(template)
+    assert res == expected_template
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "<style>p { color: {{ color }}; }</style><p>test</p>",
+        '<p class="{{ cls }}">test</p>',
+        "<p {{ attrs }}>test</p>",
+        "<!-- {{ value }} --><p>test</p>",
+        "<style>li:first-child { color: red; }</style>{% for i in x %}<li>{% endfor %}",
+        "<style>p + p { color: red; }</style><p>{% if x %}<p>{% endif %}",
+        '{% include "footer.html" %}<p>test</p>',
+    ],
+)
+def test_precompile_html_unsupported(source):
+    assert precompile_html(source) is None
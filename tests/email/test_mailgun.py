@@ -0,0 +1,150 @@
+import asyncio
+from email import message_from_bytes, policy
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from oes.webhooks.email.mailgun import MailgunClient
+from oes.webhooks.email.sender import serialize_batch_email
+from oes.webhooks.email.types import Email
+from oes.webhooks.settings import MailgunSettings
+
+
+class FakeHTTPServer:
+    def __init__(self):
+        self.connections = 0
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.decode().split("\r\n"):
+                name, _, value = line.partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            self.requests += 1
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}")
+            await writer.drain()
+
+
+@pytest_asyncio.fixture
+async def server():
+    fake = FakeHTTPServer()
+
+    async def handle(reader, writer):
+        try:
+            await fake.handle(reader, writer)
+        except asyncio.IncompleteReadError:
+            writer.close()
+
+    srv = await asyncio.start_server(handle, "127.0.0.1", 0)
+    fake.port = srv.sockets[0].getsockname()[1]
+    yield fake
+    srv.close()
+
+
+@pytest.mark.asyncio
+async def test_client_reuses_connections(server):
+    client = MailgunClient(MailgunSettings(api_key="key", http2=False))
+    url = f"http://127.0.0.1:{server.port}/v3/test/messages.mime"
+
+    for _ in range(3):
+        res = await client.post(url, data={"to": "to@test.com"})
+        assert res.status_code == 200
+
+    await client.close()
+
+    assert server.requests == 3
+    assert server.connections == 1
+    assert client.requests == 3
+    assert client.connections == 1
+    assert client.reused == 2
+
+
+@pytest.mark.asyncio
+async def test_client_post_stream():
+    requests = []
+
+    async def handle(request: httpx.Request) -> httpx.Response:
+        requests.append((request.headers, await request.aread()))
+        return httpx.Response(200, json={})
+
+    client = MailgunClient(
+        MailgunSettings(api_key="key", http2=False),
+        transport=httpx.MockTransport(handle),
+    )
+
+    async def message():
+        yield b"Subject: test\n\n"
+        yield b"body\n"
+
+    res = await client.post_stream(
+        "http://mailgun.test/v3/test/messages.mime",
+        {"to": "to@test.com", "o:tag": ["a", "b"]},
+        "message",
+        message(),
+    )
+    await client.close()
+    assert res.status_code == 200
+
+    headers, body = requests[0]
+    assert "content-length" not in headers
+    form = message_from_bytes(
+        b"Content-Type: " + headers["content-type"].encode() + b"\r\n\r\n" + body,
+        policy=policy.HTTP,
+    )
+    parts = [
+        (part.get_param("name", header="content-disposition"), part.get_content())
+        for part in form.iter_parts()
+    ]
+    assert parts == [
+        ("to", "to@test.com"),
+        ("o:tag", "a"),
+        ("o:tag", "b"),
+        ("message", b"Subject: test\n\nbody\n"),
+    ]
+
+
+def test_serialize_batch_email_keeps_placeholders():
+    html = (
+        '<html><body><p style="color: red; font-size: 12px">'
+        + "Some words " * 50
+        + "<b>%recipient.name%</b>"
+        + " more words" * 50
+        + "</p></body></html>"
+    )
+    email = Email(
+        to="%recipient%",
+        from_="from@test.com",
+        subject="Hello",
+        text="Hello %recipient.name%, " + "text " * 100,
+        html=html,
+    )
+    message = serialize_batch_email(email)
+    assert message is not None
+    assert all(len(line) <= 998 for line in message.splitlines())
+
+    parsed = message_from_bytes(message, policy=policy.default)
+    for subtype in ("plain", "html"):
+        part = parsed.get_body((subtype,))
+        assert part["Content-Transfer-Encoding"] in ("7bit", "8bit")
+        assert "%recipient.name%" in part.get_content()
+
+    html_part = parsed.get_body(("html",)).get_content()
+    assert html_part.split() == html.split()
+
+
+@pytest.mark.parametrize(
+    "html",
+    [
+        "<p>" + "x" * 300 + "</p>",
+        "<pre>" + "line of text " * 30 + "</pre>",
+    ],
+)
+def test_serialize_batch_email_not_possible(html):
+    email = Email(to="%recipient%", from_="from@test.com", text="text", html=html)
+    assert serialize_batch_email(email) is None
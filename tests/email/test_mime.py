@@ -0,0 +1,185 @@
+import re
+from io import BytesIO
+
+import pytest
+
+from oes.webhooks.email import mime
+from oes.webhooks.email.mime import (
+    iter_message_chunks,
+    serialize_message,
+    write_message,
+)
+from oes.webhooks.email.types import Attachment, AttachmentType, Email, encode_base64
+
+DATE = "Mon, 02 Jan 2023 03:04:05 +0000"
+
+
+def _normalize(data: bytes) -> bytes:
+    # replace random boundaries in order of appearance
+    names: dict[bytes, bytes] = {}
+
+    def replace(match: re.Match) -> bytes:
+        return names.setdefault(match.group(0), b"BOUNDARY-%d" % len(names))
+
+    return re.sub(rb"=+[0-9]+==", replace, data)
+
+
+def _expected(email: Email) -> bytes:
+    msg = email.get_message()
+    msg.add_header("Date", DATE)
+    return _normalize(bytes(msg))
+
+
+def _attachments():
+    data = bytes(range(256)) * 8
+    return (
+        Attachment(
+            id="att1",
+            name="file.png",
+            data=BytesIO(b"1234"),
+            media_type="image/png",
+            attachment_type=AttachmentType.inline,
+        ),
+        Attachment(
+            id="att2",
+            name="file.doc",
+            data=data,
+            media_type="application/octet-stream",
+        ),
+        Attachment(
+            id="att3",
+            name="encoded.bin",
+            data=data,
+            encoded=encode_base64(data),
+            media_type="application/octet-stream",
+        ),
+        Attachment(
+            id="att4",
+            name="résumé final.pdf",
+            data=b"pdf",
+            media_type="application/pdf",
+        ),
+        Attachment(
+            id="att5",
+            data=b"no name",
+            media_type="text/plain",
+        ),
+    )
+
+
+_long_line = "word " * 40
+_long_text = "\n".join(f"line {i} {_long_line}" for i in range(20))
+
+
+@pytest.mark.parametrize(
+    "make_email",
+    [
+        lambda: Email(to="to@test.com", from_="from@test.com", text="text"),
+        lambda: Email(
+            to="to@test.com", from_="from@test.com", subject="Subject", text=""
+        ),
+        lambda: Email(
+            to="Test User <to@test.com>",
+            from_='"Example, Inc." <from@test.com>',
+            subject="Ünïcödé subject",
+            text="Ünïcödé text\n",
+        ),
+        lambda: Email(
+            to="to@test.com",
+            from_="from@test.com",
+            subject="A long subject " * 8,
+            text=_long_line,
+        ),
+        lambda: Email(
+            to="to@test.com",
+            from_="from@test.com",
+            subject="Subject",
+            text=_long_text,
+            html="<p>" + "ü" * 200 + "</p>",
+        ),
+        lambda: Email(
+            to="to@test.com",
+            from_="from@test.com",
+            subject="Subject",
+            text="plain text",
+            html="<b>HTML</b>",
+            attachments=_attachments(),
+        ),
+    ],
+)
+def test_serialize_message(make_email):
+    assert _normalize(serialize_message(make_email(), DATE)) == _expected(make_email())
+
+
+def test_write_message_chunks():
+    email = Email(
+        to="to@test.com",
+        from_="from@test.com",
+        text="text",
+        attachments=_attachments(),
+    )
+    chunks = list(write_message(email))
+    assert len(chunks) > 1
+    assert all(isinstance(c, bytes) for c in chunks)
+    assert b"Date:" not in b"".join(chunks)
+
+
+@pytest.mark.parametrize(
+    "email",
+    [
+        Email(
+            to="to@test.com",
+            from_="from@test.com",
+            subject="hi\nBcc: evil@x.com",
+            text="text",
+        ),
+        Email(to="to@test.com\r\nBcc: evil@x.com", from_="from@test.com", text="text"),
+        Email(to="to@test.com", from_="from@test.com\nBcc: evil@x.com", text="text"),
+        Email(
+            to="to@test.com",
+            from_="from@test.com",
+            text="text",
+            subject="long " * 30 + "\nBcc: evil@x.com",
+        ),
+    ],
+)
+def test_serialize_message_rejects_line_breaks(email):
+    with pytest.raises(ValueError):
+        serialize_message(email, DATE)
+
+
+class _ShortReads(BytesIO):
+    def read(self, size=-1):
+        return super().read(min(size, 1000) if size >= 0 else size)
+
+
+def test_iter_message_chunks_streams_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(mime, "_chunk_bytes", 57 * 4)
+    data = bytes(range(256)) * 40
+    path = tmp_path / "large.pdf"
+    path.write_bytes(data)
+
+    def make_email(*attachments):
+        return Email(
+            to="to@test.com",
+            from_="from@test.com",
+            text="text",
+            attachments=attachments,
+        )
+
+    streamed = make_email(
+        Attachment(id="att1", data=path, media_type="application/pdf"),
+        Attachment(id="att2", data=_ShortReads(data), media_type="application/pdf"),
+    )
+    in_memory = make_email(
+        Attachment(id="att1", data=data, media_type="application/pdf"),
+        Attachment(id="att2", data=data, media_type="application/pdf"),
+    )
+
+    chunks = list(iter_message_chunks(streamed, DATE, size=1024))
+    assert len(chunks) > 10
+    assert max(len(c) for c in chunks) < 1024 + 57 * 4 * 2
+    assert _normalize(b"".join(chunks)) == _normalize(
+        serialize_message(in_memory, DATE)
+    )
+    assert _normalize(serialize_message(in_memory, DATE)) == _expected(in_memory)
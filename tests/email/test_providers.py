@@ -0,0 +1,235 @@
+import asyncio
+
+import httpx
+import pytest
+from aiosmtplib import (
+    SMTPRecipientRefused,
+    SMTPRecipientsRefused,
+    SMTPResponseException,
+)
+
+from oes.webhooks.email import sender
+from oes.webhooks.email.providers import (
+    CircuitBreaker,
+    NoProviderAvailable,
+    Provider,
+    ProviderRouter,
+    is_message_error,
+)
+from oes.webhooks.email.sender import (
+    close_senders,
+    get_sender_stats,
+    make_provider_router,
+    providers_message_sender,
+    start_senders,
+)
+from oes.webhooks.settings import (
+    EmailProviderSettings,
+    EmailSenderType,
+    EmailSettings,
+    MailgunSettings,
+    SMTPSettings,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self) -> float:
+        return self.time
+
+
+def _provider(name, **kwargs):
+    return Provider(name, EmailSettings(), **kwargs)
+
+
+def test_circuit_breaker():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.acquire()
+
+    clock.time = 10
+    assert breaker.acquire()
+    assert breaker.state == "half_open"
+    # one trial at a time
+    assert not breaker.acquire()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    clock.time = 20
+    assert breaker.acquire()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_router_fails_over():
+    failing = _provider("failing", breaker=CircuitBreaker(failure_threshold=1))
+    working = _provider("working")
+    router = ProviderRouter([failing, working])
+    used = []
+
+    async def send(provider):
+        used.append(provider.name)
+        if provider is failing:
+            raise ConnectionError
+
+    for _ in range(5):
+        await router.send(send)
+
+    # skipped once its breaker opened
+    assert used.count("failing") == 1
+    assert working.sent == 5
+    assert router.stats()["failing"]["state"] == "open"
+
+
+@pytest.mark.asyncio
+async def test_router_all_failed():
+    router = ProviderRouter([_provider("a"), _provider("b")])
+
+    async def send(provider):
+        raise ConnectionError(provider.name)
+
+    with pytest.raises(ConnectionError):
+        await router.send(send)
+
+    router = ProviderRouter([_provider("a", weight=0)])
+    with pytest.raises(NoProviderAvailable):
+        await router.send(send)
+
+
+@pytest.mark.asyncio
+async def test_router_message_error_not_retried():
+    a = _provider("a")
+    b = _provider("b")
+    router = ProviderRouter([a, b])
+    request = httpx.Request("POST", "http://test")
+    error = httpx.HTTPStatusError(
+        "bad", request=request, response=httpx.Response(400, request=request)
+    )
+    calls = []
+
+    async def send(provider):
+        calls.append(provider)
+        raise error
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await router.send(send)
+    assert len(calls) == 1
+    assert a.breaker.failures == b.breaker.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_router_prefers_free_providers():
+    slow = _provider("slow", concurrency=1, weight=100)
+    fast = _provider("fast", concurrency=10)
+    router = ProviderRouter([slow, fast])
+    release = asyncio.Event()
+
+    async def send(provider):
+        if provider is slow:
+            await release.wait()
+
+    assert slow.breaker.acquire()
+    first = asyncio.create_task(slow.run(send))
+    await asyncio.sleep(0)
+    assert slow.saturated
+    for _ in range(5):
+        await router.send(send)
+    assert fast.sent == 5
+
+    release.set()
+    await first
+
+
+def test_is_message_error():
+    request = httpx.Request("POST", "http://test")
+    for status, expected in ((400, True), (429, False), (401, False), (502, False)):
+        error = httpx.HTTPStatusError(
+            "", request=request, response=httpx.Response(status, request=request)
+        )
+        assert is_message_error(error) is expected
+    assert not is_message_error(ConnectionError())
+
+
+def test_is_message_error_smtp():
+    assert is_message_error(SMTPResponseException(550, "Rejected"))
+    assert not is_message_error(SMTPResponseException(421, "Try again later"))
+    assert not is_message_error(SMTPResponseException(535, "Bad credentials"))
+
+    unknown = SMTPRecipientRefused(550, "No such user", "bad@test.com")
+    busy = SMTPRecipientRefused(450, "Mailbox busy", "busy@test.com")
+    assert is_message_error(SMTPRecipientsRefused([unknown]))
+    assert not is_message_error(SMTPRecipientsRefused([unknown, busy]))
+    assert not is_message_error(SMTPRecipientsRefused([]))
+
+
+def test_make_provider_router():
+    smtp = SMTPSettings(server="smtp.test")
+    settings = EmailSettings(
+        use=EmailSenderType.providers,
+        providers=[
+            EmailProviderSettings(name="mock", use=EmailSenderType.mock, weight=2),
+            EmailProviderSettings(name="smtp", use=EmailSenderType.smtp, smtp=smtp),
+        ],
+    )
+    router = make_provider_router(settings)
+    mock, smtp_provider = router.providers
+    assert mock.weight == 2
+    assert mock.settings.use == EmailSenderType.mock
+    assert smtp_provider.settings.smtp == smtp
+    assert smtp_provider.settings.providers == ()
+
+
+@pytest.mark.asyncio
+async def test_providers_message_sender():
+    settings = EmailSettings(
+        use=EmailSenderType.providers,
+        providers=[
+            EmailProviderSettings(name="a", use=EmailSenderType.mock),
+            EmailProviderSettings(name="b", use=EmailSenderType.mock),
+        ],
+    )
+    for _ in range(4):
+        await providers_message_sender("from@test.com", "to@test.com", b"", settings)
+
+    stats = get_sender_stats()["providers"]
+    assert stats["a"]["sent"] + stats["b"]["sent"] == 4
+    await close_senders()
+    assert "providers" not in get_sender_stats()
+
+
+@pytest.mark.asyncio
+async def test_mailgun_clients_by_settings():
+    settings = EmailSettings(
+        use=EmailSenderType.providers,
+        providers=[
+            EmailProviderSettings(
+                name="a",
+                use=EmailSenderType.mailgun,
+                mailgun=MailgunSettings(domain="a.test", api_key="key", http2=False),
+            ),
+            EmailProviderSettings(
+                name="b",
+                use=EmailSenderType.mailgun,
+                mailgun=MailgunSettings(domain="b.test", api_key="key", http2=True),
+            ),
+            EmailProviderSettings(
+                name="c",
+                use=EmailSenderType.mailgun,
+                mailgun=MailgunSettings(domain="c.test", api_key="key", http2=False),
+            ),
+        ],
+    )
+    start_senders(settings)
+    assert len(sender._mailgun_clients) == 2
+    await close_senders()
+    assert not sender._mailgun_clients
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+from oes.webhooks.email.queue import EmailQueue, run_delivery_worker
+from oes.webhooks.email.ratelimit import RateLimited
+from oes.webhooks.settings import EmailQueueSettings, EmailSettings
+
+
+def test_queue_claim_and_complete(tmp_path):
+    queue = EmailQueue(tmp_path / "queue.db")
+    id_ = queue.put("from@test.com", "to@test.com", b"message")
+
+    queued = queue.claim(60)
+    assert queued is not None
+    assert queued.id == id_
+    assert queued.message == b"message"
+
+    # leased messages are not claimed twice
+    assert queue.claim(60) is None
+
+    queue.complete(id_)
+    assert queue.stats().depth == 0
+
+
+def test_queue_retry_and_fail(tmp_path):
+    queue = EmailQueue(tmp_path / "queue.db")
+    id_ = queue.put("from@test.com", "to@test.com", b"message")
+    queue.claim(60)
+
+    queue.retry(id_, 0, "error")
+    stats = queue.stats()
+    assert stats.depth == 1
+    assert stats.retrying == 1
+    assert stats.attempts == 1
+    assert stats.oldest_age is not None
+
+    queued = queue.claim(60)
+    assert queued is not None
+    assert queued.attempts == 1
+
+    queue.fail(id_, "error")
+    stats = queue.stats()
+    assert stats.depth == 0
+    assert stats.failed == 1
+    assert queue.claim(60) is None
+
+
+def test_queue_persists(tmp_path):
+    queue = EmailQueue(tmp_path / "queue.db")
+    queue.put("from@test.com", "to@test.com", b"message")
+    queue.close()
+
+    queue = EmailQueue(tmp_path / "queue.db")
+    queued = queue.claim(60)
+    assert queued is not None
+    assert queued.message == b"message"
+
+
+@pytest.mark.asyncio
+async def test_delivery_worker(tmp_path):
+    queue = EmailQueue(tmp_path / "queue.db")
+    queue_settings = EmailQueueSettings(retry_delay=0, poll_interval=0.01)
+    sent = []
+    failures = [ValueError("fail")]
+
+    async def send(from_, to, message, settings):
+        if failures:
+            raise failures.pop()
+        sent.append(message)
+
+    queue.put("from@test.com", "to@test.com", b"message")
+    wakeup = asyncio.Event()
+    task = asyncio.create_task(
+        run_delivery_worker(queue, send, EmailSettings(), queue_settings, wakeup)
+    )
+    for _ in range(100):
+        if sent:
+            break
+        await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert sent == [b"message"]
+    assert queue.stats().depth == 0
+
+
+@pytest.mark.asyncio
+async def test_delivery_worker_postpones_rate_limited(tmp_path):
+    queue = EmailQueue(tmp_path / "queue.db")
+    queue_settings = EmailQueueSettings(max_attempts=1, poll_interval=0.01)
+    calls = []
+
+    async def send(from_, to, message, settings):
+        calls.append(to)
+        raise RateLimited("domain:test.com", 5)
+
+    id_ = queue.put("from@test.com", "to@test.com", b"message")
+    wakeup = asyncio.Event()
+    task = asyncio.create_task(
+        run_delivery_worker(queue, send, EmailSettings(), queue_settings, wakeup)
+    )
+    for _ in range(100):
+        if calls:
+            break
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert calls == ["to@test.com"]
+    stats = queue.stats()
+    assert stats.depth == 1
+    assert stats.attempts == 0
+    assert stats.failed == 0
+
+    # due again after the wait
+    assert queue.claim(60) is None
+    queue.postpone(id_, 0)
+    assert queue.claim(60) is not None
+
+
+@pytest.mark.asyncio
+async def test_delivery_worker_releases_when_cancelled(tmp_path):
+    queue = EmailQueue(tmp_path / "queue.db")
+    queue_settings = EmailQueueSettings(poll_interval=0.01)
+    sending = asyncio.Event()
+
+    async def send(from_, to, message, settings):
+        sending.set()
+        await asyncio.sleep(60)
+
+    queue.put("from@test.com", "to@test.com", b"message")
+    wakeup = asyncio.Event()
+    task = asyncio.create_task(
+        run_delivery_worker(queue, send, EmailSettings(), queue_settings, wakeup)
+    )
+    await asyncio.wait_for(sending.wait(), 5)
+    assert queue.claim(60) is None
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert queue.claim(60) is not None
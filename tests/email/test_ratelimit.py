@@ -0,0 +1,165 @@
+import attrs
+import pytest
+
+from oes.webhooks.email.providers import Provider, ProviderRouter
+from oes.webhooks.email.ratelimit import (
+    Bucket,
+    RateLimited,
+    TokenBuckets,
+    get_domain,
+    wait_for_tokens,
+)
+from oes.webhooks.email.sender import MAILGUN_BATCH_SIZE, get_mailgun_batch_size
+from oes.webhooks.settings import (
+    EmailRateLimitsSettings,
+    EmailSettings,
+    MailgunSettings,
+    RateLimitSettings,
+)
+
+
+@pytest.fixture
+def buckets(tmp_path):
+    buckets = TokenBuckets(tmp_path / "buckets.db")
+    yield buckets
+    buckets.close()
+
+
+def test_reserve_paces(buckets):
+    bucket = Bucket("a", RateLimitSettings(rate=2, burst=2))
+    waits = [buckets.reserve([bucket], 10, now=100.0) for _ in range(5)]
+    assert waits == [0, 0, 0.5, 1.0, 1.5]
+
+    # refilled at the rate
+    assert buckets.reserve([bucket], 10, now=102.0) == pytest.approx(0.0)
+
+
+@pytest.mark.parametrize(
+    "rate, burst",
+    [
+        (0, 1),
+        (-1, 1),
+        (1, 0.5),
+    ],
+)
+def test_rate_limit_settings_validated(rate, burst):
+    with pytest.raises(ValueError):
+        RateLimitSettings(rate=rate, burst=burst)
+
+
+def test_reserve_takes_tokens_per_recipient(buckets):
+    bucket = Bucket("a", RateLimitSettings(rate=10, burst=5), tokens=8)
+    assert buckets.reserve([bucket], 10, now=0.0) == pytest.approx(0.3)
+
+
+def test_reserve_longest_wait(buckets):
+    slow = Bucket("slow", RateLimitSettings(rate=1))
+    fast = Bucket("fast", RateLimitSettings(rate=10))
+    buckets.reserve([slow, fast], 10, now=0.0)
+    assert buckets.reserve([slow, fast], 10, now=0.0) == pytest.approx(1.0)
+
+
+def test_reserve_shared(tmp_path):
+    a = TokenBuckets(tmp_path / "buckets.db")
+    b = TokenBuckets(tmp_path / "buckets.db")
+    bucket = Bucket("shared", RateLimitSettings(rate=1))
+    try:
+        assert a.reserve([bucket], 10, now=0.0) == 0
+        assert b.reserve([bucket], 10, now=0.0) == pytest.approx(1.0)
+        assert a.reserve([bucket], 10, now=0.0) == pytest.approx(2.0)
+    finally:
+        a.close()
+        b.close()
+
+
+def test_reserve_max_wait(buckets):
+    first = Bucket("first", RateLimitSettings(rate=1))
+    second = Bucket("second", RateLimitSettings(rate=1))
+    buckets.reserve([second], 10, now=0.0)
+    buckets.reserve([second], 10, now=0.0)
+
+    with pytest.raises(RateLimited) as exc_info:
+        buckets.reserve([first, second], 1.5, now=0.0)
+    assert exc_info.value.bucket == "second"
+    assert exc_info.value.retry_after == 2
+
+    # no tokens were taken from the first bucket
+    assert buckets.reserve([first], 1.5, now=0.0) == 0
+
+
+@pytest.mark.asyncio
+async def test_wait_for_tokens(buckets):
+    bucket = Bucket("a", RateLimitSettings(rate=50))
+    await wait_for_tokens(buckets, "mock", [bucket], 1)
+    await wait_for_tokens(buckets, "mock", [bucket], 1)
+    with pytest.raises(RateLimited):
+        await wait_for_tokens(buckets, "mock", [attrs.evolve(bucket, tokens=100)], 1)
+
+
+@pytest.mark.asyncio
+async def test_router_fails_over_when_rate_limited():
+    limited = Provider("limited", EmailSettings())
+    other = Provider("other", EmailSettings(), weight=0.0001)
+    router = ProviderRouter([limited, other])
+    used = []
+
+    async def send(provider):
+        if provider is limited:
+            raise RateLimited("a", 60)
+        used.append(provider.name)
+
+    for _ in range(3):
+        await router.send(send)
+
+    assert used == ["other"] * 3
+    assert limited.errors == 0
+    assert limited.breaker.state == "closed"
+
+
+@pytest.mark.parametrize(
+    "address, expected",
+    [
+        ("to@Example.COM", "example.com"),
+        ("Name <to@example.com>", "example.com"),
+        ("invalid", ""),
+    ],
+)
+def test_get_domain(address, expected):
+    assert get_domain(address) == expected
+
+
+def test_get_mailgun_batch_size():
+    settings = EmailSettings(mailgun=MailgunSettings(domain="test", api_key="key"))
+    assert get_mailgun_batch_size(settings) == MAILGUN_BATCH_SIZE
+
+    settings = EmailSettings(
+        mailgun=MailgunSettings(
+            domain="test",
+            api_key="key",
+            rate_limit=RateLimitSettings(rate=10, burst=20),
+        ),
+        rate_limits=EmailRateLimitsSettings(max_wait=30),
+    )
+    assert get_mailgun_batch_size(settings) == 300
+
+    settings = attrs.evolve(
+        settings,
+        rate_limits=EmailRateLimitsSettings(
+            max_wait=30, domains={"example.com": RateLimitSettings(rate=0.01)}
+        ),
+    )
+    assert get_mailgun_batch_size(settings) == 1
+
+
+def test_mailgun_batches_fit_rate_limit(buckets):
+    limit = RateLimitSettings(rate=10, burst=20)
+    settings = EmailSettings(
+        mailgun=MailgunSettings(domain="test", api_key="key", rate_limit=limit),
+        rate_limits=EmailRateLimitsSettings(max_wait=30),
+    )
+    size = get_mailgun_batch_size(settings)
+
+    # consecutive batches each wait for the previous one's tokens
+    now = 0.0
+    for _ in range(4):
+        now += buckets.reserve([Bucket("mailgun:test", limit, size)], 30, now=now)
@@ -0,0 +1,65 @@
+from pathlib import Path
+
+import jinja2
+import pytest
+import pytest_asyncio
+from cattrs import BaseValidationError
+from prometheus_client import REGISTRY
+
+from oes.webhooks.email.render import RenderPool
+from oes.webhooks.settings import EmailSettings
+
+
+@pytest_asyncio.fixture
+async def render_pool():
+    settings = EmailSettings(
+        template_path=Path("tests/email/templates").resolve(),
+        email_from="from@test.com",
+    )
+    pool = RenderPool(settings, 2)
+    await pool.start()
+    yield pool
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_render_pool(render_pool):
+    rendered = await render_pool.render(
+        "template", {"to": "to@test.com", "subject": "Test", "text": "Test text."}
+    )
+
+    assert rendered.to == "to@test.com"
+    assert rendered.from_ == "from@test.com"
+    assert b"Subject: Test\n" in rendered.message
+    assert b"Test text." in rendered.message
+
+
+@pytest.mark.asyncio
+async def test_render_pool_errors(render_pool):
+    with pytest.raises(jinja2.exceptions.TemplateNotFound):
+        await render_pool.render("missing", {"to": "to@test.com"})
+
+    with pytest.raises(BaseValidationError):
+        await render_pool.render("template", {"text": "No recipient."})
+
+
+@pytest.mark.asyncio
+async def test_render_pool_records_stages(render_pool):
+    def count(stage):
+        return REGISTRY.get_sample_value(
+            "webhooks_stage_seconds_count", {"stage": stage}
+        )
+
+    before = {stage: count(stage) or 0 for stage in ("render", "serialize")}
+    rendered = await render_pool.render(
+        "template", {"to": "to@test.com", "subject": "Test", "text": "Test text."}
+    )
+
+    assert [stage for stage, _ in rendered.stages] == [
+        "structure",
+        "render",
+        "serialize",
+    ]
+    assert {stage: count(stage) for stage in before} == {
+        stage: n + 1 for stage, n in before.items()
+    }
@@ -0,0 +1,205 @@
+import asyncio
+import threading
+
+import pytest
+import pytest_asyncio
+from aiosmtplib import SMTPServerDisconnected
+
+from oes.webhooks.email import sender
+from oes.webhooks.email.smtp import DataEncoder, SMTPPool, _wait_for_write_buffer
+from oes.webhooks.email.types import Email
+from oes.webhooks.settings import SMTPSettings
+
+
+class FakeSMTPServer:
+    def __init__(self):
+        self.connections = 0
+        self.messages = []
+        self.commands = []
+        self.writers = []
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.writers.append(writer)
+        writer.write(b"220 localhost ready\r\n")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            cmd = line.decode().strip()
+            self.commands.append(cmd.split(" ")[0].upper())
+            if cmd.upper().startswith("EHLO"):
+                writer.write(b"250 localhost\r\n")
+            elif cmd.upper() == "DATA":
+                writer.write(b"354 go ahead\r\n")
+                data = []
+                while True:
+                    chunk = await reader.readline()
+                    if chunk == b".\r\n":
+                        break
+                    data.append(chunk)
+                self.messages.append(b"".join(data))
+                writer.write(b"250 ok\r\n")
+            elif cmd.upper() == "QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+        writer.close()
+
+
+@pytest_asyncio.fixture
+async def server():
+    fake = FakeSMTPServer()
+    srv = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+    fake.port = srv.sockets[0].getsockname()[1]
+    yield fake
+    srv.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_sessions(server):
+    settings = SMTPSettings(server="127.0.0.1", port=server.port, tls=None)
+    pool = SMTPPool(settings)
+
+    await pool.send("from@test.com", ["to@test.com"], b"Subject: 1\r\n\r\none\r\n")
+    await pool.send("from@test.com", ["to@test.com"], b"Subject: 2\r\n\r\ntwo\r\n")
+    await pool.close()
+
+    assert server.connections == 1
+    assert len(server.messages) == 2
+    assert server.commands[-1] == "QUIT"
+
+
+@pytest.mark.asyncio
+async def test_pool_concurrency(server):
+    settings = SMTPSettings(server="127.0.0.1", port=server.port, tls=None, pool_size=3)
+    pool = SMTPPool(settings)
+
+    await asyncio.gather(
+        *(
+            pool.send("from@test.com", ["to@test.com"], b"Subject: x\r\n\r\nx\r\n")
+            for _ in range(6)
+        )
+    )
+    await pool.close()
+
+    assert server.connections == 3
+    assert len(server.messages) == 6
+
+
+@pytest.mark.asyncio
+async def test_pool_probes_and_reconnects(server):
+    settings = SMTPSettings(
+        server="127.0.0.1", port=server.port, tls=None, noop_interval=0
+    )
+    pool = SMTPPool(settings)
+
+    await pool.send("from@test.com", ["to@test.com"], b"Subject: 1\r\n\r\none\r\n")
+    server.writers[0].close()
+    await asyncio.sleep(0.05)
+    await pool.send("from@test.com", ["to@test.com"], b"Subject: 2\r\n\r\ntwo\r\n")
+    await pool.close()
+
+    assert server.connections == 2
+    assert len(server.messages) == 2
+
+
+@pytest.mark.asyncio
+async def test_pool_send_stream(server):
+    settings = SMTPSettings(server="127.0.0.1", port=server.port, tls=None)
+    pool = SMTPPool(settings)
+
+    async def message():
+        for chunk in (b"Subject: x\n\n", b"line\n", b".dot\nlast"):
+            yield chunk
+
+    await pool.send_stream("from@test.com", ["to@test.com"], message)
+    await pool.send("from@test.com", ["to@test.com"], b"Subject: 2\r\n\r\ntwo\r\n")
+    await pool.close()
+
+    assert server.connections == 1
+    assert server.messages[0] == b"Subject: x\r\n\r\nline\r\n..dot\r\nlast\r\n"
+    assert len(server.messages) == 2
+
+
+def test_data_encoder_chunk_boundaries():
+    encoder = DataEncoder()
+    chunks = [b".a\r", b"\n.b\n", b".c.\r", b"d\n", b"."]
+    data = b"".join(encoder.encode(c) for c in chunks) + encoder.finish()
+    assert data == b"..a\r\n..b\r\n..c.\r\nd\r\n..\r\n.\r\n"
+
+
+@pytest.mark.asyncio
+async def test_pool_send_stream_large(server):
+    settings = SMTPSettings(server="127.0.0.1", port=server.port, tls=None)
+    pool = SMTPPool(settings)
+    line = b"x" * 76 + b"\r\n"
+
+    async def message():
+        yield b"Subject: x\r\n\r\n"
+        for _ in range(50):
+            yield line * 1000
+
+    await pool.send_stream("from@test.com", ["to@test.com"], message)
+    await pool.close()
+
+    assert len(server.messages[0]) == 14 + len(line) * 1000 * 50
+
+
+class FakeTransport(asyncio.WriteTransport):
+    def __init__(self, sizes):
+        super().__init__()
+        self.sizes = list(sizes)
+
+    def get_write_buffer_size(self):
+        return self.sizes.pop(0) if len(self.sizes) > 1 else self.sizes[0]
+
+    def is_closing(self):
+        return False
+
+
+@pytest.mark.asyncio
+async def test_wait_for_write_buffer():
+    transport = FakeTransport([300, 200, 100])
+    await _wait_for_write_buffer(transport, 100)
+    assert transport.sizes == [100]
+
+    with pytest.raises(SMTPServerDisconnected):
+        await _wait_for_write_buffer(None, 100)
+
+
+@pytest.mark.asyncio
+async def test_stream_email_cancelled(monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    closed = threading.Event()
+
+    def chunks(email, date):
+        try:
+            yield b"first"
+            started.set()
+            release.wait(5)
+            yield b"second"
+        finally:
+            closed.set()
+
+    monkeypatch.setattr(sender, "iter_message_chunks", chunks)
+    email = Email(to="to@test.com", from_="from@test.com", text="Test")
+
+    async def consume():
+        async for _ in sender.stream_email(email):
+            pass
+
+    task = asyncio.create_task(consume())
+    await asyncio.to_thread(started.wait, 5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # closed once the pending chunk is done
+    assert not closed.is_set()
+    release.set()
+    assert await asyncio.to_thread(closed.wait, 5)
@@ -1,9 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import jinja2
+import pytest
+
+from oes.webhooks.email.cache import AttachmentCache
 from oes.webhooks.email.template import (
     Attachments,
+    RecipientVariables,
     Subject,
     get_environment,
+    get_template_variables,
+    render_message,
     render_template,
 )
 from oes.webhooks.email.types import Attachment, AttachmentType
@@ -36,12 +44,40 @@ def test_template_attachments():
     assert attached_objs[0] == Attachment(
         id="attachment1",
         name="attachment.txt",
-        data=b'Attachment: {{ attach("attachment.txt") }}\n',
+        data=Path("tests/email/templates/attachment.txt").resolve(),
         media_type="text/plain",
         attachment_type=AttachmentType.attachment,
     )
 
 
+def test_template_attachments_streamed():
+    subject = Subject(None)
+    cache = AttachmentCache(stream_size=16)
+    attachments = Attachments(Path("tests/email/templates"), cache)
+
+    env = get_environment(Path("tests/email/templates"))
+
+    render_template(env, subject, attachments, "attachment.txt", {})
+
+    attached_obj = next(iter(attachments))
+    assert attached_obj.data == Path("tests/email/templates/attachment.txt").resolve()
+    assert attached_obj.encoded is None
+
+
+def test_template_attachments_outlive_cache():
+    subject = Subject(None)
+    cache = AttachmentCache()
+    attachments = Attachments(Path("tests/email/templates"), cache)
+
+    env = get_environment(Path("tests/email/templates"))
+
+    render_template(env, subject, attachments, "attachment.txt", {})
+    cache.clear()
+
+    part = next(iter(attachments)).make_attachment()
+    assert part.get_content() == 'Attachment: {{ attach("attachment.txt") }}\n'
+
+
 def test_template_attachments_inline():
     subject = Subject(None)
     attachments = Attachments(Path("tests/email/templates"))
@@ -56,7 +92,7 @@ def test_template_attachments_inline():
     assert attached_objs[0] == Attachment(
         id="attachment1",
         name="inline.txt",
-        data=b'Attachment: {{ inline("inline.txt") }}\n',
+        data=Path("tests/email/templates/inline.txt").resolve(),
         media_type="text/plain",
         attachment_type=AttachmentType.inline,
     )
@@ -88,3 +124,118 @@ def test_template_subject_default():
 
     assert str(subject) == "Original"
     assert res == "Subject is Original"
+
+
+def test_get_template_variables():
+    env = get_environment(Path("tests/email/templates"))
+    res = get_template_variables(env, "recipient.txt")
+    assert res == frozenset({"recipient", "subject", "text"})
+
+
+def test_get_template_variables_placeholders():
+    env = get_environment(Path("tests/email/templates"))
+    res = get_template_variables(env, "recipient.txt", ("recipient", "to"))
+    assert res == frozenset({"recipient", "subject", "text"})
+
+
+@pytest.mark.parametrize(
+    "source, expected",
+    [
+        ("{{ recipient.name }} {{ recipient['id'] }} {{ to }}", True),
+        ("{% if recipient.vip %}VIP{% endif %}", False),
+        ("{{ recipient.name|upper }}", False),
+        ("{{ recipient.name|default('friend') }}", False),
+        ("{% for item in recipient.items %}{{ item }}{% endfor %}", False),
+        ("{{ recipient[key] }}", False),
+        ("{{ to|lower }}", False),
+        ("{{ recipient.name ~ '!' }}", False),
+    ],
+)
+def test_get_template_variables_placeholder_uses(source, expected):
+    env = jinja2.Environment(loader=jinja2.DictLoader({"test.txt": source}))
+    res = get_template_variables(env, "test.txt", ("recipient", "to"))
+    assert (res is not None) == expected
+
+
+def test_template_recipient_variables():
+    subject = Subject(None)
+    attachments = Attachments(Path("tests/email/templates"))
+
+    env = get_environment(Path("tests/email/templates"))
+    res = render_template(
+        env,
+        subject,
+        attachments,
+        "recipient.txt",
+        {"recipient": RecipientVariables(), "text": "Test text."},
+    )
+
+    assert res == "Hello %recipient.name%\n\n\nTest text."
+
+
+def test_template_concurrent_renders():
+    env = get_environment(Path("tests/email/templates"))
+
+    def render(i):
+        subject = Subject(None)
+        attachments = Attachments(Path("tests/email/templates"))
+        res = render_template(env, subject, attachments, "subject_default.txt", {})
+        subject.set_subject(f"Subject {i}")
+        res = render_template(env, subject, attachments, "template.txt", {"text": i})
+        return res
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(render, range(200)))
+
+    assert results == [f"Subject {i}\n\n{i}" for i in range(200)]
+    assert "set_subject" not in env.get_template("template.txt").globals
+
+
+def test_render_message_precompiled():
+    env = get_environment(Path("tests/email/templates"), precompile_html=True)
+    subject = Subject("Subject")
+    attachments = Attachments(Path("tests/email/templates"))
+
+    text, html = render_message(env, subject, attachments, "child", {"text": "Test"})
+
+    assert env.loader.is_precompiled("child.html")
+    assert text == "Test"
+    assert html == (
+        "<!doctype html><title>Subject</title><body>"
+        '<p style="color: red;">Default<p style="color: red;">Test'
+    )
+
+
+def test_render_message_precompiled_ignores_comments_and_raw(tmp_path: Path):
+    (tmp_path / "base.html").write_text(
+        "<style>p { color: red; }</style><p>{% block content %}{% endblock %}</p>"
+    )
+    (tmp_path / "child.html").write_text(
+        '{% extends "base.html" %}\n'
+        "{# {% block content %}Comment{% endblock %} #}\n"
+        "{% block content -%}\n"
+        "  {% raw %}{% endblock %}{{ super() }}{% endraw %}\n"
+        "{%- endblock %}\n"
+    )
+    (tmp_path / "child.txt").write_text("Text")
+    env = get_environment(tmp_path, precompile_html=True)
+    subject = Subject("Subject")
+    attachments = Attachments(tmp_path)
+
+    _, html = render_message(env, subject, attachments, "child", {})
+
+    assert env.loader.is_precompiled("child.html")
+    assert html == '<body><p style="color: red;">{% endblock %}{{ super() }}'
+
+
+def test_render_message_not_precompiled():
+    env = get_environment(Path("tests/email/templates"), precompile_html=False)
+    subject = Subject("Subject")
+    attachments = Attachments(Path("tests/email/templates"))
+
+    _, html = render_message(env, subject, attachments, "child", {"text": "Test"})
+
+    assert html == (
+        "<!doctype html><title>Subject</title><body>"
+        '<p style="color: red;">Default<p style="color: red;">Test'
+    )
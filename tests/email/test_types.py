@@ -7,6 +7,7 @@ from oes.webhooks.email.types import (
     Email,
     _make_html_part,
     _make_text_part,
+    encode_base64,
 )
 
 
@@ -164,3 +165,22 @@ def test_make_message():
         b"\n"
         b"--" + sep1 + b"--\n"
     )
+
+
+def test_make_attachment_encoded():
+    data = bytes(range(256)) * 4
+    att = Attachment(
+        id="att1",
+        name="test.bin",
+        data=data,
+        media_type="application/octet-stream",
+    )
+    encoded_att = Attachment(
+        id="att1",
+        name="test.bin",
+        data=data,
+        encoded=encode_base64(data),
+        media_type="application/octet-stream",
+    )
+
+    assert bytes(encoded_att.make_attachment()) == bytes(att.make_attachment())
@@ -0,0 +1,85 @@
+import time
+from pathlib import Path
+
+from oes.webhooks.email.cache import AttachmentCache
+from oes.webhooks.email.template import get_environment
+from oes.webhooks.email.types import encode_base64
+from oes.webhooks.email.watch import TemplateInvalidator, TemplateWatcher
+
+
+def _write_templates(path: Path):
+    (path / "base.txt").write_text("base {% block content %}{% endblock %}")
+    (path / "child.txt").write_text(
+        '{% extends "base.txt" %}{% block content %}child{% endblock %}'
+    )
+    (path / "other.txt").write_text("other")
+
+
+def test_invalidate_dependents(tmp_path: Path):
+    _write_templates(tmp_path)
+    env = get_environment(tmp_path, auto_reload=False)
+    invalidator = TemplateInvalidator(env, tmp_path, AttachmentCache())
+    for name in ("child.txt", "other.txt"):
+        env.get_template(name).render()
+
+    (tmp_path / "base.txt").write_text("new {% block content %}{% endblock %}")
+    assert env.get_template("child.txt").render() == "base child"
+
+    evicted = invalidator.invalidate([tmp_path / "base.txt"])
+    assert evicted == {"base.txt", "child.txt"}
+    assert env.get_template("child.txt").render() == "new child"
+
+
+def test_invalidate_reparses_changed(tmp_path: Path, monkeypatch):
+    _write_templates(tmp_path)
+    env = get_environment(tmp_path, auto_reload=False)
+    invalidator = TemplateInvalidator(env, tmp_path, AttachmentCache())
+    assert invalidator.invalidate([tmp_path / "base.txt"]) == {"base.txt", "child.txt"}
+
+    parsed = []
+    parse = env.parse
+    monkeypatch.setattr(
+        env, "parse", lambda source: parsed.append(source) or parse(source)
+    )
+
+    (tmp_path / "other.txt").write_text('{% include "base.txt" %}')
+    assert invalidator.invalidate([tmp_path / "other.txt"]) == {"other.txt"}
+    assert parsed == ['{% include "base.txt" %}']
+
+    evicted = invalidator.invalidate([tmp_path / "base.txt"])
+    assert evicted == {"base.txt", "child.txt", "other.txt"}
+
+
+def test_invalidate_attachment(tmp_path: Path):
+    path = tmp_path / "attachment.txt"
+    path.write_bytes(b"old")
+    env = get_environment(tmp_path, auto_reload=False)
+    cache = AttachmentCache(check_mtime=False)
+    invalidator = TemplateInvalidator(env, tmp_path, cache)
+    assert cache.get(path).encoded == encode_base64(b"old")
+
+    path.write_bytes(b"new")
+    assert cache.get(path).encoded == encode_base64(b"old")
+
+    invalidator.invalidate([path])
+    assert cache.get(path).encoded == encode_base64(b"new")
+
+
+def test_watcher(tmp_path: Path):
+    _write_templates(tmp_path)
+    env = get_environment(tmp_path, auto_reload=False)
+    watcher = TemplateWatcher(TemplateInvalidator(env, tmp_path, AttachmentCache()))
+    assert env.get_template("child.txt").render() == "base child"
+
+    watcher.start()
+    try:
+        time.sleep(0.2)
+        (tmp_path / "child.txt").write_text(
+            '{% extends "base.txt" %}{% block content %}changed{% endblock %}'
+        )
+        deadline = time.monotonic() + 10
+        while env.get_template("child.txt").render() != "base changed":
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
@@ -0,0 +1,118 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+pytest.importorskip("google.auth")
+
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+
+from oes.webhooks.sheets.async_client import AsyncGoogleSheetsClient  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def account_info():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return {
+        "type": "service_account",
+        "client_email": "test@test.iam.gserviceaccount.com",
+        "private_key": pem.decode(),
+        "private_key_id": "key1",
+        "token_uri": "https://oauth2.test/token",
+    }
+
+
+class FakeGoogle:
+    def __init__(self, expires_in=3600):
+        self.expires_in = expires_in
+        self.tokens_issued = 0
+        self.revoked = set()
+        self.appends = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.url.host == "oauth2.test":
+            form = parse_qs(request.content.decode())
+            assert form["grant_type"] == ["urn:ietf:params:oauth:grant-type:jwt-bearer"]
+            assert form["assertion"][0].count(".") == 2
+            self.tokens_issued += 1
+            return httpx.Response(
+                200,
+                json={
+                    "access_token": f"token-{self.tokens_issued}",
+                    "expires_in": self.expires_in,
+                },
+            )
+
+        token = request.headers["Authorization"].removeprefix("Bearer ")
+        if token in self.revoked:
+            return httpx.Response(401)
+
+        assert request.url.params["valueInputOption"] == "USER_ENTERED"
+        self.appends.append(
+            (request.url.path, token, json.loads(request.content)["values"])
+        )
+        return httpx.Response(200, json={})
+
+
+@pytest.mark.asyncio
+async def test_append_caches_token(account_info):
+    google = FakeGoogle()
+    client = AsyncGoogleSheetsClient(
+        account_info, transport=httpx.MockTransport(google)
+    )
+
+    await asyncio.gather(
+        client.append_rows("sheet1", "1:2", [["a"]]),
+        client.append_rows("sheet2", "Sheet 1!1:2", [["b"], ["c"]]),
+    )
+    await client.append_rows("sheet1", "1:2", [["d"]])
+    await client.close()
+
+    assert google.tokens_issued == 1
+    assert sorted(google.appends) == [
+        ("/v4/spreadsheets/sheet1/values/1:2:append", "token-1", [["a"]]),
+        ("/v4/spreadsheets/sheet1/values/1:2:append", "token-1", [["d"]]),
+        (
+            "/v4/spreadsheets/sheet2/values/Sheet 1!1:2:append",
+            "token-1",
+            [["b"], ["c"]],
+        ),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_append_refreshes_before_expiry(account_info):
+    google = FakeGoogle(expires_in=200)
+    client = AsyncGoogleSheetsClient(
+        account_info, refresh_margin=300, transport=httpx.MockTransport(google)
+    )
+
+    await client.append_rows("sheet1", "1:2", [["a"]])
+    await client.append_rows("sheet1", "1:2", [["b"]])
+    await client.close()
+
+    assert google.tokens_issued == 2
+
+
+@pytest.mark.asyncio
+async def test_append_refreshes_rejected_token(account_info):
+    google = FakeGoogle()
+    client = AsyncGoogleSheetsClient(
+        account_info, transport=httpx.MockTransport(google)
+    )
+
+    await client.append_rows("sheet1", "1:2", [["a"]])
+    google.revoked.add("token-1")
+    await client.append_rows("sheet1", "1:2", [["b"]])
+    await client.close()
+
+    assert google.tokens_issued == 2
+    assert google.appends[-1][1:] == ("token-2", [["b"]])
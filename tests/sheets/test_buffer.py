@@ -0,0 +1,129 @@
+import asyncio
+
+import httpx
+import pytest
+
+from oes.webhooks.settings import SheetsBufferSettings
+from oes.webhooks.sheets.buffer import SheetsRowBuffer, is_retryable
+
+
+class FakeAppender:
+    def __init__(self, fail: bool = False, errors=()):
+        self.calls = []
+        self.attempts = 0
+        self.fail = fail
+        self.errors = list(errors)
+
+    async def __call__(self, sheet_id, range, values):
+        await asyncio.sleep(0)
+        self.attempts += 1
+        if self.fail:
+            raise RuntimeError("append failed")
+        if self.errors:
+            raise self.errors.pop(0)
+        self.calls.append((sheet_id, range, list(values)))
+
+
+def _status_error(status):
+    request = httpx.Request("POST", "http://sheets.test")
+    return httpx.HTTPStatusError(
+        "error", request=request, response=httpx.Response(status, request=request)
+    )
+
+
+@pytest.mark.asyncio
+async def test_buffer_coalesces_rows():
+    append = FakeAppender()
+    buffer = SheetsRowBuffer(append, SheetsBufferSettings(flush_interval=0.01))
+
+    await buffer.add("sheet1", "1:2", ["a"])
+    await buffer.add("sheet1", "1:2", ["b"])
+    await buffer.add("sheet2", "1:2", ["c"])
+    assert append.calls == []
+
+    await asyncio.sleep(0.05)
+    assert sorted(append.calls) == [
+        ("sheet1", "1:2", [["a"], ["b"]]),
+        ("sheet2", "1:2", [["c"]]),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_buffer_flushes_at_row_limit():
+    append = FakeAppender()
+    buffer = SheetsRowBuffer(
+        append, SheetsBufferSettings(flush_interval=60, flush_rows=2)
+    )
+
+    await buffer.add("sheet1", "1:2", ["a"])
+    await buffer.add("sheet1", "1:2", ["b"], wait=True)
+    await buffer.add("sheet1", "1:2", ["c"])
+
+    assert append.calls == [("sheet1", "1:2", [["a"], ["b"]])]
+
+    await buffer.close()
+    assert append.calls[-1] == ("sheet1", "1:2", [["c"]])
+
+
+@pytest.mark.asyncio
+async def test_buffer_wait_raises_errors():
+    append = FakeAppender(fail=True)
+    buffer = SheetsRowBuffer(append, SheetsBufferSettings(flush_interval=0.01))
+
+    await buffer.add("sheet1", "1:2", ["a"])
+    with pytest.raises(RuntimeError):
+        await buffer.add("sheet1", "1:2", ["b"], wait=True)
+
+
+@pytest.mark.asyncio
+async def test_buffer_retries_failed_flush():
+    append = FakeAppender(errors=[_status_error(429), httpx.ConnectError("error")])
+    buffer = SheetsRowBuffer(
+        append, SheetsBufferSettings(flush_interval=0.01, retry_delay=0.01)
+    )
+
+    await buffer.add("sheet1", "1:2", ["a"])
+    await buffer.add("sheet1", "1:2", ["b"])
+    await buffer.close()
+
+    assert append.attempts == 3
+    assert append.calls == [("sheet1", "1:2", [["a"], ["b"]])]
+
+
+@pytest.mark.asyncio
+async def test_buffer_drops_rows_after_max_attempts():
+    append = FakeAppender(errors=[_status_error(503)] * 3)
+    buffer = SheetsRowBuffer(
+        append,
+        SheetsBufferSettings(flush_interval=0.01, retry_delay=0.01, max_attempts=3),
+    )
+
+    await buffer.add("sheet1", "1:2", ["a"])
+    await buffer.close()
+
+    assert append.attempts == 3
+    assert append.calls == []
+
+
+@pytest.mark.asyncio
+async def test_buffer_does_not_retry_waiting_rows():
+    append = FakeAppender(errors=[_status_error(503)])
+    buffer = SheetsRowBuffer(
+        append, SheetsBufferSettings(flush_interval=0.01, retry_delay=0.01)
+    )
+
+    await buffer.add("sheet1", "1:2", ["a"])
+    with pytest.raises(httpx.HTTPStatusError):
+        await buffer.add("sheet1", "1:2", ["b"], wait=True)
+    await buffer.close()
+
+    assert append.calls == [("sheet1", "1:2", [["a"]])]
+
+
+def test_is_retryable():
+    assert is_retryable(_status_error(429))
+    assert is_retryable(_status_error(500))
+    assert is_retryable(httpx.ReadTimeout("timeout"))
+    assert is_retryable(ConnectionResetError())
+    assert not is_retryable(_status_error(400))
+    assert not is_retryable(RuntimeError())
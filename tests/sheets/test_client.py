@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+pytest.importorskip("googleapiclient")
+
+from google.auth.credentials import AnonymousCredentials  # noqa: E402
+from googleapiclient.discovery import build_from_document  # noqa: E402
+
+from oes.webhooks.sheets.client import DISCOVERY_DOCUMENT_PATH  # noqa: E402
+
+
+def test_discovery_document_append():
+    service = build_from_document(
+        json.loads(DISCOVERY_DOCUMENT_PATH.read_text()),
+        credentials=AnonymousCredentials(),
+    )
+    request = (
+        service.spreadsheets()
+        .values()
+        .append(
+            spreadsheetId="sheet",
+            range="Sheet1!A1",
+            valueInputOption="USER_ENTERED",
+            body={"values": [["a", 1]]},
+        )
+    )
+    assert request.method == "POST"
+    assert request.uri.startswith(
+        "https://sheets.googleapis.com/v4/spreadsheets/sheet/values/Sheet1%21A1:append?"
+    )
+    assert json.loads(request.body) == {"values": [["a", 1]]}
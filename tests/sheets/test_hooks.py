@@ -0,0 +1,53 @@
+import pytest
+from jinja2 import TemplateSyntaxError
+
+from oes.webhooks.settings import GoogleSheetsHook
+from oes.webhooks.sheets.hooks import SheetsHookRegistry, compile_row
+
+
+def test_compile_row():
+    render = compile_row(
+        (
+            "id",
+            'name | default("No Name")',
+            "'TRUE' if responded_yes else 'FALSE'",
+            "missing.attr",
+            "none_value",
+            "count + 1",
+        )
+    )
+
+    row = render({"id": 1, "responded_yes": True, "none_value": None, "count": 2})
+    assert row == ["1", "No Name", "TRUE", "", "", "3"]
+
+
+def test_compile_row_invalid():
+    with pytest.raises(TemplateSyntaxError):
+        compile_row(("id", "a b"))
+
+
+def test_compile_row_sandboxed():
+    render = compile_row(("obj.__class__",))
+    assert render({"obj": object()}) == [""]
+
+
+def test_registry():
+    hooks = SheetsHookRegistry(
+        [
+            GoogleSheetsHook(id="a", sheet_id="sheet-a", values=("x",)),
+            GoogleSheetsHook(id="b", sheet_id="sheet-b", values=("y", "x")),
+        ]
+    )
+
+    hook = hooks.get("b")
+    assert hook is not None
+    assert hook.sheet_id == "sheet-b"
+    assert hooks.get("c") is None
+
+    assert hooks.render("b", {"x": 1, "y": 2}) == ["2", "1"]
+    assert hooks.render("b", {"x": 3}) == ["", "3"]
+
+    stats = hooks.stats()
+    assert stats["a"].renders == 0
+    assert stats["b"].renders == 2
+    assert stats["b"].total_time >= stats["b"].max_time > 0
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+from oes.webhooks.admission import AdmissionLimiter
+from oes.webhooks.settings import LimitSettings
+
+
+@pytest.mark.asyncio
+async def test_admission_queue_full():
+    limiter = AdmissionLimiter("test", LimitSettings(concurrency=1, queue=1))
+    release = asyncio.Event()
+
+    async def handle():
+        async with limiter.admit():
+            await release.wait()
+
+    first = asyncio.create_task(handle())
+    second = asyncio.create_task(handle())
+    await asyncio.sleep(0.01)
+    assert limiter.stats()["in_flight"] == 1
+    assert limiter.stats()["queued"] == 1
+
+    with pytest.raises(TooManyRequests) as exc_info:
+        await handle()
+    assert exc_info.value.retry_after == 1
+
+    release.set()
+    await asyncio.gather(first, second)
+    stats = limiter.stats()
+    assert stats["in_flight"] == 0
+    assert stats["queued"] == 0
+    assert stats["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_admission_queue_timeout():
+    limiter = AdmissionLimiter(
+        "test", LimitSettings(concurrency=1, queue=1, queue_timeout=0.01), 5
+    )
+    release = asyncio.Event()
+
+    async def handle():
+        async with limiter.admit():
+            await release.wait()
+
+    first = asyncio.create_task(handle())
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(ServiceUnavailable) as exc_info:
+        await handle()
+    assert exc_info.value.retry_after == 5
+    assert limiter.stats()["queued"] == 0
+
+    release.set()
+    await first
@@ -0,0 +1,56 @@
+from oes.webhooks.idempotency import IdempotencyStore, StoredResponse
+
+
+def test_idempotency_begin_and_complete(tmp_path):
+    store = IdempotencyStore(tmp_path / "keys.db")
+    assert store.begin("key", 60) is None
+
+    # held keys are not taken twice
+    assert store.begin("key", 60) == StoredResponse(complete=False)
+
+    store.complete("key", 200, "application/json", b"{}", 60)
+    assert store.begin("key", 60) == StoredResponse(
+        complete=True, status=200, content_type="application/json", body=b"{}"
+    )
+
+
+def test_idempotency_release(tmp_path):
+    store = IdempotencyStore(tmp_path / "keys.db")
+    assert store.begin("key", 60) is None
+    store.release("key")
+    assert store.begin("key", 60) is None
+
+    # completed keys are not released
+    store.complete("key", 204, None, b"", 60)
+    store.release("key")
+    assert store.begin("key", 60) == StoredResponse(complete=True, status=204)
+
+
+def test_idempotency_expiry(tmp_path):
+    store = IdempotencyStore(tmp_path / "keys.db")
+    assert store.begin("held", 0) is None
+    assert store.begin("held", 60) is None
+
+    store.complete("held", 204, None, b"", 0)
+    assert store.purge() == 1
+    assert store.begin("held", 60) is None
+
+
+def test_idempotency_shared(tmp_path):
+    store1 = IdempotencyStore(tmp_path / "keys.db")
+    store2 = IdempotencyStore(tmp_path / "keys.db")
+    assert store1.begin("key", 60) is None
+    assert store2.begin("key", 60) == StoredResponse(complete=False)
+
+
+def test_idempotency_request_hash(tmp_path):
+    store = IdempotencyStore(tmp_path / "keys.db")
+    assert store.begin("key", 60, "a") is None
+    assert store.begin("key", 60, "b") == StoredResponse(
+        complete=False, request_hash="a"
+    )
+
+    store.complete("key", 204, None, b"", 60)
+    assert store.begin("key", 60, "b") == StoredResponse(
+        complete=True, status=204, request_hash="a"
+    )
@@ -0,0 +1,77 @@
+import io
+
+import orjson
+import pytest
+from loguru import logger
+
+from oes.webhooks import log
+from oes.webhooks.log import LogFilter, QueuedSink
+
+
+@pytest.fixture
+def capture():
+    def add(sink, **kwargs):
+        handler_id = logger.add(sink, format="{message}", **kwargs)
+        handlers.append(handler_id)
+
+    handlers: list[int] = []
+    yield add
+    for handler_id in handlers:
+        logger.remove(handler_id)
+
+
+def test_queued_sink():
+    stream = io.StringIO()
+    handler_id = logger.add(QueuedSink(stream, json=True), format="{message}")
+    logger.bind(request="abc").info("Sent message to {}", "test@example.com")
+    logger.remove(handler_id)
+
+    record = orjson.loads(stream.getvalue())
+    assert record["message"] == "Sent message to test@example.com"
+    assert record["level"] == "INFO"
+    assert record["name"] == __name__
+    assert record["extra"] == {"request": "abc"}
+
+
+def test_queued_sink_exception():
+    stream = io.StringIO()
+    handler_id = logger.add(QueuedSink(stream), format="{message}")
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        logger.exception("Failed")
+    logger.remove(handler_id)
+
+    text = stream.getvalue()
+    assert "| ERROR    | " in text
+    assert "- Failed\n" in text
+    assert "ValueError: bad" in text
+
+
+def test_log_filter_sample(capture):
+    messages: list[str] = []
+    capture(messages.append, filter=LogFilter({__name__: 0}, {}))
+    logger.info("dropped")
+    logger.warning("kept")
+    assert [m.strip() for m in messages] == ["kept"]
+
+
+def test_log_filter_rate_limit(capture):
+    messages: list[str] = []
+    capture(messages.append, filter=LogFilter({}, {"tests": 3}))
+    for i in range(10):
+        logger.error("error {}", i)
+    assert len(messages) == 3
+
+
+def test_log_filter_rate_below_one(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(log.time, "monotonic", lambda: clock[0])
+    log_filter = LogFilter({}, {"x": 0.5})
+
+    assert log_filter._take("x")
+    assert not log_filter._take("x")
+    clock[0] = 1.0
+    assert not log_filter._take("x")
+    clock[0] = 2.0
+    assert log_filter._take("x")
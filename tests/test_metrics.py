@@ -0,0 +1,57 @@
+import pytest
+from prometheus_client import REGISTRY
+
+from oes.webhooks import metrics
+from oes.webhooks.email.sender import mock_message_sender
+from oes.webhooks.settings import EmailSettings, SheetsBufferSettings
+from oes.webhooks.sheets.buffer import SheetsRowBuffer
+
+
+def _value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_timed():
+    before = _value("webhooks_stage_seconds_count", stage="test")
+    with metrics.timed("test"):
+        pass
+    assert _value("webhooks_stage_seconds_count", stage="test") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_to_thread_in_flight():
+    def work():
+        return _value("webhooks_threads_in_flight", task="test")
+
+    in_flight = await metrics.to_thread("test", work)
+    assert in_flight == 1
+    assert _value("webhooks_threads_in_flight", task="test") == 0
+
+
+@pytest.mark.asyncio
+async def test_send_counted():
+    before = _value("webhooks_sends_total", provider="mock", result="success")
+    await mock_message_sender("a@example.net", "b@example.net", b"", EmailSettings())
+    after = _value("webhooks_sends_total", provider="mock", result="success")
+    assert after == before + 1
+
+
+@pytest.mark.asyncio
+async def test_sheets_rows_counted():
+    async def append(sheet_id, range, rows):
+        if sheet_id == "bad":
+            raise ValueError
+
+    buffer = SheetsRowBuffer(append, SheetsBufferSettings(flush_rows=1))
+    before_ok = _value("webhooks_sheets_rows_total", hook="ok", result="appended")
+    before_bad = _value("webhooks_sheets_rows_total", hook="bad", result="error")
+
+    await buffer.add("good", "A1", [1], wait=True, label="ok")
+    with pytest.raises(ValueError):
+        await buffer.add("bad", "A1", [1], wait=True, label="bad")
+    await buffer.close()
+
+    after_ok = _value("webhooks_sheets_rows_total", hook="ok", result="appended")
+    after_bad = _value("webhooks_sheets_rows_total", hook="bad", result="error")
+    assert after_ok == before_ok + 1
+    assert after_bad == before_bad + 1
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from oes.webhooks.ndjson import InvalidRecord, iter_records, process_records
+
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+async def _collect(records):
+    return [r async for r in records]
+
+
+@pytest.mark.asyncio
+async def test_iter_records_across_chunks():
+    records = await _collect(
+        iter_records(_chunks(b'{"a": 1}\n{"b"', b": 2}\n\n[1, ", b"2]\n", b'"end"'))
+    )
+    assert records == [{"a": 1}, {"b": 2}, [1, 2], "end"]
+
+
+@pytest.mark.asyncio
+async def test_iter_records_invalid_line():
+    records = await _collect(iter_records(_chunks(b'{"a": 1}\nnope\n{"b": 2}\n')))
+    assert records[0] == {"a": 1}
+    assert isinstance(records[1], InvalidRecord)
+    assert records[2] == {"b": 2}
+
+
+@pytest.mark.asyncio
+async def test_process_records_bounded():
+    running = 0
+    max_running = 0
+
+    async def handle(record):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+        if record == 3:
+            raise ValueError("bad record")
+        return {"status": "ok", "record": record}
+
+    async def records():
+        for i in range(10):
+            yield i
+        yield InvalidRecord("Invalid JSON")
+
+    results = await process_records(records(), handle, 2)
+
+    assert max_running == 2
+    assert len(results) == 11
+    assert results[0] == {"status": "ok", "record": 0}
+    assert results[3] == {"status": "error", "error": "bad record"}
+    assert results[10] == {"status": "error", "error": "Invalid JSON"}
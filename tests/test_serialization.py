@@ -0,0 +1,22 @@
+import json
+from datetime import date
+
+from quart import Quart
+
+from oes.webhooks.serialization import ORJSONProvider
+
+
+def test_orjson_provider():
+    app = Quart(__name__)
+    provider = ORJSONProvider(app)
+
+    data = {"a": [1, 2.5, None], "b": "ünïcödé", 1: date(2023, 1, 2)}
+    dumped = provider.dumps(data)
+
+    assert json.loads(dumped) == {
+        "a": [1, 2.5, None],
+        "b": "ünïcödé",
+        "1": "Mon, 02 Jan 2023 00:00:00 GMT",
+    }
+    assert provider.loads(dumped.encode()) == json.loads(dumped)
+    assert json.loads(provider.dumps(data, indent=4)) == json.loads(dumped)
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+from quart import Quart
+
+from oes.webhooks.app import (
+    STARTUP_OPTIONS_ENV,
+    StartupOptions,
+    _load_startup_options,
+    _save_startup_options,
+)
+from oes.webhooks.startup import StartupProfile, profile_serving
+
+
+def test_startup_profile_report():
+    profile = StartupProfile("Test")
+    with profile.step("first"):
+        pass
+    with profile.step("second"):
+        pass
+
+    report = profile.report()
+    assert report.startswith("Test startup")
+    assert [name for name, _ in profile.steps] == ["first", "second"]
+    assert "total" in report
+
+
+@pytest.mark.asyncio
+async def test_profile_serving():
+    app = Quart(__name__)
+    calls = []
+
+    @app.before_serving
+    async def start_thing():
+        calls.append("start")
+
+    profile = StartupProfile("Test")
+    profile_serving(app, profile)
+
+    await app.startup()
+    await app.shutdown()
+    assert calls == ["start"]
+    assert [name for name, _ in profile.steps] == [
+        "start tests.test_startup.start_thing"
+    ]
+
+
+def test_startup_options_round_trip(monkeypatch, tmp_path):
+    # restored after the test
+    monkeypatch.setenv(STARTUP_OPTIONS_ENV, "")
+    options = StartupOptions(tmp_path / "config.yml", debug=True)
+    _save_startup_options(options)
+
+    assert _load_startup_options() == options
+    assert str(tmp_path) in os.environ[STARTUP_OPTIONS_ENV]